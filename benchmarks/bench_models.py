@@ -0,0 +1,107 @@
+"""Microbenchmark of the data information built from the index rows
+
+URI and DataInfo are slotted dataclasses that only check the types of their
+fields. The `URI` and `DataInfo` cases compare them with the pydantic models
+they replaced, which validated every field.
+
+A DataInfoSet element also reuses the Location of its uuid, interned once per
+set, and looks up its storage type from the int8 code kept by the set. The
+`Row` case compares it with interning the Location and calling the enum for
+each row.
+
+usage (from a directory with a config.yml):
+python benchmarks/bench_models.py
+"""
+import time
+
+from pydantic import BaseModel, ConfigDict
+
+from scixtracer.models import StorageTypes
+from scixtracer.models import URI
+from scixtracer.models import Dataset
+from scixtracer.models import Location
+from scixtracer.models import DataInfo
+from scixtracer.models import DataInfoSet
+
+
+class PydanticURI(BaseModel):
+    """URI as a pydantic model"""
+    model_config = ConfigDict(frozen=True)
+
+    value: str
+
+
+class PydanticDataInfo(BaseModel):
+    """DataInfo as a pydantic model"""
+    location: Location
+    storage_type: StorageTypes
+    uri: PydanticURI
+    metadata_uri: PydanticURI | None = None
+
+
+def objects_per_second(build, count: int = 100000, repeat: int = 5
+                       ) -> float:
+    """Measure how many objects a builder creates per second
+
+    :param build: Function building one object from an index,
+    :param count: Number of objects to build,
+    :param repeat: Number of measures, the best one is kept,
+    :return: The number of objects per second
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(count):
+            build(i)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+def main():
+    """Print the construction rate before and after for each case"""
+    dataset = Dataset.intern("benchmark", "/workspace/benchmark")
+    location = Location.intern(dataset, 0)
+    rows = DataInfoSet(dataset,
+                       [i % 100 for i in range(100000)],
+                       ["Array"] * 100000,
+                       [f"/data/{i}.tif" for i in range(100000)],
+                       [f"/meta/{i}.json" for i in range(100000)])
+
+    cases = {
+        "URI": (
+            lambda i: PydanticURI(value="/data/0.tif"),
+            lambda i: URI(value="/data/0.tif")
+        ),
+        "DataInfo": (
+            lambda i: PydanticDataInfo(
+                location=location,
+                storage_type=StorageTypes.ARRAY,
+                uri=PydanticURI(value="/data/0.tif"),
+                metadata_uri=PydanticURI(value="/meta/0.json")),
+            lambda i: DataInfo(
+                location=location,
+                storage_type=StorageTypes.ARRAY,
+                uri=URI(value="/data/0.tif"),
+                metadata_uri=URI(value="/meta/0.json"))
+        ),
+        "Row": (
+            lambda i: DataInfo(
+                location=Location.intern(dataset, i % 100),
+                storage_type=StorageTypes("Array"),
+                uri=URI(value=f"/data/{i}.tif"),
+                metadata_uri=URI(value=f"/meta/{i}.json")),
+            lambda i: rows[i]
+        ),
+    }
+    print(f"{'model':<10}{'before (obj/s)':>20}{'after (obj/s)':>20}"
+          f"{'speedup':>10}")
+    for name, (before_build, after_build) in cases.items():
+        before = objects_per_second(before_build)
+        after = objects_per_second(after_build)
+        print(f"{name:<10}{before:>20,.0f}{after:>20,.0f}"
+              f"{after / before:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Makespan of the process runner on items with uneven runtimes
+
+The items sleep, so the benchmark measures the scheduling and not the CPU.
+Most items are short and a few are 50 times longer, at random positions as
+with the dense images of a plate.
+
+usage (from a directory with a config.yml):
+python benchmarks/bench_runner.py
+"""
+import random
+import statistics
+import time
+
+from scixtracer.models import BatchItem
+from scixtracer.models import Batch
+from scixtracer.runner_process import SxRunnerProcess
+
+
+def sleep_item(duration: float) -> float:
+    """Item of the benchmark batch"""
+    time.sleep(duration)
+    return duration
+
+
+def make_batch(count: int, short: float, long: float) -> Batch:
+    """Build a batch where one item in 20 is long
+
+    :param count: Number of items,
+    :param short: Duration of the short items,
+    :param long: Duration of the long items,
+    :return: The batch
+    """
+    durations = [long if i % 20 == 0 else short for i in range(count)]
+    random.Random(0).shuffle(durations)
+    batch = Batch()
+    for duration in durations:
+        batch.append(BatchItem(sleep_item, [duration], []))
+    return batch
+
+
+def run_time(options: dict[str, any], batch: Batch, workers: int) -> float:
+    """Run a batch with the process runner
+
+    :param options: Chunk options of the runner,
+    :param batch: Batch to run,
+    :param workers: Number of worker processes,
+    :return: The makespan in seconds
+    """
+    runner = SxRunnerProcess()
+    runner.connect(workers=workers, **options)
+    start = time.perf_counter()
+    runner.run([batch])
+    return time.perf_counter() - start
+
+
+def main():
+    """Print the makespan without and with runtime-based chunk sizes
+
+    The makespan includes the start of the worker processes, printed first.
+    Each value is the median of a few runs.
+    """
+    workers = 4
+    repeat = 3
+    batch = make_batch(400, 0.02, 1.0)
+    ideal = sum(item.inputs[0] for item in batch) / workers
+    cases = {
+        "large chunks": {"chunk_size": len(batch) // workers,
+                         "chunk_time": float("inf")},
+        "adaptive": {"chunk_size": 32, "chunk_time": 0.2},
+    }
+    print(f"{len(batch)} items, {workers} workers, "
+          f"ideal makespan {ideal:.2f} s")
+    startup = statistics.median(
+        run_time({}, make_batch(workers, 0, 0), workers)
+        for _ in range(repeat))
+    print(f"{'start':<16}{startup:>8.2f} s")
+    for name, options in cases.items():
+        makespan = statistics.median(run_time(options, batch, workers)
+                                     for _ in range(repeat))
+        print(f"{name:<16}{makespan:>8.2f} s"
+              f"{makespan - startup:>8.2f} s without start")
+
+
+if __name__ == "__main__":
+    main()
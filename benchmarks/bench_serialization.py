@@ -0,0 +1,101 @@
+"""Round-trip benchmark of the batch binary encoding against pickle
+
+usage (from a directory with a config.yml):
+python benchmarks/bench_serialization.py
+"""
+import pickle
+import time
+
+import numpy as np
+
+from scixtracer.models import StorageTypes
+from scixtracer.models import URI
+from scixtracer.models import Dataset
+from scixtracer.models import Location
+from scixtracer.models import DataInfo
+from scixtracer.models import BatchItem
+from scixtracer.models import Batch
+
+
+def denoise(image: np.ndarray, sigma: float) -> np.ndarray:
+    """Function referenced by the benchmark batch"""
+    return image * sigma
+
+
+def make_batch(count: int) -> Batch:
+    """Build a batch of items with one data input and two outputs
+
+    :param count: Number of items,
+    :return: The batch
+    """
+    dataset = Dataset.intern("benchmark", "/workspace/benchmark")
+    batch = Batch()
+    for i in range(count):
+        location = Location.intern(dataset, i)
+        batch.append(BatchItem(
+            denoise,
+            [DataInfo(location=location,
+                      storage_type=StorageTypes.ARRAY,
+                      uri=URI(value=f"/workspace/benchmark/raw_{i}.tif"),
+                      metadata_uri=URI(
+                          value=f"/workspace/benchmark/raw_{i}.json")),
+             1.5],
+            [DataInfo(location=location,
+                      storage_type=StorageTypes.ARRAY,
+                      uri=URI(value=f"/workspace/benchmark/out_{i}.tif")),
+             DataInfo(location=location,
+                      storage_type=StorageTypes.VALUE,
+                      uri=URI(value=f"/workspace/benchmark/count_{i}.json"))]
+        ))
+    return batch
+
+
+def best_time(func, repeat: int = 5) -> float:
+    """Best duration of a function over several runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """Print the size and round-trip durations of both encodings"""
+    batch = make_batch(20000)
+    message = batch.to_bytes()
+    pickled = pickle.dumps(batch.items, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode_all():
+        for item in Batch.from_bytes(message):
+            _ = item.inputs
+
+    cases = {
+        "pickle": (
+            lambda: pickle.dumps(batch.items,
+                                 protocol=pickle.HIGHEST_PROTOCOL),
+            lambda: pickle.loads(pickled),
+            None,
+            len(pickled)
+        ),
+        "binary": (
+            batch.to_bytes,
+            lambda: Batch.from_bytes(message),
+            decode_all,
+            len(message)
+        ),
+    }
+    print(f"{len(batch)} items")
+    print(f"{'format':<8}{'size (MB)':>12}{'encode (ms)':>14}"
+          f"{'decode (ms)':>14}{'decode all (ms)':>18}")
+    for name, (encode, decode, full_decode, size) in cases.items():
+        full = "" if full_decode is None else \
+            f"{best_time(full_decode) * 1000:.0f}"
+        print(f"{name:<8}{size / 1e6:>12.1f}"
+              f"{best_time(encode) * 1000:>14.0f}"
+              f"{best_time(decode) * 1000:>14.0f}{full:>18}")
+
+
+if __name__ == "__main__":
+    main()
@@ -19,29 +19,39 @@ from .api import get_description
 from .api import new_location
 from .api import annotate_location
 from .api import annotate_data
+from .api import annotate_locations_many
+from .api import annotate_data_many
 from .api import new_data
+from .api import new_data_many
 from .api import read_data
 from .api import write_data
 from .api import new_data_index
 from .api import get_data_info
 from .api import query_data
 from .api import query_data_at
+from .api import count_data
 from .api import query_location
 from .api import query_data_annotation
 from .api import query_location_annotation
 from .api import view_locations
 from .api import view_data
+from .api import iter_view_locations
+from .api import iter_view_data
 from .api import delete
 from .api import delete_query
+from .api import export_index
+from .api import import_index
 
 from .api_runner import call
 from .api_runner import run
+from .api_runner import resume
 
 from .models import StorageTypes
 from .models import URI, uri
 from .models import Dataset
 from .models import Location
 from .models import DataInfo
+from .models import DataInfoSet
 from .models import DataInstance
 from .models import Data
 from .models import DataQueryType
@@ -51,7 +61,10 @@ from .models import GROUP_SET
 from .models import Job
 from .models import job
 from .models import BatchItem
+from .models import FusedItem
 from .models import Batch
+from .models import ItemFailure
+from .models import PipelineStats
 
 
 __version__ = importlib.metadata.version("scixtracer")
@@ -67,24 +80,33 @@ __all__ = [
     "new_location",
     "annotate_location",
     "annotate_data",
+    "annotate_locations_many",
+    "annotate_data_many",
     "new_data_index",
     "new_data",
+    "new_data_many",
     "read_data",
     "write_data",
     "DataQueryType",
     "get_data_info",
     "query_data",
     "query_data_at",
+    "count_data",
     "query_location",
     "query_data_annotation",
     "query_location_annotation",
     "view_locations",
     "view_data",
+    "iter_view_locations",
+    "iter_view_data",
     "delete",
     "delete_query",
+    "export_index",
+    "import_index",
 
     "call",
     "run",
+    "resume",
 
     "StorageTypes",
     "URI",
@@ -92,6 +114,7 @@ __all__ = [
     "Dataset",
     "Location",
     "DataInfo",
+    "DataInfoSet",
     "DataInstance",
     "Data",
     "SINGLE",
@@ -100,5 +123,8 @@ __all__ = [
     "Job",
     "job",
     "BatchItem",
-    "Batch"
+    "FusedItem",
+    "Batch",
+    "ItemFailure",
+    "PipelineStats"
 ]
@@ -1,4 +1,9 @@
 """Definition of the main API methods"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+from pathlib import Path
+import os
+
 import pandas as pd
 
 from .models import StorageTypes
@@ -6,6 +11,7 @@ from .models import URI
 from .models import Dataset
 from .models import Location
 from .models import DataInfo
+from .models import DataInfoSet
 from .models import Data
 from .models import DataInstance
 from .models import Metadata
@@ -13,10 +19,13 @@ from .models import DataQueryType
 
 from .logger import logger
 from .config import config, config_file
-from .factory import Factory
+from .factory import ConnectedPlugin
 from .index import SxIndex
+from .index import filtered_view
+from .index_sqlite import SxIndexSQLite
 from .storage import SxStorage
 from .metadata import SxMetadata
+from .snapshot import IndexSnapshot
 
 
 # Initialize the config and the backend plugins
@@ -25,20 +34,9 @@ print('API cfile=', cfile)
 logger().set_prefix("SciXtracer")
 logger().info(f"use config file: {cfile}")
 config(cfile)  # init singleton
-__index: SxIndex = Factory(
-    "sxt_", "index").get(config().value("index", "name"))()
-if __index is not None:
-    __index.connect(**config().filtered_section("index"))
-
-__storage: SxStorage = Factory(
-    "sxt_", "storage").get(config().value("storage", "name"))()
-if __storage is not None:
-    __storage.connect(**config().filtered_section("storage"))
-
-__metadata: SxMetadata = Factory(
-    "sxt_", "metadata").get(config().value("metadata", "name"))()
-if __metadata is not None:
-    __metadata.connect(**config().filtered_section("metadata"))
+__index: SxIndex = ConnectedPlugin("index", {"sqlite": SxIndexSQLite})
+__storage: SxStorage = ConnectedPlugin("storage")
+__metadata: SxMetadata = ConnectedPlugin("metadata")
 
 
 def datasets() -> pd.DataFrame:
@@ -122,6 +120,31 @@ def annotate_data(data_info: DataInfo,
     return __index.annotate_data(data_info, key, value)
 
 
+def annotate_locations_many(locations: list[Location],
+                            annotations: dict[str, any] | pd.DataFrame):
+    """Annotate many locations in one index operation
+
+    :param locations: Locations to annotate,
+    :param annotations: Either a dictionary mapping each key to a value shared
+                        by all the locations or to a list with one value per
+                        location, or a table with one row per location and one
+                        column per key
+    """
+    return __index.annotate_locations_many(locations, annotations)
+
+
+def annotate_data_many(data_info: list[DataInfo] | DataInfoSet,
+                       annotations: dict[str, any] | pd.DataFrame):
+    """Annotate many data in one index operation
+
+    :param data_info: Information of the data to annotate,
+    :param annotations: Either a dictionary mapping each key to a value shared
+                        by all the data or to a list with one value per data,
+                        or a table with one row per data and one column per key
+    """
+    return __index.annotate_data_many(data_info, annotations)
+
+
 def new_data_index(location: Dataset | Location,
                    uri: URI,
                    storage_type: StorageTypes,
@@ -150,15 +173,15 @@ def __get_location(location: Dataset | Location,
     return location
 
 
-def __new_empty_data_uri(data: StorageTypes, loc: Location) -> URI:
+def __new_empty_data_uri(data: StorageTypes, dataset: Dataset) -> URI:
     if data == StorageTypes.ARRAY:
-        data_uri = __storage.create_tensor(loc.dataset, shape=(1, 1))
+        data_uri = __storage.create_tensor(dataset, shape=(1, 1))
     elif data == StorageTypes.TABLE:
-        data_uri = __storage.create_table(loc.dataset, None)
+        data_uri = __storage.create_table(dataset, None)
     elif data == StorageTypes.VALUE:
-        data_uri = __storage.create_value(loc.dataset, None)
+        data_uri = __storage.create_value(dataset, None)
     elif data == StorageTypes.LABEL:
-        data_uri = __storage.create_label(loc.dataset, "")
+        data_uri = __storage.create_label(dataset, "")
     else:
         raise ValueError(f'new_data: data type not recognized '
                          f'for {type(data)}')
@@ -166,19 +189,19 @@ def __new_empty_data_uri(data: StorageTypes, loc: Location) -> URI:
 
 
 def __new_instance_data_uri(data: DataInstance,
-                            loc: Location
+                            dataset: Dataset
                             ) -> [URI, StorageTypes]:
     if isinstance(data, __storage.array_types()):
-        data_uri = __storage.create_tensor(loc.dataset, data)
+        data_uri = __storage.create_tensor(dataset, data)
         storage_type = StorageTypes.ARRAY
     elif isinstance(data, __storage.table_types()):
-        data_uri = __storage.create_table(loc.dataset, data)
+        data_uri = __storage.create_table(dataset, data)
         storage_type = StorageTypes.TABLE
     elif isinstance(data, __storage.value_types()):
-        data_uri = __storage.create_value(loc.dataset, data)
+        data_uri = __storage.create_value(dataset, data)
         storage_type = StorageTypes.VALUE
     elif isinstance(data, __storage.label_types()):
-        data_uri = __storage.create_label(loc.dataset, data)
+        data_uri = __storage.create_label(dataset, data)
         storage_type = StorageTypes.LABEL
     else:
         raise ValueError(f'new_data: data type not recognized '
@@ -207,10 +230,11 @@ def new_data(location: Dataset | Location,
     # Create data storage
     if isinstance(data, StorageTypes):
         __storage_type = data
-        data_uri = __new_empty_data_uri(data, loc)
+        data_uri = __new_empty_data_uri(data, loc.dataset)
 
     else:
-        data_uri, __storage_type = __new_instance_data_uri(data, loc)
+        data_uri, __storage_type = __new_instance_data_uri(data,
+                                                           loc.dataset)
 
     # create metadata
     metadata_uri = None
@@ -224,6 +248,99 @@ def new_data(location: Dataset | Location,
     return data_info
 
 
+def __write_data(dataset: Dataset,
+                 data: DataInstance,
+                 metadata: dict[str, any] = None
+                 ) -> tuple[URI, StorageTypes, URI | None]:
+    """Write a data and its metadata, or neither of them
+
+    :param dataset: Dataset of the data,
+    :param data: Data content, or storage type of an empty data,
+    :param metadata: Metadata attached to the data,
+    :return: The URI and storage type of the data, and its metadata URI
+    """
+    if isinstance(data, StorageTypes):
+        storage_type = data
+        data_uri = __new_empty_data_uri(data, dataset)
+    else:
+        data_uri, storage_type = __new_instance_data_uri(data, dataset)
+    try:
+        metadata_uri = None if metadata is None \
+            else __metadata.create(dataset, metadata)
+    except Exception:
+        __storage.delete(storage_type, data_uri)
+        raise
+    return data_uri, storage_type, metadata_uri
+
+
+def new_data_many(location: Dataset | Location,
+                  data: list[DataInstance],
+                  *,
+                  loc_annotate: dict[str, any] = None,
+                  data_annotate: list[dict[str, any] | None] = None,
+                  metadata: list[dict[str, any] | None] = None
+                  ) -> list[DataInfo]:
+    """Create many data at one location, all or none
+
+    The data are written to the storage, concurrently if the storage is
+    `thread_safe`, then the location and the data are indexed in one
+    transaction. If a write or the transaction fails, the data and metadata
+    already written are deleted and the error is raised.
+
+    :param location: Location to write, or dataset to create it in,
+    :param data: Content of each data,
+    :param loc_annotate: Annotation attached to the location created in a
+                         dataset,
+    :param data_annotate: Annotation attached to each data,
+    :param metadata: Metadata attached to each data,
+    :return: The information of the created data,
+    :raise ValueError: If the annotations or metadata are not given for each
+                       data
+    """
+    dataset = location if isinstance(location, Dataset) \
+        else location.dataset
+    data_annotate = data_annotate or [None] * len(data)
+    metadata = metadata or [None] * len(data)
+    if len(data_annotate) != len(data) or len(metadata) != len(data):
+        raise ValueError("new_data_many: one annotation and one metadata "
+                         "are expected per data")
+    written = []
+    errors = []
+    if __storage.thread_safe and len(data) > 1:
+        with ThreadPoolExecutor(min(len(data), os.cpu_count() or 1),
+                                thread_name_prefix="sxt-data") as pool:
+            futures = [pool.submit(__write_data, dataset, value, content)
+                       for value, content in zip(data, metadata)]
+        for future in futures:
+            if future.exception() is None:
+                written.append(future.result())
+            else:
+                errors.append(future.exception())
+    else:
+        for value, content in zip(data, metadata):
+            try:
+                written.append(__write_data(dataset, value, content))
+            except Exception as error:  # pylint: disable=W0718
+                errors.append(error)
+                break
+    if not errors:
+        try:
+            return __index.create_data_many(
+                location,
+                [data_uri for data_uri, _, _ in written],
+                [storage_type for _, storage_type, _ in written],
+                data_annotate,
+                [metadata_uri for _, _, metadata_uri in written],
+                loc_annotate)
+        except Exception as error:  # pylint: disable=W0718
+            errors.append(error)
+    for data_uri, storage_type, metadata_uri in written:
+        if metadata_uri is not None:
+            __metadata.delete(metadata_uri)
+        __storage.delete(storage_type, data_uri)
+    raise errors[0]
+
+
 def read_data(data_info: DataInfo
               ) -> DataInstance:
     """Read a tensor from the dataset storage
@@ -282,28 +399,30 @@ def get_metadata(data_info: DataInfo) -> Metadata:
 class DataIter:
     """Iterator on data info for data loading
 
+    The value and the metadata of each data are read on first access.
+
     :param data_info: Information of data to load
     """
-    def __init__(self, data_info: list[DataInfo] | list[list[DataInfo]]):
+    def __init__(self,
+                 data_info: list[DataInfo] | list[list[DataInfo]] | DataInfoSet
+                 ):
         self.__data_info = data_info
 
     def __len__(self):
         return len(self.__data_info)
 
+    @staticmethod
+    def __data(info: DataInfo) -> Data:
+        """Create the lazy container of one data"""
+        return Data(info=info,
+                    value_loader=read_data,
+                    metadata_loader=get_metadata)
+
     def __getitem__(self, idx) -> Data | list[Data]:
         info_s = self.__data_info[idx]
         if isinstance(info_s, DataInfo):
-            return Data(info=info_s,
-                        value=read_data(info_s),
-                        metadata=get_metadata(info_s))
-        out_data = []
-        for info in info_s:
-            out_data.append(Data(info=info,
-                                 value=read_data(info),
-                                 metadata=get_metadata(info)
-                                 )
-                            )
-        return out_data
+            return self.__data(info_s)
+        return [self.__data(info) for info in info_s]
 
 
 def get_data_info(dataset: Dataset, data_uri: URI) -> DataInfo | None:
@@ -316,11 +435,13 @@ def get_data_info(dataset: Dataset, data_uri: URI) -> DataInfo | None:
     return __index.get_data_info(dataset, data_uri)
 
 
-def query_data_at(dataset: Dataset, locations: list[Location]) -> list[DataInfo]:
+def query_data_at(dataset: Dataset,
+                  locations: list[Location] | DataInfoSet
+                  ) -> list[DataInfo] | DataInfoSet:
     """Get all the data at given locations
 
     :param dataset: Dataset to query,
-    :param locations: Locations to query,
+    :param locations: Locations to query, or data whose locations are queried,
     :return: The list of data information at these locations
     """
     return __index.query_data_at(dataset, locations)
@@ -330,7 +451,8 @@ def query_data(dataset: Dataset,
                annotations: dict[str, any] | list[dict[str, any]],
                query_type: DataQueryType = DataQueryType.SINGLE,
                info_only: bool = True
-               ) -> list[DataInfo] | list[list[DataInfo]] | DataIter:
+               ) -> list[DataInfo] | DataInfoSet | list[list[DataInfo]] | \
+        list[DataInfoSet] | DataIter:
     """Query data in a dataset
 
     :param dataset: Dataset to query,
@@ -375,6 +497,18 @@ def delete_query(dataset: Dataset, annotations: dict[str, any]):
         delete(data_info)
 
 
+def count_data(dataset: Dataset,
+               annotations: dict[str, any] = None
+               ) -> int:
+    """Count the data in a dataset without loading the data information
+
+    :param dataset: Dataset to query,
+    :param annotations: Count data that have the annotations,
+    :return: The number of matching data
+    """
+    return __index.count_data(dataset, annotations)
+
+
 def query_location(dataset: Dataset,
                    annotations: dict[str, any] = None,
                    ) -> list[Location]:
@@ -405,23 +539,94 @@ def query_location_annotation(dataset: Dataset) -> dict[str, list[any]]:
     return __index.query_location_annotation(dataset)
 
 
-def view_locations(dataset: Dataset
+def view_locations(dataset: Dataset,
+                   annotations: dict[str, any] = None,
+                   columns: list[str] = None
                    ) -> pd.DataFrame:
     """Create a table to visualize the dataset locations structure
 
     :param dataset: Dataset to visualize
+    :param annotations: Keep only the locations that have the annotations,
+    :param columns: Columns to build (`location` and annotation keys), all of
+                    them if None,
     :return: The data view as a table
     """
-    return __index.view_locations(dataset)
+    return filtered_view(__index.view_locations, dataset,
+                         annotations=annotations, columns=columns)
 
 
 def view_data(dataset: Dataset,
-              locations: list[Location] = None,
+              locations: list[Location] | DataInfoSet = None,
+              annotations: dict[str, any] = None,
+              columns: list[str] = None
               ) -> pd.DataFrame:
     """Create a table to visualize the dataset data structure
 
     :param dataset: Dataset to visualize
-    :param locations: Locations to filter
+    :param locations: Locations to filter, or data whose locations are kept,
+    :param annotations: Keep only the data that have the annotations,
+    :param columns: Columns to build (`uri`, `location`, `storage_type`,
+                    `metadata_uri` and annotation keys), all of them if None,
     :return: The data view as a table
     """
-    return __index.view_data(dataset, locations)
+    return filtered_view(__index.view_data, dataset, locations,
+                         annotations=annotations, columns=columns)
+
+
+def iter_view_locations(dataset: Dataset,
+                        annotations: dict[str, any] = None,
+                        columns: list[str] = None,
+                        chunk_size: int = 100000
+                        ) -> Iterator[pd.DataFrame]:
+    """Lazily build the locations view by chunks of rows
+
+    :param dataset: Dataset to visualize
+    :param annotations: Keep only the locations that have the annotations,
+    :param columns: Columns to build, all of them if None,
+    :param chunk_size: Maximum number of rows per chunk,
+    :return: An iterator on the view chunks
+    """
+    return __index.iter_view_locations(dataset, annotations=annotations,
+                                       columns=columns, chunk_size=chunk_size)
+
+
+def iter_view_data(dataset: Dataset,
+                   locations: list[Location] | DataInfoSet = None,
+                   annotations: dict[str, any] = None,
+                   columns: list[str] = None,
+                   chunk_size: int = 100000
+                   ) -> Iterator[pd.DataFrame]:
+    """Lazily build the data view by chunks of rows
+
+    :param dataset: Dataset to visualize
+    :param locations: Locations to filter, or data whose locations are kept,
+    :param annotations: Keep only the data that have the annotations,
+    :param columns: Columns to build, all of them if None,
+    :param chunk_size: Maximum number of rows per chunk,
+    :return: An iterator on the view chunks
+    """
+    return __index.iter_view_data(dataset, locations, annotations=annotations,
+                                  columns=columns, chunk_size=chunk_size)
+
+
+def export_index(dataset: Dataset, path: Path | str):
+    """Dump the complete index of a dataset as compressed columnar files
+
+    The snapshot directory contains the dataset description and the
+    `locations`, `location_annotations`, `data` and `data_annotations`
+    parquet tables. The SQLite index writes the dataset URI relative to its
+    workspace, so the snapshot can be imported in another workspace.
+
+    :param dataset: Dataset to export,
+    :param path: Destination directory
+    """
+    __index.snapshot(dataset).write(path)
+
+
+def import_index(path: Path | str) -> Dataset:
+    """Load a dataset index written with export_index
+
+    :param path: Snapshot directory,
+    :return: The imported dataset
+    """
+    return __index.load_snapshot(IndexSnapshot.read(path))
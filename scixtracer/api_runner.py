@@ -1,9 +1,20 @@
 """Implements runner utilities"""
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from typing import Callable
+from typing import Iterable
+from typing import Iterator
 from datetime import datetime
+from pathlib import Path
+import contextlib
 import functools
+import os
+import pickle
+import threading
 
 from .models import DataInfo
+from .models import DataInfoSet
 from .models import Job
 from .models import StorageTypes
 from .models import Location
@@ -11,23 +22,43 @@ from .models import Dataset
 from .models import GROUP_SET
 from .models import BatchItem
 from .models import Batch
+from .models import FusedItem
+from .models import ItemFailure
 
 from .api import read_data
 from .api import new_data
+from .api import new_data_many
 from .api import new_location
 from .api import query_data
+from .api import annotate_data_many
+from .api import delete
 from .api import __storage
 
+from .journal import RunJournal
 from .runner import SxRunner
-from .factory import Factory
+from .runner import item_path
+from .runner_process import SxRunnerProcess
+from .runner_remote import SxRunnerRemote
+from .runner_thread import SxRunnerThread
+from .scheduler import DependencyGraph
+from .scheduler import fuse_batches
+from .cache import FINGERPRINT_KEY
+from .cache import RunVersions
+from .cache import call_fingerprint
+from .cache import output_fingerprint
+from .factory import ConnectedPlugin
 from .config import config
+from .logger import logger
 
 
-__runner: SxRunner = Factory(
-    "sxt_", "runner").get(config().value("runner", "name"))()
-if __runner is not None:
-    __runner.storage = __storage
-    __runner.connect(**config().filtered_section("runner"))
+__runner: SxRunner = ConnectedPlugin(
+    "runner", {"process": SxRunnerProcess,
+               "remote": SxRunnerRemote,
+               "thread": SxRunnerThread},
+    lambda runner: setattr(runner, "storage", __storage))
+
+
+__END = object()
 
 
 def __wrapper_load(*args):
@@ -44,7 +75,8 @@ def __wrapper_load(*args):
                     out_new_location = True
             ref_data = value
 
-        elif isinstance(value, list) and isinstance(value[0], DataInfo):
+        elif isinstance(value, DataInfoSet) or \
+                (isinstance(value, list) and isinstance(value[0], DataInfo)):
             metadata_list_inputs = []
             out_new_location = True
             ref_data = value[0]
@@ -60,50 +92,190 @@ def __wrapper_load(*args):
     return arg_vals, out_new_location, ref_data, metadata_inputs
 
 
-def call(func: Callable):
-    """Decorator to facilitate the data processing function call"""
+def __reference_dataset(args: tuple) -> Dataset:
+    """Get the dataset of the first data in call arguments"""
+    for value in args:
+        if isinstance(value, DataInfo):
+            return value.dataset
+        if isinstance(value, DataInfoSet) or \
+                (isinstance(value, list) and isinstance(value[0], DataInfo)):
+            return value[0].dataset
+    raise ValueError("The call arguments do not contain any data")
 
-    @functools.wraps(func)
-    def wrapper_call(annotations: list[dict[str, any]],
-                     *args):
-        # Before
+
+def __cached_outputs(dataset: Dataset, fingerprint: str | None, count: int
+                     ) -> list[DataInfo] | None:
+    """Find the outputs of a previous call with the same fingerprint
+
+    :param dataset: Dataset of the call,
+    :param fingerprint: Fingerprint of the call, None if it is not cached,
+    :param count: Number of outputs of the call,
+    :return: The outputs, or None if one of them is missing
+    """
+    if fingerprint is None:
+        return None
+    outputs = []
+    for i in range(count):
+        found = query_data(dataset, {
+            FINGERPRINT_KEY: output_fingerprint(fingerprint, i)})
+        if len(found) == 0:
+            return None
+        outputs.append(found[0])
+    return outputs
+
+
+def __call_once(func: Callable,
+                cache: bool,
+                annotations: list[dict[str, any]] | dict[str, any],
+                args: tuple,
+                lock: threading.Lock = None) -> list[DataInfo]:
+    """Load the inputs of a call, run the function and record its outputs
+
+    :param func: Data processing function,
+    :param cache: Skip the call if it was already made,
+    :param annotations: Annotations of the outputs,
+    :param args: Arguments of the function, data information or values,
+    :param lock: Lock serializing the backend calls of concurrent calls,
+                 None for a single call,
+    :return: The information of the outputs
+    """
+    backends = lock if lock is not None else contextlib.nullcontext()
+    reads = backends if not __storage.thread_safe \
+        else contextlib.nullcontext()
+
+    # Cache
+    annotations_list = annotations if isinstance(annotations, list) \
+        else [annotations]
+    fingerprint = None
+    if cache:
+        with backends:
+            fingerprint = call_fingerprint(func, args, annotations_list,
+                                           __storage)
+            cached = __cached_outputs(__reference_dataset(args), fingerprint,
+                                      len(annotations_list))
+        if cached is not None:
+            return cached
+
+    # Before
+    with reads:
         arg_vals, out_new_location, ref_data, metadata_inputs = \
             __wrapper_load(*args)
 
-        # Call
-        outputs = func(*arg_vals)
-
-        # After
-        if out_new_location:
-            location = new_location(ref_data.location.dataset,
-                                    annotations={"origin": func.__name__})
-        else:
-            location = ref_data.location
-        if isinstance(outputs, (list, tuple)):
-            for i, value in enumerate(outputs):
-                ann = annotations[i]
-                new_data(location,
-                         value,
-                         data_annotate=ann,
-                         metadata={
-                             "func": func.__name__,
-                             "inputs": metadata_inputs,
-                             "output_id": i
-                         })
-        else:
-            if isinstance(annotations, list):
-                ann = annotations[0]
-            else:
-                ann = annotations
-            new_data(location,
-                     outputs,
-                     data_annotate=ann,
-                     metadata={
-                         "func": func.__name__,
-                         "inputs": metadata_inputs,
-                         "output_id": 0
-                     })
+    # Call
+    outputs = func(*arg_vals)
+
+    # After
+    if not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+    if fingerprint is not None:
+        annotations_list = [
+            dict(ann, **{FINGERPRINT_KEY: output_fingerprint(fingerprint, i)})
+            for i, ann in enumerate(annotations_list)]
+    with backends:
+        return new_data_many(
+            ref_data.location.dataset if out_new_location
+            else ref_data.location,
+            list(outputs),
+            loc_annotate={"origin": func.__name__},
+            data_annotate=annotations_list[:len(outputs)],
+            metadata=[{"func": func.__name__,
+                       "inputs": metadata_inputs,
+                       "output_id": i} for i in range(len(outputs))])
+
+
+def __map_args(query_result: any) -> tuple:
+    """Get the call arguments of one element of query results"""
+    if isinstance(query_result, (list, tuple)):
+        return tuple(query_result)
+    return (query_result,)
+
+
+def call(func: Callable, cache: bool = False):
+    """Decorator to facilitate the data processing function call
+
+    The wrapped function is called with the annotations of the outputs
+    followed by the function arguments, and returns the information of the
+    outputs. Its `map` method calls the function on each element of query
+    results in a pool of threads:
+
+    .. code-block:: python
+
+        raws = sx.query_data(dataset, {"image": "raw"})
+        for raw, outputs, error in sx.call(wiener_filter).map(
+                raws, 2, 0.1, annotations=[{"image": "decon"}], workers=8):
+            ...
+
+    :param func: Data processing function,
+    :param cache: Skip the call if the same function was already called with
+                  the same inputs and output annotations
+    """
 
+    @functools.wraps(func)
+    def wrapper_call(annotations: list[dict[str, any]],
+                     *args) -> list[DataInfo]:
+        return __call_once(func, cache, annotations, args)
+
+    def map_call(query_results: Iterable,
+                 *params,
+                 annotations: list[dict[str, any]],
+                 workers: int = None,
+                 ordered: bool = False
+                 ) -> Iterator[tuple[any, list[DataInfo] | None,
+                                     Exception | None]]:
+        """Call the function on each element of query results
+
+        The functions run concurrently, the reads and writes of the backends
+        are serialized unless the storage is `thread_safe`. Each call records
+        its provenance as a single call does.
+
+        :param query_results: Data information, or lists of data information
+                              of a LOC_SET query, of each call,
+        :param params: Arguments following the data in each call,
+        :param annotations: Annotations of the outputs,
+        :param workers: Number of threads, default: number of CPUs,
+        :param ordered: Yield the calls in the order of the query results
+                        instead of as soon as they complete,
+        :return: The query result, the output information and the error of
+                 each call, the error or the outputs being None
+        """
+        lock = threading.Lock()
+        workers = max(1, workers or os.cpu_count() or 1)
+        results = iter(query_results)
+        running = {}
+
+        def submit(pool: ThreadPoolExecutor) -> bool:
+            query_result = next(results, __END)
+            if query_result is __END:
+                return False
+            running[pool.submit(__call_once, func, cache, annotations,
+                                __map_args(query_result) + params,
+                                lock)] = query_result
+            return True
+
+        with ThreadPoolExecutor(workers,
+                                thread_name_prefix="sxt-call") as pool:
+            try:
+                while len(running) < 2 * workers and submit(pool):
+                    pass
+                while running:
+                    if ordered:
+                        finished = [next(iter(running))]
+                        wait(finished)
+                    else:
+                        finished, _ = wait(running,
+                                           return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        query_result = running.pop(future)
+                        submit(pool)
+                        error = future.exception()
+                        yield (query_result,
+                               future.result() if error is None else None,
+                               error)
+            finally:
+                for future in running:
+                    future.cancel()
+
+    wrapper_call.map = map_call
     return wrapper_call
 
 
@@ -215,10 +387,19 @@ def __batch_item_group_set(dataset: Dataset,
                            data_info: list[DataInfo],
                            args_inputs: dict,
                            ann: dict,
-                           out_types: list
-                           ) -> BatchItem:
-    loc = new_location(dataset, annotations={"origin": job.func.__name__})
+                           out_types: list,
+                           versions: RunVersions = None
+                           ) -> tuple[BatchItem | None, str | None]:
     values_inputs = __values_inputs_group(args_inputs, data_info)
+    fingerprint = None
+    if versions is not None:
+        fingerprint = call_fingerprint(job.func, values_inputs, job.outputs,
+                                       versions)
+        cached = __cached_outputs(dataset, fingerprint, len(out_types))
+        if cached is not None:
+            versions.add(cached)
+            return None, fingerprint
+    loc = new_location(dataset, annotations={"origin": job.func.__name__})
     values_inputs_json = __serialize_inputs(values_inputs)
     print('values_inputs_json=', values_inputs_json)
     out_info_s = []
@@ -231,19 +412,36 @@ def __batch_item_group_set(dataset: Dataset,
                                 "output_id": 0
                             })
         out_info_s.append(out_info)
+    if versions is not None:
+        versions.add(out_info_s)
     return BatchItem(func=job.func,
                      inputs=values_inputs,
-                     outputs=out_info_s)
+                     outputs=out_info_s,
+                     batch_size=job.batch_size,
+                     stack=job.stack,
+                     unstack=job.unstack,
+                     memory=job.memory,
+                     threads=job.threads), fingerprint
 
 
-def __batch_item_list(job: Job,
+def __batch_item_list(dataset: Dataset,
+                      job: Job,
                       data_info: DataInfo,
                       args_inputs: dict,
                       ann: dict,
                       out_types: list,
-                      ) -> BatchItem:
-    location = __output_location(data_info, job.func)
+                      versions: RunVersions = None
+                      ) -> tuple[BatchItem | None, str | None]:
     values_inputs = __values_inputs(args_inputs, data_info)
+    fingerprint = None
+    if versions is not None:
+        fingerprint = call_fingerprint(job.func, values_inputs, job.outputs,
+                                       versions)
+        cached = __cached_outputs(dataset, fingerprint, len(out_types))
+        if cached is not None:
+            versions.add(cached)
+            return None, fingerprint
+    location = __output_location(data_info, job.func)
     values_inputs_json = __serialize_inputs(values_inputs)
     out_info_s = []
 
@@ -259,17 +457,30 @@ def __batch_item_list(job: Job,
                                 "output_id": 0
                             })
         out_info_s.append(out_info)
+    if versions is not None:
+        versions.add(out_info_s)
     return BatchItem(func=job.func,
                      inputs=values_inputs,
-                     outputs=out_info_s)
+                     outputs=out_info_s,
+                     batch_size=job.batch_size,
+                     stack=job.stack,
+                     unstack=job.unstack,
+                     memory=job.memory,
+                     threads=job.threads), fingerprint
 
 
-def __batch_job(dataset, job: Job, run_id: str, job_id: str):
+def __batch_job(dataset, job: Job, run_id: str, job_id: str,
+                versions: RunVersions = None
+                ) -> tuple[Batch, list[str | None], int]:
     """Run a job query to extract the job batch commands
 
     :param job: Job to run
     :param run_id: Identifier of the run the job belongs to
     :param job_id: Identifier of the job in the run
+    :param versions: Versions of the data of a cache-aware run, whose items
+                     already computed are skipped, None to run all items
+    :return: The batch, the fingerprint of each item and the number of
+             skipped items
     """
     query_inputs, args_inputs = __filter_inputs(job.inputs)
     print("RUN query with ", query_inputs)
@@ -278,26 +489,330 @@ def __batch_job(dataset, job: Job, run_id: str, job_id: str):
     ann = {"run_id": run_id, "job_id": job_id}
 
     batch = Batch()
+    fingerprints = []
+    skipped = 0
     if job.query_type == GROUP_SET:
-        batch.append(__batch_item_group_set(dataset, job, data_info,
-                                            args_inputs, ann, out_types))
+        planned = [__batch_item_group_set(dataset, job, data_info,
+                                          args_inputs, ann, out_types,
+                                          versions)]
+    else:
+        planned = [__batch_item_list(dataset, job, d_info, args_inputs, ann,
+                                     out_types, versions)
+                   for d_info in data_info]
+    for item, fingerprint in planned:
+        if item is None:
+            skipped += 1
+            continue
+        batch.append(item)
+        fingerprints.append(fingerprint)
+    return batch, fingerprints, skipped
+
+
+def __store_fingerprints(batches: list[Batch],
+                         fingerprints: list[list[str | None]],
+                         failures: list[ItemFailure]):
+    """Annotate the outputs of the successful items with their fingerprint"""
+    failed = {(failure.batch, failure.item) for failure in failures}
+    outputs = []
+    values = []
+    for batch_index, batch in enumerate(batches):
+        for item_index, item in enumerate(batch.items):
+            fingerprint = fingerprints[batch_index][item_index]
+            if fingerprint is None or (batch_index, item_index) in failed:
+                continue
+            for i, info in enumerate(item.outputs):
+                outputs.append(info)
+                values.append(output_fingerprint(fingerprint, i))
+    if len(outputs) > 0:
+        annotate_data_many(outputs, {FINGERPRINT_KEY: values})
+
+
+def __journal_dir() -> Path:
+    """Directory containing the run journals
+
+    It is the `journal` key of the runner section of the config file, or the
+    `runs` directory of the index workspace.
+    """
+    runner_config = config().section("runner")
+    if "journal" in runner_config:
+        return Path(runner_config["journal"])
+    index_config = config().section("index")
+    if "workspace" in index_config:
+        return Path(index_config["workspace"]) / "runs"
+    return Path(config().file).parent / "runs"
+
+
+def __execute(batches: list[Batch],
+              journal: RunJournal | None,
+              nodes: dict[tuple[int, int], tuple[int, int]] = None,
+              transient: set[str] = None
+              ) -> tuple[list[ItemFailure], list[DataInfo]]:
+    """Run batches with the runner and record their progress in the journal
+
+    If the runner supports it, the chains of items with a single consumer at
+    the same location run as fused items. Their transient outputs are passed
+    in memory, and the other transient outputs are kept in the ephemeral
+    store of the runner if it has one.
+
+    :param batches: Batches to run,
+    :param journal: Journal of the run, None to run without journal,
+    :param nodes: Node in the journal of each node of the batches,
+    :param transient: URIs of the outputs that need not be written,
+    :return: The failed items, with their node in the journal, and the
+             outputs that were not written
+    """
+    transient = transient or set()
+    planned = batches
+    if __runner.fusing:
+        batches, fused_nodes = fuse_batches(batches, transient)
+        chains = sum(len(stages) > 1 for stages in fused_nodes.values())
+        if chains:
+            logger().info(f"{chains} chains of items fused")
+    else:
+        fused_nodes = {(batch_index, item_index): [(batch_index, item_index)]
+                       for batch_index, batch in enumerate(batches)
+                       for item_index in range(len(batch))}
+    if nodes is not None:
+        fused_nodes = {node: [nodes[stage] for stage in stages]
+                       for node, stages in fused_nodes.items()}
+    if journal is not None:
+        journal.open(fused_nodes)
+        __runner.journal = journal
+    __runner.transient = transient
+    finished = False
+    try:
+        failures = __runner.run(batches) or []
+        finished = True
+    finally:
+        __runner.journal = None
+        __runner.transient = frozenset()
+        if journal is not None:
+            if finished and not __runner.journaling:
+                failed = {(failure.batch, failure.item)
+                          for failure in failures}
+                for batch_index, batch in enumerate(batches):
+                    for item_index, item in enumerate(batch.items):
+                        node = (batch_index, item_index)
+                        if node not in failed:
+                            journal.done(node, [info.uri.value
+                                                for info in item.outputs])
+                for failure in failures:
+                    journal.failed(failure)
+            journal.close(finished)
+    failures = [failure.model_copy(update={"batch": node[0],
+                                           "item": node[1],
+                                           "func": item_path(stage)})
+                for failure in failures
+                for node, stage in zip(
+                    fused_nodes[(failure.batch, failure.item)],
+                    __stages(batches[failure.batch].items[failure.item]))]
+    for failure in failures:
+        logger().error(f"Job {failure.batch} item {failure.item} "
+                       f"({failure.func}) failed: {failure.error}")
+    if __runner.ephemeral:
+        unwritten = [info for batch in planned for item in batch.items
+                     for info in item.outputs if info.uri.value in transient]
     else:
-        for d_info in data_info:
-            batch.append(__batch_item_list(job, d_info, args_inputs, ann,
-                                           out_types))
-    return batch
+        unwritten = [info for batch in batches for item in batch.items
+                     if isinstance(item, FusedItem)
+                     for stage in item.stages for info in stage.outputs
+                     if info.uri.value in item.transient]
+    return failures, unwritten
+
+
+def __stages(item: BatchItem) -> list[BatchItem]:
+    """Get the planned items run by an item"""
+    return item.stages if isinstance(item, FusedItem) else [item]
+
+
+def __transient(batches: list[Batch], jobs: list[Job]) -> list[str]:
+    """Get the URIs of the outputs of the jobs that do not keep them"""
+    return [info.uri.value
+            for batch, job in zip(batches, jobs) if not job.keep
+            for item in batch.items for info in item.outputs]
+
 
+def __rerun_producers(batches: list[Batch],
+                      completed: set[tuple[int, int]],
+                      transient: set[str]) -> set[tuple[int, int]]:
+    """Get the completed items that need not run again
 
-def run(dataset: Dataset, jobs: list[Job]):
+    The transient outputs are lost when a run stops, so their producers run
+    again if an item reading them did not complete.
+
+    :param batches: Planned batches,
+    :param completed: Completed items according to the journal,
+    :param transient: URIs of the transient outputs,
+    :return: The items that do not need to run again
+    """
+    graph = DependencyGraph(batches)
+    completed = set(completed)
+    changed = True
+    while changed:
+        changed = False
+        for node in sorted(completed):
+            if any(info.uri.value in transient
+                   for info in graph.item(node).outputs) and \
+                    any(consumer not in completed
+                        for consumer in graph.consumers(node)):
+                completed.discard(node)
+                changed = True
+    return completed
+
+
+def __discard(unwritten: list[DataInfo]):
+    """Delete the planned data of outputs that were not written"""
+    for info in unwritten:
+        delete(info)
+    if unwritten:
+        logger().info(f"{len(unwritten)} intermediate results not kept")
+
+
+def __discard_left(batches: list[Batch],
+                   completed: set[tuple[int, int]],
+                   discarded: set[str] = frozenset(),
+                   transient: set[str] = frozenset()):
+    """Delete the planned outputs of the items that did not complete
+
+    They are empty placeholders or partial results. :func:`resume` creates
+    them again for the items it runs.
+
+    :param batches: Planned batches,
+    :param completed: Items that completed,
+    :param discarded: URIs of the outputs already deleted,
+    :param transient: URIs of the outputs deleted even if their item
+                      completed
+    """
+    left = [info for batch_index, batch in enumerate(batches)
+            for item_index, item in enumerate(batch.items)
+            for info in item.outputs
+            if info.uri.value not in discarded and
+            ((batch_index, item_index) not in completed or
+             info.uri.value in transient)]
+    for info in left:
+        delete(info)
+    if left:
+        logger().info(f"{len(left)} outputs of unfinished items deleted")
+
+
+def __completed(batches: list[Batch], failures: list[ItemFailure]
+                ) -> set[tuple[int, int]]:
+    """Get the items of a finished run that did not fail"""
+    failed = {(failure.batch, failure.item) for failure in failures}
+    return {(batch_index, item_index)
+            for batch_index, batch in enumerate(batches)
+            for item_index in range(len(batch))
+            if (batch_index, item_index) not in failed}
+
+
+def __replace_input(value: any, infos: dict[str, DataInfo]) -> any:
+    """Replace the planned data of an item input"""
+    if isinstance(value, DataInfo):
+        return infos.get(value.uri.value, value)
+    if isinstance(value, (list, DataInfoSet)) and len(value) > 0 and \
+            isinstance(value[0], DataInfo):
+        return [infos.get(info.uri.value, info) for info in value]
+    return value
+
+
+def __replace_data(batches: list[Batch], infos: dict[str, DataInfo]
+                   ) -> list[Batch]:
+    """Replace planned data in the inputs and outputs of the items
+
+    :param batches: Planned batches,
+    :param infos: New information of each replaced data URI,
+    :return: The batches with the replaced data
+    """
+    if not infos:
+        return batches
+    replaced = []
+    for batch in batches:
+        replaced_batch = Batch()
+        for item in batch.items:
+            replaced_batch.append(BatchItem(
+                func=item.func,
+                inputs=[__replace_input(value, infos)
+                        for value in item.inputs],
+                outputs=[infos.get(info.uri.value, info)
+                         for info in item.outputs],
+                batch_size=item.batch_size,
+                stack=item.stack,
+                unstack=item.unstack,
+                memory=item.memory,
+                threads=item.threads))
+        replaced.append(replaced_batch)
+    return replaced
+
+
+def __plan_left(run_id: str,
+                batches: list[Batch],
+                completed: set[tuple[int, int]],
+                existing: set[str],
+                outputs: list[list[dict[str, any]]]
+                ) -> dict[str, DataInfo]:
+    """Create again the deleted outputs of the items left to run
+
+    :param run_id: Identifier of the run,
+    :param batches: Planned batches,
+    :param completed: Items that do not run again,
+    :param existing: URIs of the data of the run in the index,
+    :param outputs: Annotations of the outputs of the job of each batch,
+    :return: The new information of each replaced output URI
+    """
+    planned = {}
+    for batch_index, batch in enumerate(batches):
+        job_outputs = outputs[batch_index]
+        ann = {"run_id": run_id, "job_id": str(batch_index)}
+        for item_index, item in enumerate(batch.items):
+            if (batch_index, item_index) in completed or \
+                    all(info.uri.value in existing for info in item.outputs):
+                continue
+            inputs_json = __serialize_inputs(
+                [__replace_input(value, planned) for value in item.inputs])
+            for i, info in enumerate(item.outputs):
+                if info.uri.value in existing:
+                    continue
+                planned[info.uri.value] = new_data(
+                    info.location, info.storage_type,
+                    data_annotate=dict(ann, **(job_outputs[i]
+                                               if i < len(job_outputs)
+                                               else {})),
+                    metadata={"func": item.func.__name__,
+                              "inputs": inputs_json,
+                              "output_id": 0})
+    return planned
+
+
+def run(dataset: Dataset, jobs: list[Job], cache: bool = False
+        ) -> list[ItemFailure]:
     """Execute the jobs
 
+    A failing item does not stop the run if the runner reports the failures.
+    The plan and the progress of the run are written in a run journal, so an
+    interrupted run can continue with :func:`resume`. The outputs of the
+    failed and cancelled items are deleted, and so are those of the items
+    not completed according to the journal if the runner stops on an error.
+
     :param dataset: Dataset to run the job on,
-    :param jobs: List of jobs to run
+    :param jobs: List of jobs to run,
+    :param cache: Skip the items whose function, inputs and output
+                  annotations match an item that succeeded in a previous
+                  cache-aware run,
+    :return: The items that failed
     """
-    run_id = str(datetime.now())
+    run_id = datetime.now().strftime("%Y-%m-%dT%H-%M-%S-%f")
     batch_jobs = []
+    fingerprints = []
+    skipped = 0
+    versions = RunVersions(__storage) if cache else None
     for i, job in enumerate(jobs):
-        batch_jobs.append(__batch_job(dataset, job, run_id, job_id=str(i)))
+        batch, job_fingerprints, job_skipped = __batch_job(
+            dataset, job, run_id, job_id=str(i), versions=versions)
+        batch_jobs.append(batch)
+        fingerprints.append(job_fingerprints)
+        skipped += job_skipped
+    if cache:
+        logger().info(f"{skipped} items found in the cache")
 
     # print
     for bat in batch_jobs:
@@ -306,4 +821,88 @@ def run(dataset: Dataset, jobs: list[Job]):
             print(item.func.__name__)
             print(item.inputs)
             print(item.outputs)
-    __runner.run(batch_jobs)
+
+    transient = __transient(batch_jobs, jobs)
+    journal = RunJournal(__journal_dir() / run_id)
+    try:
+        journal.write_plan(dataset, batch_jobs, fingerprints, cache,
+                           transient, [job.outputs for job in jobs])
+    except (ImportError, AttributeError, ValueError,
+            pickle.PickleError) as error:
+        logger().warning(f"Run {run_id} cannot be resumed: {error}")
+        journal = None
+    else:
+        logger().info(f"Run {run_id} journal: {journal.directory}")
+    try:
+        failures, unwritten = __execute(batch_jobs, journal,
+                                        transient=set(transient))
+    except BaseException:
+        __discard_left(batch_jobs,
+                       set() if journal is None else journal.completed(),
+                       transient=set(transient))
+        raise
+    if cache:
+        __store_fingerprints(batch_jobs, fingerprints, failures)
+    __discard(unwritten)
+    __discard_left(batch_jobs, __completed(batch_jobs, failures),
+                   {info.uri.value for info in unwritten})
+    return failures
+
+
+def resume(run_id: str) -> list[ItemFailure]:
+    """Continue an interrupted run
+
+    The items completed according to the run journal are skipped, except the
+    producers of transient outputs read by items that did not complete. The
+    other items run again and overwrite their outputs, which are created
+    again if they were deleted when the run stopped.
+
+    :param run_id: Identifier of the run,
+    :return: The items that failed
+    """
+    journal = RunJournal(__journal_dir() / run_id)
+    dataset, batches, fingerprints, cache, transient, outputs = \
+        journal.read_plan()
+    existing = {info.uri.value: info
+                for info in query_data(dataset, {"run_id": run_id})}
+    replaced = {uri: existing[new_uri]
+                for uri, new_uri in journal.replacements().items()
+                if new_uri in existing}
+    batches = __replace_data(batches, replaced)
+    transient = [replaced[uri].uri.value if uri in replaced else uri
+                 for uri in transient]
+    completed = __rerun_producers(batches, journal.completed(),
+                                  set(transient))
+    planned = __plan_left(run_id, batches, completed, set(existing), outputs)
+    if planned:
+        journal.replaced({uri: info.uri.value
+                          for uri, info in planned.items()})
+        batches = __replace_data(batches, planned)
+        transient = [planned[uri].uri.value if uri in planned else uri
+                     for uri in transient]
+    remaining = []
+    nodes = {}
+    for batch_index, batch in enumerate(batches):
+        remaining_batch = Batch()
+        for item_index, item in enumerate(batch.items):
+            if (batch_index, item_index) in completed:
+                continue
+            nodes[(batch_index, len(remaining_batch))] = \
+                (batch_index, item_index)
+            remaining_batch.append(item)
+        remaining.append(remaining_batch)
+    logger().info(f"Resume run {run_id}: {len(nodes)} of "
+                  f"{sum(len(batch) for batch in batches)} items left")
+    try:
+        failures, unwritten = __execute(remaining, journal, nodes,
+                                        set(transient))
+    except BaseException:
+        __discard_left(batches, journal.completed(),
+                       transient=set(transient))
+        raise
+    if cache:
+        __store_fingerprints(batches, fingerprints, failures)
+    __discard(unwritten)
+    __discard_left(batches, __completed(batches, failures),
+                   {info.uri.value for info in unwritten})
+    return failures
@@ -0,0 +1,162 @@
+"""Fingerprints of function calls for the cache-aware runs
+
+The fingerprint of a call identifies the function, its code, its inputs and
+its output annotations. Each output of a call that succeeded is annotated with
+the `fingerprint` key and the value `<fingerprint>/<output index>`, so that a
+later call with the same fingerprint finds its outputs in the index instead of
+running again.
+
+Data inputs are identified by their URI and by the content version given by
+the storage. The outputs of a cached call keep their URI, so the calls
+downstream of a cache hit are cache hits as well, and the calls downstream of
+a new result are run again. A data rewritten in place is only seen as changed
+if the storage gives a content version for it: without one, a cache-aware
+run may return outputs computed from its previous content.
+
+Numpy arrays are identified by their content, the other values by their
+representation when it is exact, or by their pickle. A call with a value that
+cannot be identified is not cached.
+"""
+from typing import Callable
+from types import CodeType
+import hashlib
+import inspect
+import json
+import pickle
+
+import numpy as np
+
+from .models import DataInfo
+from .models import DataInfoSet
+from .models import URI
+from .storage import SxStorage
+
+
+FINGERPRINT_KEY = "fingerprint"
+
+# Annotations that differ between runs and are not part of the fingerprint
+RUN_ANNOTATIONS = ("run_id", "job_id", FINGERPRINT_KEY)
+
+
+def _update_code(digest, code: CodeType):
+    """Add a code object, and the code objects nested in it, to a digest"""
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _update_code(digest, const)
+        else:
+            digest.update(repr(const).encode())
+
+
+def function_hash(func: Callable) -> str:
+    """Hash the identity and the code of a function
+
+    :param func: Function, possibly wrapped by a decorator,
+    :return: The hexadecimal hash
+    """
+    func = inspect.unwrap(func)
+    digest = hashlib.sha256(
+        f"{func.__module__}:{func.__qualname__}".encode())
+    code = getattr(func, "__code__", None)
+    if code is not None:
+        _update_code(digest, code)
+    return digest.hexdigest()
+
+
+class RunVersions:
+    """Content versions of the data inputs of a cache-aware run
+
+    The outputs planned by the run, and the outputs of its cached items, are
+    identified by their URI only: their content is given by the call that
+    produces them, and their version changes when the call writes them.
+    The other data get their version from the storage.
+
+    :param storage: Storage giving the content version of the data
+    """
+    def __init__(self, storage: SxStorage):
+        self.__storage = storage
+        self.produced: set[str] = set()
+
+    def add(self, outputs: list[DataInfo]):
+        """Record outputs planned or cached by the run
+
+        :param outputs: The outputs
+        """
+        self.produced.update(info.uri.value for info in outputs)
+
+    def version(self, uri: URI) -> str | None:
+        """Get the version of a data content, as :meth:`SxStorage.version`
+
+        :param uri: Unique identifier of the data,
+        :return: The version, None for an output of the run
+        """
+        if uri.value in self.produced:
+            return None
+        return self.__storage.version(uri)
+
+
+class _Unidentified(Exception):
+    """Raised for an input value that has no fingerprint"""
+
+
+def _input_key(value: any, storage: SxStorage = None) -> any:
+    """Describe an input with JSON compatible values"""
+    if isinstance(value, DataInfo):
+        version = None if storage is None else storage.version(value.uri)
+        return ["data", value.uri.value, version]
+    if isinstance(value, DataInfoSet):
+        value = list(value)
+    if isinstance(value, (list, tuple)):
+        return [_input_key(val, storage) for val in value]
+    if isinstance(value, dict):
+        return ["dict", [[_input_key(key, storage), _input_key(val, storage)]
+                         for key, val in value.items()]]
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise _Unidentified(value)
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes())
+        return ["ndarray", str(value.dtype), list(value.shape),
+                digest.hexdigest()]
+    if value is None or isinstance(value, (str, int, float, bool,
+                                           np.generic)):
+        return [type(value).__name__, repr(value)]
+    try:
+        content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as error:
+        raise _Unidentified(value) from error
+    return [type(value).__name__, hashlib.sha256(content).hexdigest()]
+
+
+def call_fingerprint(func: Callable,
+                     inputs: list[any],
+                     outputs: list[dict[str, any]],
+                     storage: SxStorage | RunVersions = None
+                     ) -> str | None:
+    """Compute the fingerprint of a function call
+
+    :param func: Called function,
+    :param inputs: Data information and values given to the function,
+    :param outputs: Annotations of each output,
+    :param storage: Storage giving the content version of the data,
+    :return: The hexadecimal fingerprint, None if an input value cannot be
+             identified and the call must not be cached
+    """
+    outputs = [{key: str(value) for key, value in sorted(ann.items())
+                if key not in RUN_ANNOTATIONS} for ann in outputs]
+    try:
+        inputs_key = _input_key(list(inputs), storage)
+    except _Unidentified:
+        return None
+    description = json.dumps([function_hash(func), inputs_key, outputs])
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+def output_fingerprint(fingerprint: str, output_id: int) -> str:
+    """Annotation value identifying one output of a call
+
+    :param fingerprint: Fingerprint of the call,
+    :param output_id: Index of the output,
+    :return: The annotation value
+    """
+    return f"{fingerprint}/{output_id}"
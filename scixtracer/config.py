@@ -96,9 +96,8 @@ class ConfigData:
         """
         if key not in self.data:
             raise ValueError(f"Cannot find the section {key} in the config")
-        values = self.data[key]
-        values.pop("name")
-        return values
+        return {name: value for name, value in self.data[key].items()
+                if name != "name"}
 
     def value(self, section_name: str, key: str) -> str:
         """Get the config data for on category
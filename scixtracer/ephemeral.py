@@ -0,0 +1,170 @@
+"""Store of the ephemeral outputs of a run
+
+The outputs of a job with `keep` False are ephemeral. When they are not
+passed in memory inside a fused item, a runner with an ephemeral store writes
+them to the store instead of the storage backend, and removes them as soon as
+all the items reading them are done. The store is removed at the end of the
+run, with the data planned for these outputs in the dataset.
+
+The store is shared by the worker processes of a host. Each value is pickled
+in a file of a memory directory (`/dev/shm`, a tmpfs, if it exists) while
+the values fit in the memory bound. Under memory pressure the value goes to a
+spill directory on the local disk if one is given, and to the storage
+backend otherwise.
+"""
+from pathlib import Path
+import hashlib
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
+
+from .scheduler import DependencyGraph
+from .scheduler import Node
+
+
+def _memory_directory() -> Path:
+    """Get a directory in memory, or the temporary directory if none"""
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm
+    return Path(tempfile.gettempdir())
+
+
+class EphemeralStore:
+    """Bounded store of the ephemeral outputs of a run
+
+    :param max_bytes: Size of the values kept in memory,
+    :param spill: Directory on the local disk for the values that do not fit
+                  in memory, None to write them to the storage backend,
+    :param memory: Directory in memory, default: `/dev/shm`,
+    :param context: Multiprocessing context of the processes sharing the
+                    store
+    """
+    def __init__(self,
+                 max_bytes: int,
+                 spill: Path | str = None,
+                 memory: Path | str = None,
+                 context=None):
+        name = f"sxt-{uuid.uuid4().hex}"
+        self.__directories = [Path(memory or _memory_directory()) / name]
+        if spill is not None:
+            self.__directories.append(Path(spill) / name)
+        for directory in self.__directories:
+            directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.__max_bytes = max_bytes
+        self.__used = (context or multiprocessing).Value("q", 0)
+        self.uris: set[str] = set()
+
+    @property
+    def used(self) -> int:
+        """Size in bytes of the values in memory"""
+        return self.__used.value
+
+    def __path(self, index: int, uri: str) -> Path:
+        digest = hashlib.sha1(uri.encode()).hexdigest()
+        return self.__directories[index] / digest
+
+    def write(self, uri: str, value: any) -> bool:
+        """Write an ephemeral output
+
+        :param uri: URI of the output,
+        :param value: Value of the output,
+        :return: False if the output is not ephemeral, or if it fits neither
+                 in memory nor in the spill directory
+        """
+        if uri not in self.uris:
+            return False
+        self.evict(uri)
+        content = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.__used.get_lock():
+            fits = self.__used.value + len(content) <= self.__max_bytes
+            if fits:
+                self.__used.value += len(content)
+        if fits:
+            path = self.__path(0, uri)
+        elif len(self.__directories) > 1:
+            path = self.__path(1, uri)
+        else:
+            return False
+        temporary = path.with_suffix(".tmp")
+        temporary.write_bytes(content)
+        os.replace(temporary, path)
+        return True
+
+    def read(self, uri: str) -> any:
+        """Read an ephemeral output
+
+        :param uri: URI of the output,
+        :return: The value,
+        :raise KeyError: If the output is not in the store
+        """
+        if uri in self.uris:
+            for index in range(len(self.__directories)):
+                try:
+                    content = self.__path(index, uri).read_bytes()
+                except FileNotFoundError:
+                    continue
+                return pickle.loads(content)
+        raise KeyError(uri)
+
+    def evict(self, uri: str):
+        """Remove an output from the store
+
+        :param uri: URI of the output
+        """
+        for index in range(len(self.__directories)):
+            path = self.__path(index, uri)
+            try:
+                size = path.stat().st_size
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            if index == 0:
+                with self.__used.get_lock():
+                    self.__used.value -= size
+
+    def close(self):
+        """Remove the store and all its values"""
+        for directory in self.__directories:
+            shutil.rmtree(directory, ignore_errors=True)
+        self.__used.value = 0
+
+
+class EphemeralLifetimes:
+    """Eviction of the ephemeral outputs when their consumers are done
+
+    :param graph: Dependency graph of the run,
+    :param store: Store of the ephemeral outputs
+    """
+    def __init__(self, graph: DependencyGraph, store: EphemeralStore):
+        self.__graph = graph
+        self.__store = store
+        self.__pending = {}
+
+    def __evict(self, node: Node):
+        """Remove the ephemeral outputs of an item"""
+        for info in self.__graph.item(node).outputs:
+            if info.uri.value in self.__store.uris:
+                self.__store.evict(info.uri.value)
+
+    def settled(self, nodes: list[Node]):
+        """Record that items are done, failed or cancelled
+
+        The outputs of an item are evicted when all its consumers are
+        settled, or when it is settled if it has no consumer.
+
+        :param nodes: The settled items
+        """
+        for node in nodes:
+            if not self.__graph.consumers(node):
+                self.__evict(node)
+            for producer in self.__graph.dependencies(node):
+                pending = self.__pending.get(
+                    producer, len(self.__graph.consumers(producer))) - 1
+                self.__pending[producer] = pending
+                if pending == 0:
+                    self.__evict(producer)
+
@@ -1,18 +1,28 @@
 """Plugin loader factory"""
+from typing import Callable
 import importlib
 import pkgutil
+import threading
+
+from .config import config
 
 
 class Factory:
     """Factory to instantiate an interface implementation
 
     :param module_prefix: Prefix of the module containing implementation,
-    :param submodule_name: Name of the submodule containing the API export
+    :param submodule_name: Name of the submodule containing the API export,
+    :param builtins: Implementations shipped with scixtracer, by name. An
+                     installed plugin with the same name takes precedence
     """
-    def __init__(self, module_prefix: str, submodule_name: str):
+    def __init__(self,
+                 module_prefix: str,
+                 submodule_name: str,
+                 builtins: dict[str, any] = None):
         self.__module_prefix = module_prefix
         self.__submodule_name = submodule_name
-        self.__models = self.__register_plugins()
+        self.__models = dict(builtins) if builtins is not None else {}
+        self.__models.update(self.__register_plugins())
 
     @property
     def models(self) -> dict:
@@ -50,3 +60,50 @@ class Factory:
             raise ValueError(
                 f'Cannot find implementation of {name}')
         return self.__models[name]
+
+
+class ConnectedPlugin:
+    """Backend plugin created and connected on first use
+
+    The attributes are read from and written to the connected plugin, so
+    importing scixtracer, as the worker processes of the runners do, does not
+    connect the backends the process does not use.
+
+    :param section: Section of the config file naming the plugin and giving
+                    its connection options, also the submodule name of the
+                    plugin packages,
+    :param builtins: Implementations shipped with scixtracer, by name,
+    :param setup: Function called with the plugin before it is connected
+    """
+    def __init__(self,
+                 section: str,
+                 builtins: dict[str, any] = None,
+                 setup: Callable = None):
+        object.__setattr__(self, "_ConnectedPlugin__section", section)
+        object.__setattr__(self, "_ConnectedPlugin__builtins", builtins)
+        object.__setattr__(self, "_ConnectedPlugin__setup", setup)
+        object.__setattr__(self, "_ConnectedPlugin__plugin", None)
+        object.__setattr__(self, "_ConnectedPlugin__lock", threading.Lock())
+
+    def __connected(self) -> any:
+        """Get the plugin, connecting it on the first call"""
+        plugin = self.__plugin
+        if plugin is not None:
+            return plugin
+        with self.__lock:
+            if self.__plugin is None:
+                plugin = Factory("sxt_", self.__section, self.__builtins).get(
+                    config().value(self.__section, "name"))()
+                if self.__setup is not None:
+                    self.__setup(plugin)
+                plugin.connect(**config().filtered_section(self.__section))
+                object.__setattr__(self, "_ConnectedPlugin__plugin", plugin)
+            return self.__plugin
+
+    def __getattr__(self, name: str) -> any:
+        if name.startswith("_ConnectedPlugin__"):
+            raise AttributeError(name)
+        return getattr(self.__connected(), name)
+
+    def __setattr__(self, name: str, value: any):
+        setattr(self.__connected(), name, value)
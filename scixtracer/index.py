@@ -1,5 +1,8 @@
 """Definition of the main API methods"""
 from abc import abstractmethod, ABC
+from typing import Callable
+from typing import Iterator
+import inspect
 
 import pandas as pd
 
@@ -8,6 +11,195 @@ from .models import URI
 from .models import Dataset
 from .models import Location
 from .models import DataInfo
+from .models import DataInfoSet
+from .snapshot import IndexSnapshot
+from .snapshot import annotation_type
+
+
+class AnnotationStats:
+    """Incrementally maintained annotation values of a dataset
+
+    Keep, for each annotation key, the dictionary of its values with the number
+    of objects (data or locations) that carry them. On every create_data,
+    annotate_* and delete call, an index counts the annotations added and
+    removed by the call and applies them to its stored counts, so that the
+    annotation queries are answered in O(distinct values) instead of scanning
+    the dataset. Values are counted with their type, so that True and 1 are
+    counted apart.
+    """
+    def __init__(self):
+        self.__counts: dict[str, dict[tuple[any, str], int]] = {}
+
+    @classmethod
+    def from_annotations(cls, annotations: list[dict[str, any]]
+                         ) -> "AnnotationStats":
+        """Build the statistics of a set of objects in one pass
+
+        :param annotations: Annotations of each object,
+        :return: The statistics
+        """
+        stats = cls()
+        for ann in annotations:
+            stats.add(ann)
+        return stats
+
+    def add(self, annotations: dict[str, any] | None, count: int = 1):
+        """Register the annotations of a new object
+
+        :param annotations: Annotations of the object,
+        :param count: Number of objects carrying these annotations
+        """
+        if annotations is None:
+            return
+        for key, value in annotations.items():
+            values = self.__counts.setdefault(key, {})
+            typed = (value, annotation_type(value))
+            values[typed] = values.get(typed, 0) + count
+
+    def counts(self) -> dict[str, dict[tuple[any, str], int]]:
+        """Get the number of objects for each annotation key and value
+
+        :return: The counts per key and (value, value type) pair
+        """
+        return {key: dict(values) for key, values in self.__counts.items()}
+
+
+def annotation_rows(count: int,
+                    annotations: dict[str, any] | pd.DataFrame
+                    ) -> list[dict[str, any]]:
+    """Expand bulk annotations into one annotation dictionary per target
+
+    :param count: Number of annotated targets,
+    :param annotations: Either a dictionary mapping each key to a single value
+                        shared by all the targets or to a list with one value
+                        per target, or a table with one row per target and one
+                        column per key. Missing (None/NaN) values are skipped,
+    :return: The annotations of each target
+    """
+    if isinstance(annotations, pd.DataFrame):
+        if len(annotations.index) != count:
+            raise ValueError(f"Annotation table has {len(annotations.index)} "
+                             f"rows for {count} targets")
+        columns = {key: annotations[key].tolist()
+                   for key in annotations.columns}
+    else:
+        columns = {}
+        for key, value in annotations.items():
+            if isinstance(value, (list, tuple)):
+                if len(value) != count:
+                    raise ValueError(f"Annotation {key} has {len(value)} "
+                                     f"values for {count} targets")
+                columns[key] = list(value)
+            else:
+                columns[key] = [value] * count
+    rows = [{} for _ in range(count)]
+    for key, values in columns.items():
+        for row, value in zip(rows, values):
+            if value is None or (isinstance(value, float) and pd.isna(value)):
+                continue
+            row[key] = value
+    return rows
+
+
+LOCATION_VIEW_COLUMNS = ["location"]
+DATA_VIEW_COLUMNS = ["uri", "location", "storage_type", "metadata_uri"]
+
+
+def _distinct_types(values: list) -> bool:
+    """Tell if the equal values of a list all have the same type"""
+    values = [value for value in values if value is not None]
+    return len(set(values)) == len({(value, type(value)) for value in values})
+
+
+def view_frame(columns: dict[str, list],
+               categorical: list[str] | dict[str, list] = None
+               ) -> pd.DataFrame:
+    """Build a view table column-wise
+
+    Index implementations fetch each column of a view straight from their
+    storage and assemble the table here, instead of appending rows. Annotation
+    values repeat a lot, so they are stored as categorical columns, unless
+    the column has equal values of different types (1 and True) that a
+    categorical column would merge.
+
+    :param columns: Values of each column, in the table order,
+    :param categorical: Names of the columns to store as categories, or the
+                        categories of each of these columns so that chunks of
+                        the same view share their categories,
+    :return: The view table
+    """
+    data = {}
+    for name, values in columns.items():
+        if isinstance(categorical, dict) and name in categorical:
+            if _distinct_types(categorical[name]):
+                data[name] = pd.Categorical(values,
+                                            categories=categorical[name])
+            else:
+                data[name] = values
+        elif categorical is not None and name in categorical:
+            if _distinct_types(values):
+                data[name] = pd.Categorical(values)
+            else:
+                data[name] = values
+        else:
+            data[name] = values
+    return pd.DataFrame(data, columns=list(columns.keys()))
+
+
+def view_columns(base_columns: list[str],
+                 annotation_keys: list[str],
+                 columns: list[str] = None
+                 ) -> list[str]:
+    """Select the columns of a view
+
+    :param base_columns: Columns describing the indexed object,
+    :param annotation_keys: Available annotation keys,
+    :param columns: Requested columns, all of them if None,
+    :return: The columns to build, in the table order
+    """
+    available = base_columns + [key for key in annotation_keys
+                                if key not in base_columns]
+    if columns is None:
+        return available
+    return [name for name in available if name in columns]
+
+
+def filtered_view(view_method: Callable,
+                  dataset: Dataset,
+                  *args,
+                  annotations: dict[str, any] = None,
+                  columns: list[str] = None
+                  ) -> pd.DataFrame:
+    """Build a view with the filters the index accepts, filter it otherwise
+
+    Index plugins written before the view filters only take the dataset, and
+    the locations of the data view. Their full view is built and filtered
+    here, and the filters are not passed to them.
+
+    :param view_method: The `view_locations` or `view_data` method of an
+                        index,
+    :param dataset: Dataset to visualize,
+    :param args: Other positional arguments of the method,
+    :param annotations: Keep only the rows that have the annotations,
+    :param columns: Columns to keep, all of them if None,
+    :return: The view table
+    """
+    filters = {name: value for name, value in (("annotations", annotations),
+                                                ("columns", columns))
+               if value is not None}
+    parameters = inspect.signature(view_method).parameters
+    if all(name in parameters for name in filters) or \
+            any(parameter.kind == parameter.VAR_KEYWORD
+                for parameter in parameters.values()):
+        return view_method(dataset, *args, **filters)
+    view = view_method(dataset, *args)
+    for key, value in (annotations or {}).items():
+        if key not in view.columns:
+            return view.iloc[0:0]
+        view = view[view[key].astype(object) == value]
+    if columns is not None:
+        view = view[[name for name in view.columns if name in columns]]
+    return view
 
 
 class SxIndex(ABC):
@@ -89,6 +281,44 @@ class SxIndex(ABC):
         :param value: Annotation value
         """
 
+    def annotate_locations_many(self,
+                                locations: list[Location],
+                                annotations: dict[str, any] | pd.DataFrame):
+        """Annotate many locations at once
+
+        The default implementation calls annotate_location for each key and
+        location. Index implementations should override it to commit all the
+        annotations in a single transaction and update their secondary indexes
+        once.
+
+        :param locations: Locations to annotate,
+        :param annotations: Values per key, shared or one per location, or a
+                            table with one row per location
+        """
+        for location, ann in zip(locations,
+                                 annotation_rows(len(locations), annotations)):
+            for key, value in ann.items():
+                self.annotate_location(location, key, value)
+
+    def annotate_data_many(self,
+                           data_info: list[DataInfo] | DataInfoSet,
+                           annotations: dict[str, any] | pd.DataFrame):
+        """Annotate many data at once
+
+        The default implementation calls annotate_data for each key and data.
+        Index implementations should override it to commit all the
+        annotations in a single transaction and update their secondary indexes
+        once.
+
+        :param data_info: Information of the data to annotate,
+        :param annotations: Values per key, shared or one per data, or a table
+                            with one row per data
+        """
+        for info, ann in zip(data_info,
+                             annotation_rows(len(data_info), annotations)):
+            for key, value in ann.items():
+                self.annotate_data(info, key, value)
+
     @abstractmethod
     def create_data(self,
                     location: Dataset | Location,
@@ -107,6 +337,39 @@ class SxIndex(ABC):
         :return: The data information
         """
 
+    def create_data_many(self,
+                         location: Dataset | Location,
+                         uris: list[URI],
+                         storage_types: list[StorageTypes],
+                         annotations: list[dict[str, any] | None] = None,
+                         metadata_uris: list[URI | None] = None,
+                         loc_annotate: dict[str, any] = None
+                         ) -> list[DataInfo]:
+        """Create many data at one location at once
+
+        The default implementation calls new_location if the location is a
+        dataset, then create_data for each data. Index implementations
+        should override it to commit the location and all the data in a
+        single transaction, so that either all the data are indexed or none.
+
+        :param location: Location of the data, or dataset to create it in,
+        :param uris: URI of each data,
+        :param storage_types: Storage type of each data,
+        :param annotations: Annotations of each data,
+        :param metadata_uris: Metadata URI of each data,
+        :param loc_annotate: Annotations of the location created in a
+                             dataset,
+        :return: The information of each data
+        """
+        if isinstance(location, Dataset):
+            location = self.new_location(location, loc_annotate)
+        annotations = annotations or [None] * len(uris)
+        metadata_uris = metadata_uris or [None] * len(uris)
+        return [self.create_data(location, uri, storage_type, ann,
+                                 metadata_uri)
+                for uri, storage_type, ann, metadata_uri
+                in zip(uris, storage_types, annotations, metadata_uris)]
+
     def get_data_info(self, dataset: Dataset, data_uri: URI) -> DataInfo | None:
         """Read the data information from it URI
 
@@ -118,12 +381,14 @@ class SxIndex(ABC):
     @abstractmethod
     def query_data_at(self,
                       dataset: Dataset,
-                      locations: list[Location]) -> list[DataInfo]:
+                      locations: list[Location] | DataInfoSet
+                      ) -> list[DataInfo] | DataInfoSet:
         """Get all the data at given locations
 
 
         :param dataset: Dataset to query,
-        :param locations: Locations to query,
+        :param locations: Locations to query, or data whose locations are
+                          queried,
         :return: The list of data information at these locations
         """
 
@@ -131,9 +396,12 @@ class SxIndex(ABC):
     def query_data_single(self,
                           dataset: Dataset,
                           annotations: dict[str, any] = None
-                          ) -> list[DataInfo] | list[list[DataInfo]]:
+                          ) -> list[DataInfo] | DataInfoSet:
         """Retrieve data from a dataset
 
+        Implementations may return a :class:`DataInfoSet` to avoid building
+        one DataInfo per result.
+
         :param dataset: Dataset to query,
         :param annotations: Query data that have the annotations,
         """
@@ -154,7 +422,7 @@ class SxIndex(ABC):
     def query_data_group_set(self,
                              dataset: Dataset,
                              annotations: list[dict[str: any]]
-                             ) -> list[list[DataInfo]]:
+                             ) -> list[list[DataInfo]] | list[DataInfoSet]:
         """Retrieve sets of data that share the same type and annotations
 
         :param dataset: Dataset to query,
@@ -174,10 +442,29 @@ class SxIndex(ABC):
         :return: Locations that correspond to the query
         """
 
+    def count_data(self,
+                   dataset: Dataset,
+                   annotations: dict[str, any] = None
+                   ) -> int:
+        """Count the data matching annotations
+
+        The default implementation materializes the query result. Index
+        implementations should override it to count without building the
+        data information.
+
+        :param dataset: Dataset to query,
+        :param annotations: Count data that have the annotations,
+        :return: The number of matching data
+        """
+        return len(self.query_data_single(dataset, annotations))
+
     @abstractmethod
     def query_data_annotation(self, dataset: Dataset) -> dict[str, list[any]]:
         """Get all the data annotations in the datasets with their values
 
+        Implementations are expected to answer from an incrementally
+        maintained :class:`AnnotationStats` rather than scanning the data.
+
         :param dataset: Dataset to query,
         :return: Available annotations with their values
         """
@@ -187,30 +474,143 @@ class SxIndex(ABC):
                                   ) -> dict[str, list[any]]:
         """Get all the location annotations in the datasets with their values
 
+        Implementations are expected to answer from an incrementally
+        maintained :class:`AnnotationStats` rather than scanning the locations.
+
         :param dataset: Dataset to be queried,
         :return: Available locations with their values
         """
 
     @abstractmethod
-    def view_locations(self, dataset: Dataset) -> pd.DataFrame:
+    def view_locations(self,
+                       dataset: Dataset,
+                       annotations: dict[str, any] = None,
+                       columns: list[str] = None
+                       ) -> pd.DataFrame:
         """Create a table to visualize the dataset locations structure
 
+        The table has a `location` column with the location uuid followed by
+        one categorical column per location annotation key. It is built
+        column-wise with :func:`view_frame`.
+
         :param dataset: Dataset to visualize
+        :param annotations: Keep only the locations that have the annotations,
+        :param columns: Columns to build, all of them if None,
         :return: The data view as a table
         """
 
     @abstractmethod
     def view_data(self,
                   dataset: Dataset,
-                  locations: list[Location] = None,
+                  locations: list[Location] | DataInfoSet = None,
+                  annotations: dict[str, any] = None,
+                  columns: list[str] = None
                   ) -> pd.DataFrame:
         """Create a table to visualize the dataset data structure
 
+        The table has the `uri`, `location`, `storage_type` and `metadata_uri`
+        columns followed by one categorical column per data annotation key. It
+        is built column-wise with :func:`view_frame`.
+
         :param dataset: Dataset to visualize
-        :param locations: Locations to filter
+        :param locations: Locations to filter, or data whose locations are kept
+        :param annotations: Keep only the data that have the annotations,
+        :param columns: Columns to build, all of them if None,
         :return: The data view as a table
         """
 
+    def iter_view_locations(self,
+                            dataset: Dataset,
+                            annotations: dict[str, any] = None,
+                            columns: list[str] = None,
+                            chunk_size: int = 100000
+                            ) -> Iterator[pd.DataFrame]:
+        """Build the locations view by chunks of rows
+
+        The default implementation slices the full view. Index implementations
+        should override it to fetch one chunk at a time from their storage.
+
+        :param dataset: Dataset to visualize
+        :param annotations: Keep only the locations that have the annotations,
+        :param columns: Columns to build, all of them if None,
+        :param chunk_size: Maximum number of rows per chunk,
+        :return: An iterator on the view chunks
+        """
+        view = filtered_view(self.view_locations, dataset,
+                             annotations=annotations, columns=columns)
+        for start in range(0, len(view.index), chunk_size):
+            yield view.iloc[start:start+chunk_size]
+
+    def iter_view_data(self,
+                       dataset: Dataset,
+                       locations: list[Location] | DataInfoSet = None,
+                       annotations: dict[str, any] = None,
+                       columns: list[str] = None,
+                       chunk_size: int = 100000
+                       ) -> Iterator[pd.DataFrame]:
+        """Build the data view by chunks of rows
+
+        The default implementation slices the full view. Index implementations
+        should override it to fetch one chunk at a time from their storage.
+
+        :param dataset: Dataset to visualize
+        :param locations: Locations to filter, or data whose locations are kept
+        :param annotations: Keep only the data that have the annotations,
+        :param columns: Columns to build, all of them if None,
+        :param chunk_size: Maximum number of rows per chunk,
+        :return: An iterator on the view chunks
+        """
+        view = filtered_view(self.view_data, dataset, locations,
+                             annotations=annotations, columns=columns)
+        for start in range(0, len(view.index), chunk_size):
+            yield view.iloc[start:start+chunk_size]
+
+    def snapshot(self, dataset: Dataset) -> IndexSnapshot:
+        """Dump the complete index of a dataset as columnar tables
+
+        The default implementation converts the locations and data views.
+
+        :param dataset: Dataset to dump,
+        :return: The index snapshot
+        """
+        return IndexSnapshot.from_views(dataset,
+                                        self.get_description(dataset),
+                                        self.view_locations(dataset),
+                                        self.view_data(dataset))
+
+    def load_snapshot(self, snapshot: IndexSnapshot) -> Dataset:
+        """Load a dataset index from a snapshot
+
+        The default implementation creates each location with new_location
+        and its data with one create_data_many call, so the location uuids
+        are not preserved and the load is only as fast as create_data_many.
+        Index implementations should override it with a bulk load that keeps
+        the uuids and rebuilds the secondary indexes in one pass.
+
+        :param snapshot: Snapshot to load,
+        :return: The loaded dataset
+        """
+        dataset = self.new_dataset(snapshot.dataset["name"])
+        self.set_description(dataset, snapshot.dataset["description"])
+        location_ann = snapshot.location_annotations_of()
+        data_ann = snapshot.data_annotations_of()
+        rows = {}
+        for row in snapshot.data.itertuples(index=False):
+            rows.setdefault(row.location, []).append(row)
+        for uuid in snapshot.locations["location"].tolist():
+            location = self.new_location(dataset, location_ann.get(uuid, {}))
+            data = rows.get(uuid, [])
+            if not data:
+                continue
+            self.create_data_many(
+                location,
+                [URI(value=row.uri) for row in data],
+                [StorageTypes(row.storage_type) for row in data],
+                [data_ann.get(row.uri, {}) for row in data],
+                [None if row.metadata_uri is None
+                 else URI(value=row.metadata_uri) for row in data])
+        return dataset
+
     @abstractmethod
     def delete(self, data_info: DataInfo):
         """Delete a data
@@ -0,0 +1,858 @@
+"""Reference implementation of the dataset index on an embedded SQLite file
+
+The index is tuned for one writer and many concurrent readers, possibly in
+different processes:
+
+- the database runs in WAL mode so that readers never block the writer,
+- each thread (and each forked process) opens its own connection,
+- writes take the write lock up front (BEGIN IMMEDIATE) and wait on a busy
+  timeout instead of failing with "database is locked",
+- statements are parametrized and cached by the connections, lists are passed
+  as a single JSON parameter so that the statement text never changes,
+- many rows are inserted with executemany in one transaction,
+- (dataset, key, value) annotation indexes and the location index cover the
+  queries so they never read the base tables.
+
+Annotation statistics are maintained in the same transaction as the writes.
+SQLite stores booleans as integers: each annotation row keeps the type of its
+value, as the snapshot tables do, and the boolean values are read back as
+booleans.
+"""
+import itertools
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+
+from .models import StorageTypes
+from .models import URI
+from .models import Dataset
+from .models import Location
+from .models import DataInfo
+from .models import DataInfoSet
+from .models import location_uuids
+from .index import SxIndex
+from .index import AnnotationStats
+from .index import annotation_rows
+from .index import view_frame
+from .index import view_columns
+from .index import LOCATION_VIEW_COLUMNS
+from .index import DATA_VIEW_COLUMNS
+from .snapshot import IndexSnapshot
+from .snapshot import annotations_table
+from .snapshot import annotation_type
+
+
+LOCATION = "location"
+DATA = "data"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    uri TEXT NOT NULL UNIQUE,
+    metadata_uri TEXT,
+    description TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS locations (
+    dataset_id INTEGER NOT NULL,
+    uuid INTEGER NOT NULL,
+    PRIMARY KEY (dataset_id, uuid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS location_annotations (
+    dataset_id INTEGER NOT NULL,
+    uuid INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value,
+    value_type TEXT NOT NULL,
+    PRIMARY KEY (dataset_id, uuid, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS location_annotations_kv
+    ON location_annotations (dataset_id, key, value, uuid);
+CREATE TABLE IF NOT EXISTS data (
+    id INTEGER PRIMARY KEY,
+    dataset_id INTEGER NOT NULL,
+    uuid INTEGER NOT NULL,
+    uri TEXT NOT NULL,
+    storage_type TEXT NOT NULL,
+    metadata_uri TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS data_uri ON data (dataset_id, uri);
+CREATE INDEX IF NOT EXISTS data_location
+    ON data (dataset_id, uuid, storage_type, uri, metadata_uri);
+CREATE TABLE IF NOT EXISTS data_annotations (
+    data_id INTEGER NOT NULL,
+    dataset_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value,
+    value_type TEXT NOT NULL,
+    PRIMARY KEY (data_id, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS data_annotations_kv
+    ON data_annotations (dataset_id, key, value, data_id);
+CREATE TABLE IF NOT EXISTS annotation_stats (
+    dataset_id INTEGER NOT NULL,
+    target TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value,
+    value_type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (dataset_id, target, key, value, value_type)
+) WITHOUT ROWID;
+"""
+
+DATA_COLUMNS = "d.id, d.uuid, d.storage_type, d.uri, d.metadata_uri"
+
+
+def _slug(name: str) -> str:
+    """Build a directory name from a dataset name"""
+    return re.sub(r"\W+", "_", name.strip().lower())
+
+
+def _ids_param(values: list) -> str:
+    """Pass a list of values as one statement parameter (read by json_each)"""
+    return json.dumps(list(values))
+
+
+def _typed(value: any, value_type: str) -> any:
+    """Read back an annotation value stored with the name of its type"""
+    return bool(value) if value_type == "bool" else value
+
+
+def _location_filter(dataset_id: int, annotations: dict[str, any]
+                     ) -> tuple[str, list]:
+    """SQL condition selecting the locations that have all the annotations"""
+    if not annotations:
+        return "", []
+    select = ("SELECT uuid FROM location_annotations "
+              "WHERE dataset_id = ? AND key = ? AND value = ?")
+    sql = " AND uuid IN (" + " INTERSECT ".join(
+        [select] * len(annotations)) + ")"
+    params = []
+    for key, value in annotations.items():
+        params.extend([dataset_id, key, value])
+    return sql, params
+
+
+def _data_filter(dataset_id: int, annotations: dict[str, any]
+                 ) -> tuple[str, list]:
+    """SQL condition selecting the data that have all the annotations
+
+    A key value pair matches either the data annotations or the annotations of
+    the data location.
+    """
+    if not annotations:
+        return "", []
+    select = ("SELECT data_id FROM data_annotations "
+              "WHERE dataset_id = ? AND key = ? AND value = ? "
+              "UNION "
+              "SELECT dl.id FROM location_annotations la "
+              "JOIN data dl ON dl.dataset_id = la.dataset_id "
+              "AND dl.uuid = la.uuid "
+              "WHERE la.dataset_id = ? AND la.key = ? AND la.value = ?")
+    sql = " AND d.id IN (" + " INTERSECT ".join(
+        [f"SELECT * FROM ({select})"] * len(annotations)) + ")"
+    params = []
+    for key, value in annotations.items():
+        params.extend([dataset_id, key, value, dataset_id, key, value])
+    return sql, params
+
+
+class SxIndexSQLite(SxIndex):
+    """Dataset index stored in a SQLite database file
+
+    Configuration keys of the `index` section:
+
+    - `workspace`: directory of the datasets and of the `index.db` file,
+    - `database`: path of the database file, default to workspace/index.db,
+    - `timeout`: seconds a write waits for the lock before failing (60)
+    """
+    def __init__(self):
+        self.__workspace = None
+        self.__database = None
+        self.__timeout = 60.0
+        self.__local = threading.local()
+        self.__dataset_ids = {}
+
+    def connect(self, **kwargs):
+        self.__workspace = Path(kwargs.get("workspace", "."))
+        self.__database = Path(kwargs.get("database",
+                                          self.__workspace / "index.db"))
+        self.__timeout = float(kwargs.get("timeout", 60))
+        self.__database.parent.mkdir(parents=True, exist_ok=True)
+        con = self.__connection()
+        con.execute("PRAGMA journal_mode=WAL")
+        con.executescript(SCHEMA)
+
+    def __connection(self) -> sqlite3.Connection:
+        """Get the connection of the calling thread and process"""
+        con = getattr(self.__local, "con", None)
+        if con is None or self.__local.pid != os.getpid():
+            con = sqlite3.connect(str(self.__database),
+                                  timeout=self.__timeout,
+                                  isolation_level=None,
+                                  cached_statements=512)
+            con.execute(f"PRAGMA busy_timeout={int(self.__timeout * 1000)}")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute("PRAGMA temp_store=MEMORY")
+            self.__local.con = con
+            self.__local.pid = os.getpid()
+        return con
+
+    @contextmanager
+    def __write(self) -> Iterator[sqlite3.Cursor]:
+        """Run statements in one write transaction"""
+        con = self.__connection()
+        cur = con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield cur
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        cur.execute("COMMIT")
+
+    def __read(self, sql: str, params: list | tuple = ()) -> list[tuple]:
+        """Run a read query"""
+        return self.__connection().execute(sql, params).fetchall()
+
+    def __dataset_id(self, dataset: Dataset) -> int:
+        """Get the database id of a dataset"""
+        uri = dataset.uri.value
+        if uri not in self.__dataset_ids:
+            rows = self.__read("SELECT id FROM datasets WHERE uri = ?", (uri,))
+            if not rows:
+                raise ValueError(f"Dataset {uri} not found in the index")
+            self.__dataset_ids[uri] = rows[0][0]
+        return self.__dataset_ids[uri]
+
+    @staticmethod
+    def __update_stats(cur: sqlite3.Cursor,
+                       dataset_id: int,
+                       target: str,
+                       added: AnnotationStats = None,
+                       removed: AnnotationStats = None):
+        """Apply annotation count deltas to the statistics table"""
+        rows = []
+        if added is not None:
+            for key, values in added.counts().items():
+                for (value, type_), count in values.items():
+                    rows.append((dataset_id, target, key, value, type_,
+                                 count))
+        if removed is not None:
+            for key, values in removed.counts().items():
+                for (value, type_), count in values.items():
+                    rows.append((dataset_id, target, key, value, type_,
+                                 -count))
+        if not rows:
+            return
+        cur.executemany(
+            "INSERT INTO annotation_stats VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (dataset_id, target, key, value, value_type) "
+            "DO UPDATE SET count = count + excluded.count", rows)
+        if removed is not None:
+            cur.execute("DELETE FROM annotation_stats WHERE dataset_id = ? "
+                        "AND target = ? AND count <= 0", (dataset_id, target))
+
+    @staticmethod
+    def __data_set(dataset: Dataset, rows: list[tuple]) -> DataInfoSet:
+        """Pack (id, uuid, storage_type, uri, metadata_uri) rows"""
+        if not rows:
+            return DataInfoSet(dataset, [], [], [], [])
+        _, uuids, storage_types, uris, metadata_uris = zip(*rows)
+        return DataInfoSet(dataset, uuids, storage_types, uris, metadata_uris)
+
+    def datasets(self) -> pd.DataFrame:
+        rows = self.__read("SELECT name, uri FROM datasets ORDER BY id")
+        return pd.DataFrame(rows, columns=["name", "uri"])
+
+    def set_description(self, dataset: Dataset, metadata: dict[str, any]):
+        with self.__write() as cur:
+            cur.execute("UPDATE datasets SET description = ? WHERE id = ?",
+                        (json.dumps(metadata), self.__dataset_id(dataset)))
+
+    def get_description(self, dataset: Dataset) -> dict[str, any]:
+        rows = self.__read("SELECT description FROM datasets WHERE id = ?",
+                           (self.__dataset_id(dataset),))
+        return json.loads(rows[0][0])
+
+    def new_dataset(self, name: str) -> Dataset:
+        uri = str(self.__workspace / _slug(name))
+        with self.__write() as cur:
+            rows = cur.execute("SELECT id FROM datasets WHERE uri = ?",
+                               (uri,)).fetchall()
+            if rows and Path(uri).exists():
+                raise ValueError(f"Dataset {uri} already exists")
+            if rows:
+                # The dataset directory was removed, drop its stale entries
+                self.__purge(cur, rows[0][0])
+            cur.execute("INSERT INTO datasets (name, uri) VALUES (?, ?)",
+                        (name, uri))
+            self.__dataset_ids[uri] = cur.lastrowid
+        return Dataset.intern(name, uri)
+
+    def __purge(self, cur: sqlite3.Cursor, dataset_id: int):
+        """Remove a dataset and all its entries"""
+        for table in ("data_annotations", "data", "location_annotations",
+                      "locations", "annotation_stats"):
+            cur.execute(f"DELETE FROM {table} WHERE dataset_id = ?",
+                        (dataset_id,))
+        cur.execute("DELETE FROM datasets WHERE id = ?", (dataset_id,))
+        self.__dataset_ids = {uri: id_ for uri, id_
+                              in self.__dataset_ids.items()
+                              if id_ != dataset_id}
+
+    def get_dataset(self, uri: URI) -> Dataset:
+        rows = self.__read("SELECT name, uri, metadata_uri FROM datasets "
+                           "WHERE uri = ?", (str(uri),))
+        if not rows:
+            raise ValueError(f"Dataset {uri} not found in the index")
+        name, uri_, metadata_uri = rows[0]
+        return Dataset.intern(name, uri_, metadata_uri)
+
+    @staticmethod
+    def __insert_location(cur: sqlite3.Cursor,
+                          dataset_id: int,
+                          annotations: dict[str, any] = None) -> int:
+        """Insert a location with the next uuid of the dataset"""
+        uuid = cur.execute("SELECT COALESCE(MAX(uuid) + 1, 0) FROM locations "
+                           "WHERE dataset_id = ?", (dataset_id,)).fetchone()[0]
+        cur.execute("INSERT INTO locations VALUES (?, ?)", (dataset_id, uuid))
+        if annotations:
+            cur.executemany(
+                "INSERT INTO location_annotations VALUES (?, ?, ?, ?, ?)",
+                [(dataset_id, uuid, key, value, annotation_type(value))
+                 for key, value in annotations.items()])
+            SxIndexSQLite.__update_stats(
+                cur, dataset_id, LOCATION,
+                added=AnnotationStats.from_annotations([annotations]))
+        return uuid
+
+    def new_location(self,
+                     dataset: Dataset,
+                     annotations: dict[str, str | int | float | bool] = None
+                     ) -> Location:
+        dataset_id = self.__dataset_id(dataset)
+        with self.__write() as cur:
+            uuid = self.__insert_location(cur, dataset_id, annotations)
+        return Location.intern(dataset, uuid)
+
+    def annotate_location(self,
+                          location: Location,
+                          key: str,
+                          value: str | int | float | bool):
+        self.annotate_locations_many([location], {key: value})
+
+    def annotate_data(self,
+                      data_info: DataInfo,
+                      key: str,
+                      value: str | int | float | bool):
+        self.annotate_data_many([data_info], {key: value})
+
+    @staticmethod
+    def __annotate_many(cur: sqlite3.Cursor,
+                        dataset_id: int,
+                        target: str,
+                        ids: list[int],
+                        rows: list[dict[str, any]]):
+        """Upsert the annotations of many locations or data"""
+        if target == LOCATION:
+            table, column = "location_annotations", "uuid"
+            insert = ("INSERT INTO location_annotations "
+                      "VALUES (?, ?, ?, ?, ?) "
+                      "ON CONFLICT (dataset_id, uuid, key) "
+                      "DO UPDATE SET value = excluded.value, "
+                      "value_type = excluded.value_type")
+        else:
+            table, column = "data_annotations", "data_id"
+            insert = ("INSERT INTO data_annotations VALUES (?, ?, ?, ?, ?) "
+                      "ON CONFLICT (data_id, key) "
+                      "DO UPDATE SET value = excluded.value, "
+                      "value_type = excluded.value_type")
+        keys = {key for row in rows for key in row}
+        written = {(id_, key) for id_, row in zip(ids, rows) for key in row}
+        removed = AnnotationStats()
+        for id_, key, value, type_ in cur.execute(
+                f"SELECT {column}, key, value, value_type FROM {table} "
+                f"WHERE dataset_id = ? "
+                f"AND {column} IN (SELECT value FROM json_each(?)) "
+                f"AND key IN (SELECT value FROM json_each(?))",
+                (dataset_id, _ids_param(ids), _ids_param(keys))):
+            if (id_, key) in written:
+                removed.add({key: _typed(value, type_)})
+        values = []
+        for id_, row in zip(ids, rows):
+            for key, value in row.items():
+                if target == LOCATION:
+                    values.append((dataset_id, id_, key, value,
+                                   annotation_type(value)))
+                else:
+                    values.append((id_, dataset_id, key, value,
+                                   annotation_type(value)))
+        cur.executemany(insert, values)
+        SxIndexSQLite.__update_stats(
+            cur, dataset_id, target,
+            added=AnnotationStats.from_annotations(rows), removed=removed)
+
+    def annotate_locations_many(self,
+                                locations: list[Location],
+                                annotations: dict[str, any] | pd.DataFrame):
+        if len(locations) == 0:
+            return
+        rows = annotation_rows(len(locations), annotations)
+        dataset_id = self.__dataset_id(locations[0].dataset)
+        with self.__write() as cur:
+            self.__annotate_many(cur, dataset_id, LOCATION,
+                                 location_uuids(locations).tolist(),
+                                 rows)
+
+    def annotate_data_many(self,
+                           data_info: list[DataInfo] | DataInfoSet,
+                           annotations: dict[str, any] | pd.DataFrame):
+        if len(data_info) == 0:
+            return
+        rows = annotation_rows(len(data_info), annotations)
+        dataset_id = self.__dataset_id(data_info[0].dataset)
+        with self.__write() as cur:
+            if isinstance(data_info, DataInfoSet):
+                uris = data_info.uris.tolist()
+            else:
+                uris = [info.uri.value for info in data_info]
+            ids = self.__data_ids(cur, dataset_id, uris)
+            self.__annotate_many(cur, dataset_id, DATA, ids, rows)
+
+    @staticmethod
+    def __data_ids(cur: sqlite3.Cursor,
+                   dataset_id: int,
+                   uris: list[str]) -> list[int]:
+        """Get the database ids of data from their URIs"""
+        ids = dict(cur.execute(
+            "SELECT uri, id FROM data WHERE dataset_id = ? "
+            "AND uri IN (SELECT value FROM json_each(?))",
+            (dataset_id, _ids_param(uris))).fetchall())
+        for uri in uris:
+            if uri not in ids:
+                raise ValueError(f"Data {uri} not found in the index")
+        return [ids[uri] for uri in uris]
+
+    def create_data(self,
+                    location: Dataset | Location,
+                    uri: URI,
+                    storage_type: StorageTypes,
+                    annotations: dict[str, any] = None,
+                    metadata_uri: URI = None
+                    ) -> DataInfo:
+        dataset = location if isinstance(location, Dataset) \
+            else location.dataset
+        dataset_id = self.__dataset_id(dataset)
+        with self.__write() as cur:
+            if isinstance(location, Dataset):
+                location = Location.intern(
+                    dataset, self.__insert_location(cur, dataset_id))
+            cur.execute("INSERT INTO data (dataset_id, uuid, uri, "
+                        "storage_type, metadata_uri) VALUES (?, ?, ?, ?, ?)",
+                        (dataset_id, location.uuid, str(uri),
+                         str(storage_type),
+                         None if metadata_uri is None else str(metadata_uri)))
+            data_id = cur.lastrowid
+            if annotations:
+                cur.executemany(
+                    "INSERT INTO data_annotations VALUES (?, ?, ?, ?, ?)",
+                    [(data_id, dataset_id, key, value, annotation_type(value))
+                     for key, value in annotations.items()])
+                self.__update_stats(
+                    cur, dataset_id, DATA,
+                    added=AnnotationStats.from_annotations([annotations]))
+        return DataInfo(location=location,
+                        storage_type=StorageTypes(storage_type), uri=uri,
+                        metadata_uri=metadata_uri)
+
+    def create_data_many(self,
+                         location: Dataset | Location,
+                         uris: list[URI],
+                         storage_types: list[StorageTypes],
+                         annotations: list[dict[str, any] | None] = None,
+                         metadata_uris: list[URI | None] = None,
+                         loc_annotate: dict[str, any] = None
+                         ) -> list[DataInfo]:
+        dataset = location if isinstance(location, Dataset) \
+            else location.dataset
+        dataset_id = self.__dataset_id(dataset)
+        annotations = annotations or [None] * len(uris)
+        metadata_uris = metadata_uris or [None] * len(uris)
+        with self.__write() as cur:
+            if isinstance(location, Dataset):
+                location = Location.intern(dataset, self.__insert_location(
+                    cur, dataset_id, loc_annotate))
+            rows = []
+            for uri, storage_type, ann, metadata_uri in zip(
+                    uris, storage_types, annotations, metadata_uris):
+                cur.execute("INSERT INTO data (dataset_id, uuid, uri, "
+                            "storage_type, metadata_uri) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (dataset_id, location.uuid, str(uri),
+                             str(storage_type),
+                             None if metadata_uri is None
+                             else str(metadata_uri)))
+                rows.extend((cur.lastrowid, dataset_id, key, value,
+                             annotation_type(value))
+                            for key, value in (ann or {}).items())
+            if rows:
+                cur.executemany(
+                    "INSERT INTO data_annotations VALUES (?, ?, ?, ?, ?)",
+                    rows)
+                self.__update_stats(
+                    cur, dataset_id, DATA,
+                    added=AnnotationStats.from_annotations(
+                        [ann for ann in annotations if ann]))
+        return [DataInfo(location=location,
+                         storage_type=StorageTypes(storage_type), uri=uri,
+                         metadata_uri=metadata_uri)
+                for uri, storage_type, metadata_uri
+                in zip(uris, storage_types, metadata_uris)]
+
+    def get_data_info(self, dataset: Dataset, data_uri: URI) -> DataInfo | None:
+        rows = self.__read(f"SELECT {DATA_COLUMNS} FROM data d "
+                           f"WHERE d.dataset_id = ? AND d.uri = ?",
+                           (self.__dataset_id(dataset), str(data_uri)))
+        if not rows:
+            return None
+        return self.__data_set(dataset, rows)[0]
+
+    def query_data_at(self,
+                      dataset: Dataset,
+                      locations: list[Location] | DataInfoSet
+                      ) -> DataInfoSet:
+        rows = self.__read(
+            f"SELECT {DATA_COLUMNS} FROM data d WHERE d.dataset_id = ? "
+            f"AND d.uuid IN (SELECT value FROM json_each(?)) ORDER BY d.id",
+            (self.__dataset_id(dataset),
+             _ids_param(location_uuids(locations).tolist())))
+        return self.__data_set(dataset, rows)
+
+    def __query_rows(self, dataset_id: int, annotations: dict[str, any]
+                     ) -> list[tuple]:
+        """Get the data rows matching annotations"""
+        sql, params = _data_filter(dataset_id, annotations)
+        return self.__read(
+            f"SELECT {DATA_COLUMNS} FROM data d WHERE d.dataset_id = ?"
+            f"{sql} ORDER BY d.id",
+            [dataset_id] + params)
+
+    def query_data_single(self,
+                          dataset: Dataset,
+                          annotations: dict[str, any] = None
+                          ) -> DataInfoSet:
+        rows = self.__query_rows(self.__dataset_id(dataset), annotations)
+        return self.__data_set(dataset, rows)
+
+    def query_data_loc_set(self,
+                           dataset: Dataset,
+                           annotations: list[dict[str: any]]
+                           ) -> list[list[DataInfo]]:
+        dataset_id = self.__dataset_id(dataset)
+        per_query = []
+        for ann in annotations:
+            by_location = {}
+            for info in self.__data_set(dataset,
+                                        self.__query_rows(dataset_id, ann)):
+                by_location.setdefault(info.location.uuid, []).append(info)
+            per_query.append(by_location)
+        common = set(per_query[0]) if per_query else set()
+        for by_location in per_query[1:]:
+            common &= set(by_location)
+        out = []
+        for uuid in sorted(common):
+            out.extend(list(item) for item in itertools.product(
+                *[by_location[uuid] for by_location in per_query]))
+        return out
+
+    def query_data_group_set(self,
+                             dataset: Dataset,
+                             annotations: list[dict[str: any]]
+                             ) -> list[DataInfoSet]:
+        return [self.query_data_single(dataset, ann) for ann in annotations]
+
+    def query_location(self,
+                       dataset: Dataset,
+                       annotations: dict[str, any] = None,
+                       ) -> list[Location]:
+        dataset_id = self.__dataset_id(dataset)
+        sql, params = _location_filter(dataset_id, annotations)
+        rows = self.__read(f"SELECT uuid FROM locations WHERE dataset_id = ?"
+                           f"{sql} ORDER BY uuid",
+                           [dataset_id] + params)
+        return [Location.intern(dataset, row[0]) for row in rows]
+
+    def count_data(self,
+                   dataset: Dataset,
+                   annotations: dict[str, any] = None
+                   ) -> int:
+        dataset_id = self.__dataset_id(dataset)
+        sql, params = _data_filter(dataset_id, annotations)
+        return self.__read(f"SELECT COUNT(*) FROM data d "
+                           f"WHERE d.dataset_id = ?{sql}",
+                           [dataset_id] + params
+                           )[0][0]
+
+    def __annotation_values(self, dataset: Dataset, target: str
+                            ) -> dict[str, list[any]]:
+        """Read the annotation statistics of a dataset"""
+        dataset_id = self.__dataset_id(dataset)
+        out = {}
+        for key, value, type_ in self.__read(
+                "SELECT key, value, value_type FROM annotation_stats "
+                "WHERE dataset_id = ? AND target = ?",
+                (dataset_id, target)):
+            out.setdefault(key, []).append(_typed(value, type_))
+        return out
+
+    def query_data_annotation(self, dataset: Dataset) -> dict[str, list[any]]:
+        return self.__annotation_values(dataset, DATA)
+
+    def query_location_annotation(self, dataset: Dataset
+                                  ) -> dict[str, list[any]]:
+        return self.__annotation_values(dataset, LOCATION)
+
+    def __annotation_columns(self,
+                             dataset_id: int,
+                             target: str,
+                             ids: list[int],
+                             keys: list[str]
+                             ) -> dict[str, list]:
+        """Fetch annotation columns aligned on the given object ids"""
+        if target == LOCATION:
+            table, column = "location_annotations", "uuid"
+        else:
+            table, column = "data_annotations", "data_id"
+        columns = {}
+        id_range = (min(ids), max(ids)) if ids else (0, -1)
+        for key in keys:
+            values = {id_: _typed(value, type_) for id_, value, type_
+                      in self.__read(
+                          f"SELECT {column}, value, value_type FROM {table} "
+                          f"WHERE dataset_id = ? AND key = ? "
+                          f"AND {column} BETWEEN ? AND ?",
+                          (dataset_id, key, id_range[0], id_range[1]))}
+            columns[key] = [values.get(id_) for id_ in ids]
+        return columns
+
+    def __location_chunks(self,
+                          dataset: Dataset,
+                          annotations: dict[str, any],
+                          columns: list[str],
+                          chunk_size: int | None
+                          ) -> Iterator[pd.DataFrame]:
+        """Build the locations view by chunks of rows"""
+        dataset_id = self.__dataset_id(dataset)
+        categories = self.query_location_annotation(dataset)
+        names = view_columns(LOCATION_VIEW_COLUMNS, list(categories), columns)
+        keys = [name for name in names if name not in LOCATION_VIEW_COLUMNS]
+        sql, params = _location_filter(dataset_id, annotations)
+        last = -1
+        while True:
+            rows = self.__read(
+                f"SELECT uuid FROM locations WHERE dataset_id = ? "
+                f"AND uuid > ?{sql} ORDER BY uuid LIMIT ?",
+                [dataset_id, last] + params + [chunk_size or -1])
+            uuids = [row[0] for row in rows]
+            if not uuids and last >= 0:
+                return
+            data = {"location": uuids}
+            data.update(self.__annotation_columns(dataset_id, LOCATION,
+                                                  uuids, keys))
+            yield view_frame({name: data[name] for name in names},
+                             {key: categories[key] for key in keys})
+            if not uuids or chunk_size is None or len(uuids) < chunk_size:
+                return
+            last = uuids[-1]
+
+    def __data_chunks(self,
+                      dataset: Dataset,
+                      locations: list[Location] | DataInfoSet,
+                      annotations: dict[str, any],
+                      columns: list[str],
+                      chunk_size: int | None
+                      ) -> Iterator[pd.DataFrame]:
+        """Build the data view by chunks of rows"""
+        dataset_id = self.__dataset_id(dataset)
+        categories = self.query_data_annotation(dataset)
+        names = view_columns(DATA_VIEW_COLUMNS, list(categories), columns)
+        keys = [name for name in names if name not in DATA_VIEW_COLUMNS]
+        sql, params = _data_filter(dataset_id, annotations)
+        if locations is not None:
+            sql += " AND d.uuid IN (SELECT value FROM json_each(?))"
+            params.append(_ids_param(location_uuids(locations).tolist()))
+        last = -1
+        while True:
+            rows = self.__read(
+                f"SELECT {DATA_COLUMNS} FROM data d WHERE d.dataset_id = ? "
+                f"AND d.id > ?{sql} ORDER BY d.id LIMIT ?",
+                [dataset_id, last] + params + [chunk_size or -1])
+            if not rows and last >= 0:
+                return
+            ids, uuids, storage_types, uris, metadata_uris = \
+                (list(column) for column in zip(*rows)) if rows \
+                else ([], [], [], [], [])
+            data = {"uri": uris, "location": uuids,
+                    "storage_type": storage_types,
+                    "metadata_uri": metadata_uris}
+            data.update(self.__annotation_columns(dataset_id, DATA, ids, keys))
+            categorical = {key: categories[key] for key in keys}
+            categorical["storage_type"] = [str(type_)
+                                           for type_ in StorageTypes]
+            yield view_frame({name: data[name] for name in names},
+                             categorical)
+            if not rows or chunk_size is None or len(rows) < chunk_size:
+                return
+            last = ids[-1]
+
+    def view_locations(self,
+                       dataset: Dataset,
+                       annotations: dict[str, any] = None,
+                       columns: list[str] = None
+                       ) -> pd.DataFrame:
+        return next(self.__location_chunks(dataset, annotations, columns,
+                                           None))
+
+    def view_data(self,
+                  dataset: Dataset,
+                  locations: list[Location] | DataInfoSet = None,
+                  annotations: dict[str, any] = None,
+                  columns: list[str] = None
+                  ) -> pd.DataFrame:
+        return next(self.__data_chunks(dataset, locations, annotations,
+                                       columns, None))
+
+    def iter_view_locations(self,
+                            dataset: Dataset,
+                            annotations: dict[str, any] = None,
+                            columns: list[str] = None,
+                            chunk_size: int = 100000
+                            ) -> Iterator[pd.DataFrame]:
+        return self.__location_chunks(dataset, annotations, columns,
+                                      chunk_size)
+
+    def iter_view_data(self,
+                       dataset: Dataset,
+                       locations: list[Location] | DataInfoSet = None,
+                       annotations: dict[str, any] = None,
+                       columns: list[str] = None,
+                       chunk_size: int = 100000
+                       ) -> Iterator[pd.DataFrame]:
+        return self.__data_chunks(dataset, locations, annotations, columns,
+                                  chunk_size)
+
+    def snapshot(self, dataset: Dataset) -> IndexSnapshot:
+        dataset_id = self.__dataset_id(dataset)
+        locations = self.__read("SELECT uuid FROM locations "
+                                "WHERE dataset_id = ? ORDER BY uuid",
+                                (dataset_id,))
+        location_ann = self.__read("SELECT uuid, key, value, value_type "
+                                   "FROM location_annotations "
+                                   "WHERE dataset_id = ?", (dataset_id,))
+        data = self.__read("SELECT uri, uuid, storage_type, metadata_uri "
+                           "FROM data WHERE dataset_id = ? ORDER BY id",
+                           (dataset_id,))
+        data_ann = self.__read("SELECT d.uri, a.key, a.value, a.value_type "
+                               "FROM data_annotations a "
+                               "JOIN data d ON d.id = a.data_id "
+                               "WHERE a.dataset_id = ?", (dataset_id,))
+        for rows in (location_ann, data_ann):
+            rows[:] = [(id_, key, _typed(value, type_))
+                       for id_, key, value, type_ in rows]
+        return IndexSnapshot(
+            dataset={"name": dataset.name,
+                     "uri": self.__relative_uri(dataset.uri.value),
+                     "metadata_uri": None if dataset.metadata_uri is None
+                     else dataset.metadata_uri.value,
+                     "description": self.get_description(dataset)},
+            locations=pd.DataFrame(locations, columns=["location"]),
+            location_annotations=annotations_table(
+                *([list(col) for col in zip(*location_ann)]
+                  if location_ann else ([], [], [])), "location"),
+            data=pd.DataFrame(data, columns=DATA_VIEW_COLUMNS),
+            data_annotations=annotations_table(
+                *([list(col) for col in zip(*data_ann)]
+                  if data_ann else ([], [], [])), "uri")
+        )
+
+    def __relative_uri(self, uri: str) -> str:
+        """Get a dataset URI relative to the workspace, if it is in it"""
+        try:
+            return Path(uri).relative_to(self.__workspace).as_posix()
+        except ValueError:
+            return uri
+
+    def load_snapshot(self, snapshot: IndexSnapshot) -> Dataset:
+        info = snapshot.dataset
+        uri = str(self.__workspace / info["uri"])
+        location_ann = snapshot.location_annotations_of()
+        data_ann = snapshot.data_annotations_of()
+        location_stats = AnnotationStats.from_annotations(
+            list(location_ann.values()))
+        data_stats = AnnotationStats.from_annotations(list(data_ann.values()))
+        with self.__write() as cur:
+            if cur.execute("SELECT 1 FROM datasets WHERE uri = ?",
+                           (uri,)).fetchall():
+                raise ValueError(f"Dataset {uri} already exists")
+            cur.execute("INSERT INTO datasets (name, uri, metadata_uri, "
+                        "description) VALUES (?, ?, ?, ?)",
+                        (info["name"], uri, info["metadata_uri"],
+                         json.dumps(info["description"])))
+            dataset_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO locations VALUES (?, ?)",
+                ((dataset_id, int(uuid))
+                 for uuid in snapshot.locations["location"].tolist()))
+            cur.executemany(
+                "INSERT INTO location_annotations VALUES (?, ?, ?, ?, ?)",
+                ((dataset_id, int(uuid), key, value, annotation_type(value))
+                 for uuid, ann in location_ann.items()
+                 for key, value in ann.items()))
+            cur.executemany(
+                "INSERT INTO data (dataset_id, uuid, uri, storage_type, "
+                "metadata_uri) VALUES (?, ?, ?, ?, ?)",
+                ((dataset_id, int(row.location), row.uri, row.storage_type,
+                  row.metadata_uri)
+                 for row in snapshot.data.itertuples(index=False)))
+            ids = dict(cur.execute("SELECT uri, id FROM data "
+                                   "WHERE dataset_id = ?", (dataset_id,)))
+            cur.executemany(
+                "INSERT INTO data_annotations VALUES (?, ?, ?, ?, ?)",
+                ((ids[uri], dataset_id, key, value, annotation_type(value))
+                 for uri, ann in data_ann.items()
+                 for key, value in ann.items()))
+            self.__update_stats(cur, dataset_id, LOCATION,
+                                added=location_stats)
+            self.__update_stats(cur, dataset_id, DATA, added=data_stats)
+        self.__dataset_ids[uri] = dataset_id
+        return Dataset.intern(info["name"], uri, info["metadata_uri"])
+
+    def delete(self, data_info: DataInfo):
+        dataset_id = self.__dataset_id(data_info.dataset)
+        with self.__write() as cur:
+            rows = cur.execute("SELECT id FROM data WHERE dataset_id = ? "
+                               "AND uri = ?",
+                               (dataset_id, data_info.uri.value)).fetchall()
+            if not rows:
+                return
+            data_id = rows[0][0]
+            annotations = {key: _typed(value, type_)
+                           for key, value, type_ in cur.execute(
+                               "SELECT key, value, value_type "
+                               "FROM data_annotations WHERE data_id = ?",
+                               (data_id,))}
+            cur.execute("DELETE FROM data_annotations WHERE data_id = ?",
+                        (data_id,))
+            cur.execute("DELETE FROM data WHERE id = ?", (data_id,))
+            self.__update_stats(
+                cur, dataset_id, DATA,
+                removed=AnnotationStats.from_annotations([annotations]))
+
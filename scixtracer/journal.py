@@ -0,0 +1,279 @@
+"""Append-only journal of a run, used to resume an interrupted run
+
+A run journal is a directory named after the run identifier with three files:
+
+- `plan.json`: the dataset, the options, the item fingerprints, the
+  outputs that need not be written and the output annotations of the jobs
+  of the run,
+- `plan.bin`: the batches of the run in the scixtracer binary format,
+- `journal.jsonl`: one JSON event per line, `started`, `completed` (with the
+  output URIs), `failed`, `finished` and `replaced` (a planned output
+  created again with a new URI by a resumed run).
+
+The events are written with group commit: they are buffered and written with
+a single write and fsync when the buffer is full, when the flush interval is
+elapsed, and when the run ends. A crash loses at most the last group, so a
+resumed run may run again a few items that were completed, which only
+rewrites the same outputs. A torn last line is ignored when reading.
+"""
+from pathlib import Path
+import json
+import os
+import struct
+import threading
+import time
+
+from .models import Dataset
+from .models import Batch
+from .models import ItemFailure
+
+
+JOURNAL_VERSION = 1
+
+_PLAN_LENGTH = struct.Struct(">Q")
+
+Node = tuple[int, int]
+
+
+class JournalWriter:
+    """Buffered writer of journal events with group commit
+
+    :param path: Journal file, opened in append mode,
+    :param group_size: Number of events written at once,
+    :param interval: Maximum time in seconds an event stays in the buffer
+                     when other events are appended
+    """
+    def __init__(self, path: Path, group_size: int = 256,
+                 interval: float = 1.0):
+        self.__file = open(path, "ab")
+        self.__group_size = group_size
+        self.__interval = interval
+        self.__buffer = []
+        self.__last_flush = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def append(self, event: dict[str, any]):
+        """Add an event to the journal
+
+        :param event: JSON serializable event
+        """
+        with self.__lock:
+            self.__buffer.append(json.dumps(event, separators=(",", ":")))
+            if len(self.__buffer) >= self.__group_size or \
+                    time.monotonic() - self.__last_flush >= self.__interval:
+                self.__flush()
+
+    def __flush(self):
+        """Write the buffered events and sync them to the disk"""
+        if self.__buffer:
+            self.__file.write(("\n".join(self.__buffer) + "\n").encode())
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__buffer = []
+        self.__last_flush = time.monotonic()
+
+    def flush(self):
+        """Write the buffered events and sync them to the disk"""
+        with self.__lock:
+            self.__flush()
+
+    def close(self):
+        """Flush the events and close the file"""
+        with self.__lock:
+            self.__flush()
+            self.__file.close()
+
+
+def read_events(path: Path) -> list[dict[str, any]]:
+    """Read the events of a journal file
+
+    :param path: Journal file,
+    :return: The events, without a torn last line
+    """
+    events = []
+    if not path.exists():
+        return events
+    with open(path, "rb") as file:
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+    return events
+
+
+class RunJournal:
+    """Journal of a run
+
+    :param directory: Directory of the journal, named after the run id
+    """
+    def __init__(self, directory: Path | str):
+        self.__directory = Path(directory)
+        self.__writer = None
+        self.__nodes = None
+
+    @property
+    def run_id(self) -> str:
+        """Identifier of the run"""
+        return self.__directory.name
+
+    @property
+    def directory(self) -> Path:
+        """Directory of the journal"""
+        return self.__directory
+
+    def write_plan(self,
+                   dataset: Dataset,
+                   batches: list[Batch],
+                   fingerprints: list[list[str | None]],
+                   cache: bool,
+                   transient: list[str] = None,
+                   outputs: list[list[dict[str, any]]] = None):
+        """Write the plan of the run before it starts
+
+        :param dataset: Dataset of the run,
+        :param batches: Batches of the run,
+        :param fingerprints: Fingerprint of each item, None if not cached,
+        :param cache: True if the run is cache-aware,
+        :param transient: URIs of the outputs that need not be written,
+        :param outputs: Annotations of the outputs of the job of each batch,
+        :raise pickle.PickleError: If a parameter of the batches cannot be
+                                   written or read back
+        """
+        messages = [batch.to_bytes() for batch in batches]
+        for message in messages:
+            Batch.from_bytes(message)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        with open(self.__directory / "plan.bin", "wb") as file:
+            for message in messages:
+                file.write(_PLAN_LENGTH.pack(len(message)))
+                file.write(message)
+            file.flush()
+            os.fsync(file.fileno())
+        with open(self.__directory / "plan.json", "w",
+                  encoding="utf-8") as file:
+            json.dump({"version": JOURNAL_VERSION,
+                       "dataset": {"name": dataset.name,
+                                   "uri": dataset.uri.value,
+                                   "metadata_uri": dataset.metadata_value},
+                       "cache": cache,
+                       "items": [len(batch) for batch in batches],
+                       "fingerprints": fingerprints,
+                       "transient": transient or [],
+                       "outputs": outputs or [[] for _ in batches]}, file)
+
+    def read_plan(self) -> tuple[Dataset, list[Batch], list[list[str | None]],
+                                 bool, list[str], list[list[dict[str, any]]]]:
+        """Read the plan of the run
+
+        :return: The dataset, the batches, the item fingerprints, the cache
+                 option, the transient outputs and the output annotations
+                 of the jobs of the run
+        """
+        with open(self.__directory / "plan.json", "r",
+                  encoding="utf-8") as file:
+            plan = json.load(file)
+        if plan.get("version") != JOURNAL_VERSION:
+            raise ValueError(f"Unsupported run journal version "
+                             f"{plan.get('version')}")
+        batches = []
+        with open(self.__directory / "plan.bin", "rb") as file:
+            content = file.read()
+        offset = 0
+        while offset < len(content):
+            (length,) = _PLAN_LENGTH.unpack_from(content, offset)
+            offset += _PLAN_LENGTH.size
+            batches.append(Batch.from_bytes(content[offset:offset + length]))
+            offset += length
+        dataset = Dataset.intern(**plan["dataset"])
+        return (dataset, batches, plan["fingerprints"], plan["cache"],
+                plan.get("transient", []),
+                plan.get("outputs", [[] for _ in batches]))
+
+    def completed(self) -> set[Node]:
+        """Get the items completed according to the journal
+
+        :return: The batch and item index of the completed items
+        """
+        return {(event["batch"], event["item"])
+                for event in read_events(self.__directory / "journal.jsonl")
+                if event["event"] == "completed"}
+
+    def replacements(self) -> dict[str, str]:
+        """Get the planned outputs created again by resumed runs
+
+        :return: The last URI of each planned output URI that was replaced
+        """
+        replaced = {event["old"]: event["new"]
+                    for event in read_events(self.__directory /
+                                             "journal.jsonl")
+                    if event["event"] == "replaced"}
+        latest = {}
+        for uri in replaced:
+            new_uri = uri
+            while new_uri in replaced:
+                new_uri = replaced[new_uri]
+            latest[uri] = new_uri
+        return latest
+
+    def replaced(self, uris: dict[str, str]):
+        """Record that planned outputs were created again with new URIs
+
+        :param uris: New URI of each replaced output URI
+        """
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        writer = JournalWriter(self.__directory / "journal.jsonl")
+        for old, new in uris.items():
+            writer.append({"event": "replaced", "old": old, "new": new})
+        writer.close()
+
+    def open(self, nodes: dict[Node, list[Node]] = None):
+        """Start writing events
+
+        :param nodes: Nodes in the journal of each node of the running
+                      batches, if they are a subset of the planned batches
+                      or if their items are fused
+        """
+        self.__nodes = nodes
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        self.__writer = JournalWriter(self.__directory / "journal.jsonl")
+
+    def __node(self, node: Node) -> list[Node]:
+        return [node] if self.__nodes is None else self.__nodes[node]
+
+    def started(self, node: Node):
+        """Record that an item started
+
+        :param node: Batch and item index of the item
+        """
+        for batch, item in self.__node(node):
+            self.__writer.append({"event": "started", "batch": batch,
+                                  "item": item})
+
+    def done(self, node: Node, outputs: list[str]):
+        """Record that an item completed
+
+        :param node: Batch and item index of the item,
+        :param outputs: URIs of the item outputs
+        """
+        for batch, item in self.__node(node):
+            self.__writer.append({"event": "completed", "batch": batch,
+                                  "item": item, "outputs": outputs})
+
+    def failed(self, failure: ItemFailure):
+        """Record that an item failed
+
+        :param failure: Description of the failure
+        """
+        for batch, item in self.__node((failure.batch, failure.item)):
+            self.__writer.append({"event": "failed", "batch": batch,
+                                  "item": item, "error": failure.error})
+
+    def close(self, finished: bool = True):
+        """Flush the events and close the journal
+
+        :param finished: Record that the run reached its end
+        """
+        if finished:
+            self.__writer.append({"event": "finished", "time": time.time()})
+        self.__writer.close()
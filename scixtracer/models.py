@@ -1,9 +1,20 @@
-"""Module to define the data models used by sciXtracer"""
-from typing import Callable
+"""Module to define the data models used by sciXtracer
+
+The index, storage and metadata backends build a URI and a DataInfo for each
+row they read, so these two row types are slotted dataclasses. Their
+constructors only check the field types and convert a storage type name,
+which is about twice as fast as a pydantic validation (see
+benchmarks/bench_models.py). The other models are pydantic models.
+"""
+from dataclasses import dataclass
+from typing import Callable, Iterator
 from enum import StrEnum
 from pathlib import Path
+import threading
+import weakref
 
-from pydantic import BaseModel
+import numpy as np
+from pydantic import BaseModel, ConfigDict
 
 
 class StorageTypes(StrEnum):
@@ -14,10 +25,37 @@ class StorageTypes(StrEnum):
     LABEL = "Label"
 
 
-class URI(BaseModel):
+# Storage types of a DataInfoSet, stored as indexes in this tuple
+_STORAGE_MEMBERS = tuple(StorageTypes)
+_STORAGE_CODES = {str(type_): code
+                  for code, type_ in enumerate(_STORAGE_MEMBERS)}
+_STORAGE_NAMES = np.asarray([str(type_) for type_ in _STORAGE_MEMBERS],
+                            dtype=object)
+
+
+def _storage_codes(storage_types: np.ndarray | list[str]) -> np.ndarray:
+    """Encode storage types as indexes in the storage types tuple"""
+    values = np.asarray(storage_types)
+    if values.dtype.kind in "iu":
+        return values.astype(np.int8)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int8)
+    names, inverse = np.unique(values.astype(str), return_inverse=True)
+    codes = np.asarray([_STORAGE_CODES[str(StorageTypes(name))]
+                        for name in names], dtype=np.int8)
+    return codes[inverse.reshape(-1)]
+
+
+@dataclass(frozen=True, slots=True)
+class URI:
     """Unique identifier of a data (eg path)"""
     value: str
 
+    def __post_init__(self):
+        if not isinstance(self.value, str):
+            raise TypeError(f"URI value must be a str, not "
+                            f"{type(self.value).__name__}")
+
     def __str__(self):
         return self.value
 
@@ -30,25 +68,116 @@ def uri(value: str | Path):
     return URI(value=str(value))
 
 
+# Registries of the Dataset and Location instances alive in the session.
+_INTERN_LOCK = threading.Lock()
+_DATASETS = weakref.WeakValueDictionary()
+_LOCATIONS = weakref.WeakValueDictionary()
+
+
 class Dataset(BaseModel):
-    """Information about a dataset"""
+    """Information about a dataset
+
+    Datasets are immutable. Use :meth:`intern` to share one instance per
+    dataset URI in the session.
+    """
+    model_config = ConfigDict(frozen=True)
+
     name: str
     uri: URI
-    metadata_uri: URI = None
+    metadata_uri: URI | None = None
+
+    @classmethod
+    def intern(cls,
+               name: str,
+               uri: URI | str,
+               metadata_uri: URI | str | None = None
+               ) -> "Dataset":
+        """Get the shared instance of a dataset
+
+        :param name: Name of the dataset,
+        :param uri: Unique identifier of the dataset,
+        :param metadata_uri: Unique identifier of the dataset metadata,
+        :return: The dataset instance registered for this URI
+        """
+        uri_value = str(uri)
+        metadata_value = None if metadata_uri is None else str(metadata_uri)
+        with _INTERN_LOCK:
+            dataset = _DATASETS.get(uri_value)
+            if dataset is None or dataset.name != name or \
+                    dataset.metadata_value != metadata_value:
+                dataset = cls(name=str(name),
+                              uri=URI(value=uri_value),
+                              metadata_uri=None if metadata_value is None
+                              else URI(value=metadata_value))
+                _DATASETS[uri_value] = dataset
+        return dataset
+
+    @property
+    def metadata_value(self) -> str | None:
+        """Value of the metadata URI, None if the dataset has no metadata"""
+        return None if self.metadata_uri is None else self.metadata_uri.value
+
+    def __reduce__(self):
+        return Dataset.intern, (self.name, self.uri.value, self.metadata_value)
 
 
 class Location(BaseModel):
-    """Information of a dataset location"""
+    """Information of a dataset location
+
+    Locations are immutable. Use :meth:`intern` to share one instance per
+    dataset location in the session.
+    """
+    model_config = ConfigDict(frozen=True)
+
     dataset: Dataset
     uuid: int
 
+    @classmethod
+    def intern(cls, dataset: Dataset, uuid: int) -> "Location":
+        """Get the shared instance of a location
 
-class DataInfo(BaseModel):
+        :param dataset: Dataset of the location,
+        :param uuid: Identifier of the location in the dataset,
+        :return: The location instance registered for this dataset and uuid
+        """
+        key = (dataset.uri.value, uuid)
+        location = _LOCATIONS.get(key)
+        if location is not None and location.dataset is dataset:
+            return location
+        if _DATASETS.get(dataset.uri.value) is not dataset:
+            dataset = Dataset.intern(dataset.name, dataset.uri,
+                                     dataset.metadata_uri)
+        with _INTERN_LOCK:
+            location = _LOCATIONS.get(key)
+            if location is None or location.dataset is not dataset:
+                location = cls(dataset=dataset, uuid=int(uuid))
+                _LOCATIONS[key] = location
+        return location
+
+    def __reduce__(self):
+        return Location.intern, (self.dataset, self.uuid)
+
+
+@dataclass(slots=True)
+class DataInfo:
     """Information about one data in a project"""
     location: Location
     storage_type: StorageTypes
     uri: URI
-    metadata_uri: URI
+    metadata_uri: URI | None = None
+
+    def __post_init__(self):
+        if not isinstance(self.location, Location):
+            raise TypeError(f"DataInfo location must be a Location, not "
+                            f"{type(self.location).__name__}")
+        if not isinstance(self.storage_type, StorageTypes):
+            self.storage_type = StorageTypes(self.storage_type)
+        for name in ("uri", "metadata_uri"):
+            value = getattr(self, name)
+            if not isinstance(value, URI) and \
+                    (name == "uri" or value is not None):
+                raise TypeError(f"DataInfo {name} must be a URI, not "
+                                f"{type(value).__name__}")
 
     @property
     def dataset(self) -> Dataset:
@@ -56,6 +185,180 @@ class DataInfo(BaseModel):
         return self.location.dataset
 
 
+class DataInfoSet:
+    """Compact set of data information sharing one dataset
+
+    The information is stored as one array per field (location uuid, storage
+    type, URI and metadata URI) instead of one DataInfo object per data. The
+    set can be filtered and sliced with vectorized operations, and a DataInfo
+    is only built when an element is accessed.
+
+    The set keeps the list semantics of the query results: it can be
+    iterated, indexed, compared with a list of DataInfo and concatenated
+    with a list or another set, which gives a list.
+
+    :param dataset: Dataset of all the data,
+    :param uuids: Location uuid of each data,
+    :param storage_types: Storage type of each data,
+    :param uris: URI of each data,
+    :param metadata_uris: Metadata URI of each data (None if no metadata)
+    """
+    def __init__(self,
+                 dataset: Dataset,
+                 uuids: np.ndarray | list[int],
+                 storage_types: np.ndarray | list[str],
+                 uris: np.ndarray | list[str],
+                 metadata_uris: np.ndarray | list[str | None] = None):
+        self.__dataset = dataset
+        self.__uuids = np.asarray(uuids, dtype=np.int64)
+        self.__storage_codes = _storage_codes(storage_types)
+        self.__uris = np.asarray(uris, dtype=object)
+        if metadata_uris is None:
+            metadata_uris = np.full(len(self.__uris), None, dtype=object)
+        self.__metadata_uris = np.asarray(metadata_uris, dtype=object)
+        self.__locations = {}
+
+    @classmethod
+    def from_list(cls, dataset: Dataset, data_info: list[DataInfo]
+                  ) -> "DataInfoSet":
+        """Pack a list of data information
+
+        :param dataset: Dataset of the data,
+        :param data_info: Information of the data,
+        :return: The data set
+        """
+        return cls(dataset,
+                   [info.location.uuid for info in data_info],
+                   [str(info.storage_type) for info in data_info],
+                   [info.uri.value for info in data_info],
+                   [None if info.metadata_uri is None
+                    else info.metadata_uri.value for info in data_info])
+
+    @property
+    def dataset(self) -> Dataset:
+        """Dataset shared by all the data"""
+        return self.__dataset
+
+    @property
+    def uuids(self) -> np.ndarray:
+        """Location uuid of each data"""
+        return self.__uuids
+
+    @property
+    def storage_types(self) -> np.ndarray:
+        """Storage type of each data"""
+        return _STORAGE_NAMES[self.__storage_codes]
+
+    @property
+    def uris(self) -> np.ndarray:
+        """URI of each data"""
+        return self.__uris
+
+    @property
+    def metadata_uris(self) -> np.ndarray:
+        """Metadata URI of each data"""
+        return self.__metadata_uris
+
+    def __len__(self):
+        return len(self.__uris)
+
+    def __element(self, index: int) -> DataInfo:
+        """Build the information of one data"""
+        uuid = int(self.__uuids[index])
+        location = self.__locations.get(uuid)
+        if location is None:
+            location = Location.intern(self.__dataset, uuid)
+            self.__locations[uuid] = location
+        metadata_uri = self.__metadata_uris[index]
+        return DataInfo(
+            location=location,
+            storage_type=_STORAGE_MEMBERS[self.__storage_codes[index]],
+            uri=URI(value=self.__uris[index]),
+            metadata_uri=None if metadata_uri is None
+            else URI(value=metadata_uri)
+        )
+
+    def __getitem__(self, index: int | slice | np.ndarray | list
+                    ) -> "DataInfo | DataInfoSet":
+        if isinstance(index, (int, np.integer)):
+            return self.__element(index)
+        return DataInfoSet(self.__dataset,
+                           self.__uuids[index],
+                           self.__storage_codes[index],
+                           self.__uris[index],
+                           self.__metadata_uris[index])
+
+    def __iter__(self) -> Iterator[DataInfo]:
+        for index in range(len(self)):
+            yield self.__element(index)
+
+    def __eq__(self, other: any) -> bool:
+        if isinstance(other, (list, DataInfoSet)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __add__(self, other: any) -> list[DataInfo]:
+        if isinstance(other, (list, DataInfoSet)):
+            return self.to_list() + list(other)
+        return NotImplemented
+
+    def __radd__(self, other: any) -> list[DataInfo]:
+        if isinstance(other, list):
+            return other + self.to_list()
+        return NotImplemented
+
+    def filter(self,
+               mask: np.ndarray = None,
+               storage_type: StorageTypes = None,
+               locations: "list[Location] | DataInfoSet" = None
+               ) -> "DataInfoSet":
+        """Select data with vectorized conditions
+
+        :param mask: Boolean array selecting the data,
+        :param storage_type: Keep only the data of this storage type,
+        :param locations: Keep only the data at these locations,
+        :return: The selected data
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if mask is not None:
+            keep &= np.asarray(mask, dtype=bool)
+        if storage_type is not None:
+            keep &= self.__storage_codes == \
+                _STORAGE_CODES[str(StorageTypes(storage_type))]
+        if locations is not None:
+            keep &= np.isin(self.__uuids, location_uuids(locations))
+        return self[keep]
+
+    def locations(self) -> list[Location]:
+        """Get the distinct locations of the data
+
+        :return: The locations sorted by uuid
+        """
+        return [Location.intern(self.__dataset, int(uuid))
+                for uuid in np.unique(self.__uuids)]
+
+    def to_list(self) -> list[DataInfo]:
+        """Build the information of every data
+
+        :return: The list of data information
+        """
+        return list(self)
+
+
+def location_uuids(locations: "list[Location] | DataInfoSet") -> np.ndarray:
+    """Get the uuids of locations given as a list or as a data set
+
+    :param locations: Locations, or data whose locations are used,
+    :return: The location uuids
+    """
+    if isinstance(locations, DataInfoSet):
+        return np.unique(locations.uuids)
+    return np.asarray([location.uuid for location in locations],
+                      dtype=np.int64)
+
+
 DataInstance = any
 
 
@@ -74,31 +377,70 @@ class Metadata:
         return list(self.value.keys())
 
 
+_NOT_LOADED = object()
+
+
 class Data:
-    """Container for both the data info and value"""
+    """Container for both the data info and value
+
+    The value and the metadata can be given, or loaded on first access with
+    the loader functions. A loaded payload can be dropped with
+    :meth:`release` and is then loaded again on the next access.
+
+    :param info: Information of the data,
+    :param metadata: Metadata of the data,
+    :param value: Value of the data,
+    :param value_loader: Function reading the value from the data info,
+    :param metadata_loader: Function reading the metadata from the data info
+    """
     def __init__(self,
                  info: DataInfo,
-                 metadata: Metadata,
-                 value: DataInstance):
+                 metadata: Metadata = None,
+                 value: DataInstance = None,
+                 value_loader: Callable[[DataInfo], DataInstance] = None,
+                 metadata_loader: Callable[[DataInfo], Metadata] = None):
         self.__info = info
+        self.__value_loader = value_loader
+        self.__metadata_loader = metadata_loader
         self.__metadata = metadata
         self.__value = value
+        if metadata is None and metadata_loader is not None:
+            self.__metadata = _NOT_LOADED
+        if value is None and value_loader is not None:
+            self.__value = _NOT_LOADED
 
     @property
     def info(self) -> DataInfo:
         """Data info property"""
-        return self.__info.info
+        return self.__info
 
     @property
     def metadata(self) -> Metadata:
-        """Metadata property"""
+        """Metadata property, read on first access"""
+        if self.__metadata is _NOT_LOADED:
+            self.__metadata = self.__metadata_loader(self.__info)
         return self.__metadata
 
     @property
     def value(self) -> DataInstance:
-        """Data instance property"""
+        """Data instance property, read on first access"""
+        if self.__value is _NOT_LOADED:
+            self.__value = self.__value_loader(self.__info)
         return self.__value
 
+    @property
+    def is_loaded(self) -> bool:
+        """True if both the value and the metadata are in memory"""
+        return self.__value is not _NOT_LOADED and \
+            self.__metadata is not _NOT_LOADED
+
+    def release(self):
+        """Drop the value and the metadata that can be loaded again"""
+        if self.__value_loader is not None:
+            self.__value = _NOT_LOADED
+        if self.__metadata_loader is not None:
+            self.__metadata = _NOT_LOADED
+
 
 SINGLE = "single"
 LOC_SET = "loc_set"
@@ -113,40 +455,121 @@ class DataQueryType(StrEnum):
 
 
 class Job(BaseModel):
-    """Container for a job description"""
+    """Container for a job description
+
+    A job with a `batch_size` larger than 1 is batchable: the runner may call
+    its function once for up to `batch_size` items with the same parameters.
+    Each data input is then given as the values of the items stacked by
+    `stack` (numpy.stack by default), and each output is split into the item
+    values by `unstack` (along the first axis by default).
+
+    `memory` (peak memory of an item in MB) and `threads` (threads used by an
+    item) are hints for the runners that share a memory and CPU budget
+    between the running items.
+
+    The outputs of a job with `keep` False are intermediate results: when
+    the run fuses the job with its single consumer, they are passed in memory
+    and not written to the storage, otherwise a runner with an ephemeral
+    store keeps them until their consumers are done.
+    """
     func: Callable
     inputs: list[dict[str, str] | float | int | bool | str]
     outputs: list[dict[str, str] | float | int | bool | str]
     query_type: DataQueryType = DataQueryType.SINGLE
+    batch_size: int = 1
+    stack: Callable | None = None
+    unstack: Callable | None = None
+    memory: float | None = None
+    threads: int = 1
+    keep: bool = True
+
+    def to_bytes(self) -> bytes:
+        """Encode the job in the scixtracer binary format
+
+        :return: The binary message
+        """
+        from .serialization import encode_job
+        return encode_job(self)
+
+    @classmethod
+    def from_bytes(cls, message: bytes) -> "Job":
+        """Decode a job written with :meth:`to_bytes`
+
+        :param message: The binary message,
+        :return: The job
+        """
+        from .serialization import decode_job
+        return decode_job(message)
 
 
 def job(func: Callable,
         inputs: list[dict[str, str] | float | int | bool] | str,
         outputs: list[dict[str, str] | float | int | bool | str],
-        query_type: DataQueryType = DataQueryType.SINGLE
+        query_type: DataQueryType = DataQueryType.SINGLE,
+        batch_size: int = 1,
+        stack: Callable = None,
+        unstack: Callable = None,
+        memory: float = None,
+        threads: int = 1,
+        keep: bool = True
         ) -> Job:
     """Create new job info
 
     :param func: Function to run,
     :param inputs: Queries for each input,
     :param outputs: Annotations for each output,
-    :param query_type: Type of query to apply for the inputs
+    :param query_type: Type of query to apply for the inputs,
+    :param batch_size: Maximum number of items per function call,
+    :param stack: Function stacking the item values of a data input,
+    :param unstack: Function splitting an output into the item values,
+    :param memory: Peak memory of an item in MB, None if unknown,
+    :param threads: Number of threads used by an item,
+    :param keep: False if the outputs are intermediate results that are not
+                 kept after the run
     """
     return Job(func=func,
                inputs=inputs,
                outputs=outputs,
-               query_type=query_type)
+               query_type=query_type,
+               batch_size=batch_size,
+               stack=stack,
+               unstack=unstack,
+               memory=memory,
+               threads=threads,
+               keep=keep)
 
 
 class BatchItem:
-    """Container for one function run"""
+    """Container for one function run
+
+    :param func: Function to run,
+    :param inputs: Data information or value of each input,
+    :param outputs: Data information of each output,
+    :param batch_size: Maximum number of items run in one call of a
+                       batchable function, 1 if the function is not
+                       batchable,
+    :param stack: Function stacking the item values of a data input,
+    :param unstack: Function splitting an output into the item values,
+    :param memory: Peak memory of the item in MB, None if unknown,
+    :param threads: Number of threads used by the item
+    """
     def __init__(self,
                  func: Callable,
                  inputs: list[DataInfo | float | int | str | bool],
-                 outputs: list[DataInfo]):
+                 outputs: list[DataInfo],
+                 batch_size: int = 1,
+                 stack: Callable = None,
+                 unstack: Callable = None,
+                 memory: float = None,
+                 threads: int = 1):
         self.__func = func
         self.__inputs = inputs
         self.__outputs = outputs
+        self.__batch_size = batch_size
+        self.__stack = stack
+        self.__unstack = unstack
+        self.__memory = memory
+        self.__threads = threads
 
     @property
     def func(self):
@@ -163,6 +586,168 @@ class BatchItem:
         """Outputs property"""
         return self.__outputs
 
+    @property
+    def batch_size(self) -> int:
+        """Maximum number of items per call of the function"""
+        return self.__batch_size
+
+    @property
+    def stack(self) -> Callable | None:
+        """Function stacking the item values of a data input"""
+        return self.__stack
+
+    @property
+    def unstack(self) -> Callable | None:
+        """Function splitting an output into the item values"""
+        return self.__unstack
+
+    @property
+    def memory(self) -> float | None:
+        """Peak memory of the item in MB, None if unknown"""
+        return self.__memory
+
+    @property
+    def threads(self) -> int:
+        """Number of threads used by the item"""
+        return self.__threads
+
+    def to_bytes(self) -> bytes:
+        """Encode the item in the scixtracer binary format
+
+        :return: The binary message
+        """
+        from .serialization import encode_batch_item
+        return encode_batch_item(self)
+
+    @classmethod
+    def from_bytes(cls, message: bytes) -> "BatchItem":
+        """Decode an item written with :meth:`to_bytes`
+
+        :param message: The binary message,
+        :return: The item, decoded on first access to its content
+        """
+        from .serialization import decode_batch_item
+        return decode_batch_item(message)
+
+
+class FusedItem(BatchItem):
+    """Chain of batch items run in one task
+
+    Each stage reads the outputs of the previous stages from memory. The
+    transient outputs are only passed in memory, the others are also written
+    to the storage.
+
+    :param stages: Items of the chain, in order,
+    :param transient: URIs of the outputs that are not written
+    """
+    def __init__(self, stages: list[BatchItem], transient: list[str] = None):
+        super().__init__(stages[-1].func, None, None)
+        self.__stages = stages
+        self.__transient = set(transient or [])
+
+    @property
+    def stages(self) -> list[BatchItem]:
+        """Items of the chain, in order"""
+        return self.__stages
+
+    @property
+    def transient(self) -> set[str]:
+        """URIs of the outputs passed in memory and not written"""
+        return self.__transient
+
+    @property
+    def inputs(self):
+        """Inputs of all the stages"""
+        return [stage.inputs for stage in self.__stages]
+
+    @property
+    def outputs(self):
+        """Outputs of the stages that are written to the storage"""
+        return [info for stage in self.__stages for info in stage.outputs
+                if info.uri.value not in self.__transient]
+
+    @property
+    def memory(self) -> float | None:
+        """Largest peak memory of the stages in MB, None if unknown"""
+        hints = [stage.memory for stage in self.__stages
+                 if stage.memory is not None]
+        return max(hints) if hints else None
+
+    @property
+    def threads(self) -> int:
+        """Largest number of threads used by a stage"""
+        return max(stage.threads for stage in self.__stages)
+
+
+class ItemFailure(BaseModel):
+    """Failure of one batch item during a run
+
+    :param batch: Index of the batch in the run,
+    :param item: Index of the item in the batch,
+    :param func: Import path of the item function,
+    :param error: Description of the error,
+    :param traceback: Formatted traceback of the error
+    """
+    batch: int
+    item: int
+    func: str
+    error: str
+    traceback: str = ""
+
+
+class PipelineStats(BaseModel):
+    """Busy time of the stages of the pipelined execution of batch items
+
+    The inputs of the next items are read by a prefetch thread and the
+    outputs of the previous items are written by a write thread while the
+    current item is computed. The utilisation of a stage is its busy time
+    divided by the elapsed time: a prefetch stage always busy and a compute
+    stage waiting for it means that reads are the bottleneck.
+
+    :param items: Number of items run,
+    :param elapsed: Elapsed time of the runs in seconds,
+    :param read: Time spent reading inputs,
+    :param compute: Time spent in the item functions,
+    :param write: Time spent writing outputs,
+    :param read_wait: Time the compute stage waited for inputs,
+    :param write_wait: Time the compute stage waited for room in the write
+                       queue
+    """
+    items: int = 0
+    elapsed: float = 0.0
+    read: float = 0.0
+    compute: float = 0.0
+    write: float = 0.0
+    read_wait: float = 0.0
+    write_wait: float = 0.0
+
+    def merge(self, other: "PipelineStats") -> "PipelineStats":
+        """Add the times of other runs
+
+        :param other: Statistics of the other runs,
+        :return: The sum of the statistics
+        """
+        return PipelineStats(**{name: getattr(self, name) +
+                                getattr(other, name)
+                                for name in PipelineStats.model_fields})
+
+    def utilisation(self) -> dict[str, float]:
+        """Get the fraction of the elapsed time each stage was busy
+
+        :return: The utilisation of the `read`, `compute` and `write` stages
+        """
+        return {name: getattr(self, name) / self.elapsed
+                if self.elapsed > 0 else 0.0
+                for name in ("read", "compute", "write")}
+
+    def summary(self) -> str:
+        """Describe the utilisation of the stages in one line"""
+        stages = ", ".join(f"{name} {value:.0%}"
+                           for name, value in self.utilisation().items())
+        return (f"{self.items} items, {stages}, compute waited "
+                f"{self.read_wait:.2f} s for inputs and "
+                f"{self.write_wait:.2f} s for writes")
+
 
 class Batch:
     """Container for a batch run"""
@@ -181,3 +766,22 @@ class Batch:
 
     def __getitem__(self, index):
         return self.items[index]
+
+    def to_bytes(self) -> bytes:
+        """Encode the batch in the scixtracer binary format
+
+        :return: The binary message
+        """
+        from .serialization import encode_batch
+        return encode_batch(self)
+
+    @classmethod
+    def from_bytes(cls, message: bytes) -> "Batch":
+        """Decode a batch written with :meth:`to_bytes`
+
+        :param message: The binary message,
+        :return: The batch, each item is decoded on first access to its
+                 content
+        """
+        from .serialization import decode_batch
+        return decode_batch(message)
@@ -1,12 +1,375 @@
 """Definition of the main API methods"""
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+import copy
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import traceback
 
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from .cache import _Unidentified
+from .cache import _input_key
+from .models import DataInfo
+from .models import DataInfoSet
+from .models import BatchItem
+from .models import FusedItem
 from .models import Batch
+from .models import ItemFailure
+from .models import PipelineStats
+from .ephemeral import EphemeralStore
+from .journal import RunJournal
+from .scheduler import DependencyGraph
+from .scheduler import Node
+from .serialization import function_path
 from .storage import SxStorage
 
 
+def _data_size(value: any) -> int:
+    """Estimate the memory size of a data value in bytes"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    return sys.getsizeof(value)
+
+
+def _rss() -> float | None:
+    """Resident memory of the process in MB, None if unknown"""
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            pages = int(file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def _max_rss() -> float | None:
+    """Peak resident memory of the process in MB, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class _MemorySampler:
+    """Sample the resident memory of the process while items run
+
+    One thread samples the memory while the sampler is used in a with block,
+    and :meth:`measure` gives the peak memory added by each item.
+
+    :param interval: Sampling interval in seconds,
+    :param enabled: False to skip the measures, their `peak` is then None
+    """
+    def __init__(self, interval: float = 0.005, enabled: bool = True):
+        self.__interval = interval
+        self.__enabled = enabled and _rss() is not None
+        self.__high = 0.0
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __sample(self):
+        while not self.__stop.wait(self.__interval):
+            rss = _rss()
+            with self.__lock:
+                if rss is not None and rss > self.__high:
+                    self.__high = rss
+
+    def __enter__(self):
+        if self.__enabled:
+            self.__thread = threading.Thread(target=self.__sample,
+                                             name="sxt-memory", daemon=True)
+            self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        if self.__thread is not None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+
+    def reset(self) -> float | None:
+        """Restart the high-water mark from the current resident memory
+
+        :return: The resident memory in MB, None if the sampler is disabled
+        """
+        if not self.__enabled:
+            return None
+        rss = _rss()
+        with self.__lock:
+            self.__high = rss or 0.0
+        return rss
+
+    def high(self) -> float:
+        """Highest resident memory in MB since the last reset"""
+        rss = _rss() or 0.0
+        with self.__lock:
+            return max(self.__high, rss)
+
+    def measure(self) -> "_PeakMemory":
+        """Measure the peak memory added by the code run in a with block"""
+        return _PeakMemory(self)
+
+
+class _PeakMemory:
+    """Measure the peak memory added by the code run in a with block
+
+    The resident memory is read from the sampler, and the peak of the
+    process is used when the block raises it. `peak` is None if the resident
+    memory cannot be read.
+
+    :param sampler: Sampler of the resident memory
+    """
+    def __init__(self, sampler: _MemorySampler):
+        self.peak = None
+        self.__sampler = sampler
+        self.__start = None
+        self.__max = None
+
+    def __enter__(self):
+        self.__start = self.__sampler.reset()
+        if self.__start is not None:
+            self.__max = _max_rss()
+        return self
+
+    def __exit__(self, *args):
+        if self.__start is None:
+            return
+        high = self.__sampler.high()
+        peak = _max_rss()
+        if peak is not None and self.__max is not None and peak > self.__max:
+            high = max(high, peak)
+        self.peak = max(0.0, high - self.__start)
+
+
+def _unstack(value: any) -> list[any]:
+    """Split the output of a batched call along its first axis"""
+    if isinstance(value, pd.DataFrame):
+        raise TypeError("Cannot split a table output by item, give an "
+                        "unstack function to the job")
+    return list(value)
+
+
+def _group_key(item: BatchItem) -> tuple | None:
+    """Key shared by the items that can run in the same call
+
+    :param item: Batch item,
+    :return: The key, None if the item runs alone
+    """
+    if item.batch_size <= 1:
+        return None
+    params = []
+    for value in item.inputs:
+        if isinstance(value, DataInfo):
+            params.append(None)
+        elif isinstance(value, (DataInfoSet, list)):
+            return None
+        else:
+            try:
+                params.append(json.dumps(_input_key(value)))
+            except _Unidentified:
+                return None
+    return item.func, item.stack, item.unstack, tuple(params)
+
+
+def batch_groups(items: list[BatchItem]) -> list[list[int]]:
+    """Group the items that can run in one call of a batchable function
+
+    Items are compatible if they have the same function and batching options,
+    single data inputs at the same positions, and the same other inputs. The
+    other inputs are compared by content as in the call fingerprints, an item
+    with an input that cannot be identified runs alone.
+
+    :param items: Items to group,
+    :return: The indexes of the items of each group, in the order of the
+             first item of each group
+    """
+    groups = []
+    open_groups = {}
+    for index, item in enumerate(items):
+        key = _group_key(item)
+        if key is None:
+            groups.append([index])
+            continue
+        group = open_groups.get(key)
+        if group is None or len(group) >= item.batch_size:
+            group = []
+            open_groups[key] = group
+            groups.append(group)
+        group.append(index)
+    return groups
+
+
+class InputCache:
+    """Least recently used cache of the data read by a runner
+
+    Each read gives the item its own copy of a cached data, so an item that
+    changes its input in place does not change it for the next items reading
+    it. With `read_only`, the cached numpy arrays are given without a copy
+    and made read-only instead: an item changing such an input in place then
+    fails. The cache can be shared by threads, a data missing from the cache
+    is loaded without holding the cache lock.
+
+    :param max_bytes: Maximum memory size of the cached data,
+    :param read_only: Give the cached arrays read-only instead of copied
+    """
+    def __init__(self, max_bytes: int = 256 * 2**20, read_only: bool = False):
+        self.__max_bytes = max_bytes
+        self.__read_only = read_only
+        self.__values = OrderedDict()
+        self.__bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__values)
+
+    def read(self, info: DataInfo, loader: Callable[[DataInfo], any]) -> any:
+        """Get a data from the cache, or load it
+
+        :param info: Information of the data,
+        :param loader: Function reading the data from the storage,
+        :return: The data value
+        """
+        uri = info.uri.value
+        with self.__lock:
+            cached = self.__values.get(uri)
+            if cached is not None:
+                self.hits += 1
+                self.__values.move_to_end(uri)
+            else:
+                self.misses += 1
+        if cached is not None:
+            return self.__private(cached[0])
+        value = loader(info)
+        size = _data_size(value)
+        if size <= self.__max_bytes:
+            if self.__read_only and isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            with self.__lock:
+                if uri in self.__values:
+                    self.__bytes -= self.__values.pop(uri)[1]
+                self.__values[uri] = (value, size)
+                self.__bytes += size
+                while self.__bytes > self.__max_bytes:
+                    _, (_, evicted) = self.__values.popitem(last=False)
+                    self.__bytes -= evicted
+            return self.__private(value)
+        return value
+
+    def __private(self, value: any) -> any:
+        """Get the value given to an item for a cached data"""
+        if self.__read_only and isinstance(value, np.ndarray):
+            return value
+        return copy.deepcopy(value)
+
+    def discard(self, uri: str):
+        """Remove a data from the cache, after it is written
+
+        :param uri: URI of the data
+        """
+        with self.__lock:
+            if uri in self.__values:
+                self.__bytes -= self.__values.pop(uri)[1]
+
+    def clear(self):
+        """Remove all the cached data"""
+        with self.__lock:
+            self.__values.clear()
+            self.__bytes = 0
+
+
+class _Serialized:
+    """Proxy calling the methods of a backend one at a time
+
+    :param backend: Backend that is not thread-safe
+    """
+    def __init__(self, backend: any):
+        self.__backend = backend
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> any:
+        attribute = getattr(self.__backend, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            with self.__lock:
+                return attribute(*args, **kwargs)
+        return call
+
+
+def shared_backend(backend: any) -> any:
+    """Get a backend that can be called from several threads
+
+    :param backend: Storage, index or metadata backend,
+    :return: The backend if it declares `thread_safe`, or a proxy serializing
+             its calls
+    """
+    if getattr(backend, "thread_safe", False):
+        return backend
+    return _Serialized(backend)
+
+
 class SxRunner(ABC):
-    """Interface for storage interactions"""
+    """Interface for storage interactions
+
+    Runners that record the progress of each item in the run journal set
+    `journaling` to True. For the other runners, the items are recorded when
+    the run returns.
+
+    Runners that set an `input_cache` read each input once while it stays in
+    the cache, for the items sharing inputs.
+
+    Runners that run the items with :meth:`run_item` set `fusing` to True,
+    so the run gives them fused items for the chains of items with a single
+    consumer at the same location.
+
+    The run gives in `transient` the URIs of the outputs that need not be
+    written. Runners with an ephemeral store set `ephemeral` to True and
+    keep these outputs in their `ephemeral_store` until their consumers are
+    done, the other runners write them to the storage.
+
+    Runners that run several items at once in the same process set
+    `measure_memory` to False, as the memory of the process is then shared.
+
+    With `prefetch` larger than 0, :meth:`run_items` pipelines the items:
+    a thread reads the inputs of the next `prefetch` items and another one
+    writes the outputs of up to `write_queue` previous items while the
+    current item is computed. The storage must then be given through
+    :func:`shared_backend`. `pipeline_stats` holds the busy time of the
+    stages, of the last call in a worker and of the whole run in the runner
+    that started it.
+    """
+    journaling: bool = False
+    fusing: bool = False
+    ephemeral: bool = False
+    transient: set[str] = frozenset()
+    ephemeral_store: EphemeralStore | None = None
+    measure_memory: bool = True
+    prefetch: int = 0
+    write_queue: int = 2
+    pipeline_stats: PipelineStats | None = None
+    journal: RunJournal | None = None
+    input_cache: InputCache | None = None
+
     def __init__(self, storage: SxStorage = None):
         self.storage = storage
 
@@ -15,8 +378,337 @@ class SxRunner(ABC):
         """Initialize any needed connection to the database"""
 
     @abstractmethod
-    def run(self, batches: list[Batch]):
+    def run(self, batches: list[Batch]) -> list[ItemFailure] | None:
         """Execute a run defined as a list of batch
 
-        :param batches: List of batches to run
+        :param batches: List of batches to run,
+        :return: The failed items, if the runner reports them
+        """
+
+    def record_started(self, node: tuple[int, int]):
+        """Record in the run journal that an item started
+
+        :param node: Batch and item index of the item
+        """
+        if self.journal is not None:
+            self.journal.started(node)
+
+    def record_done(self, node: tuple[int, int], item: BatchItem):
+        """Record in the run journal that an item completed
+
+        :param node: Batch and item index of the item,
+        :param item: The item
+        """
+        if self.journal is not None:
+            self.journal.done(node, [info.uri.value for info in item.outputs])
+
+    def record_failed(self, failure: ItemFailure):
+        """Record in the run journal that an item failed
+
+        :param failure: Description of the failure
+        """
+        if self.journal is not None:
+            self.journal.failed(failure)
+
+    def record_failures(self,
+                        graph: DependencyGraph,
+                        failures: list[ItemFailure],
+                        new_failures: list[ItemFailure]
+                        ) -> set[Node]:
+        """Add failed items and the items depending on them to the failures
+
+        :param graph: Dependency graph of the run,
+        :param failures: Failures of the run, updated in place,
+        :param new_failures: Items that just failed,
+        :return: The nodes of the items that just failed
+        """
+        failed = set()
+        for failure in new_failures:
+            node = (failure.batch, failure.item)
+            failed.add(node)
+            cancelled = [ItemFailure(
+                batch=consumer[0],
+                item=consumer[1],
+                func=item_path(graph.item(consumer)),
+                error=f"Input from job {failure.batch} item "
+                      f"{failure.item} failed"
+            ) for consumer in graph.failed(node)]
+            for entry in [failure] + cancelled:
+                failures.append(entry)
+                self.record_failed(entry)
+        return failed
+
+    def read_input(self, value: any, values: dict[str, any] = None) -> any:
+        """Read the value of a batch item input
+
+        :param value: Data information, list of data information or value,
+        :param values: Data already in memory, by URI,
+        :return: The data read from the storage, or the value itself
+        """
+        if isinstance(value, DataInfo):
+            return self.__read(value, values)
+        if isinstance(value, DataInfoSet) or \
+                (isinstance(value, list) and len(value) > 0 and
+                 isinstance(value[0], DataInfo)):
+            return [self.__read(info, values) for info in value]
+        return value
+
+    def __read(self, info: DataInfo, values: dict[str, any] = None) -> any:
+        """Read a data from memory, the ephemeral store or the storage"""
+        if values is not None and info.uri.value in values:
+            return values[info.uri.value]
+        if self.ephemeral_store is not None:
+            try:
+                return self.ephemeral_store.read(info.uri.value)
+            except KeyError:
+                pass
+        if self.input_cache is None:
+            return self.storage.read_data(info)
+        return self.input_cache.read(info, self.storage.read_data)
+
+    def run_item(self, item: BatchItem):
+        """Read the inputs of an item, call its function and write outputs
+
+        The stages of a fused item run one after the other, each stage reads
+        the outputs of the previous stages from memory.
+
+        :param item: Item to run
+        """
+        if isinstance(item, FusedItem):
+            values = {}
+            for stage in item.stages:
+                self.__call(stage, values, item.transient)
+            return
+        self.__call(item)
+
+    def __call(self,
+               item: BatchItem,
+               values: dict[str, any] = None,
+               transient: set[str] = frozenset()):
+        """Call the function of an item and write its outputs
+
+        :param item: Item to run,
+        :param values: Data in memory by URI, completed with the outputs,
+        :param transient: URIs of the outputs that are only kept in memory
+        """
+        outputs = item.func(*[self.read_input(value, values)
+                              for value in item.inputs])
+        if not isinstance(outputs, (list, tuple)):
+            outputs = [outputs]
+        for info, value in zip(item.outputs, outputs):
+            if values is not None:
+                values[info.uri.value] = value
+            if info.uri.value not in transient:
+                self.__write(info, value)
+
+    def __write(self, info: DataInfo, value: any):
+        """Write an output to the ephemeral store or to the storage"""
+        if self.input_cache is not None:
+            self.input_cache.discard(info.uri.value)
+        if self.ephemeral_store is not None and \
+                self.ephemeral_store.write(info.uri.value, value):
+            return
+        self.storage.write_data(info, value)
+
+    def run_group(self, items: list[BatchItem]):
+        """Run compatible items of a batchable function in one call
+
+        :param items: Items of a group made by :func:`batch_groups`
         """
+        first = items[0]
+        stack = first.stack or np.stack
+        unstack = first.unstack or _unstack
+        args = []
+        for index, value in enumerate(first.inputs):
+            if isinstance(value, DataInfo):
+                args.append(stack([self.read_input(item.inputs[index])
+                                   for item in items]))
+            else:
+                args.append(value)
+        outputs = first.func(*args)
+        if len(first.outputs) == 1:
+            outputs = [outputs]
+        for output_index, output in enumerate(outputs):
+            values = list(unstack(output))
+            if len(values) != len(items):
+                raise ValueError(f"Output {output_index} of a call on "
+                                 f"{len(items)} items split into "
+                                 f"{len(values)} values")
+            for item, value in zip(items, values):
+                self.__write(item.outputs[output_index], value)
+
+    def run_items(self, items: list[BatchItem]
+                  ) -> tuple[list[Exception | None], list[float],
+                             list[float | None]]:
+        """Run items, with one call per group of compatible batchable items
+
+        If the call of a group fails, its items run again one by one, so that
+        an error is only reported for the items that raise it.
+
+        :param items: Items to run,
+        :return: The error of each item, None if it succeeded, the runtime of
+                 each item in seconds, and the peak memory of each item in
+                 MB, None if it was not measured. The items of a group share
+                 the peak memory of their call.
+        """
+        with _MemorySampler(enabled=self.measure_memory) as sampler:
+            return self.__run_items(items, sampler)
+
+    def __run_items(self, items: list[BatchItem], sampler: _MemorySampler
+                    ) -> tuple[list[Exception | None], list[float],
+                               list[float | None]]:
+        """Run items, measuring their memory with the sampler of the call"""
+        errors = [None] * len(items)
+        durations = [0.0] * len(items)
+        peaks = [None] * len(items)
+        singles = []
+        for group in batch_groups(items):
+            if len(group) > 1:
+                start = time.perf_counter()
+                try:
+                    with sampler.measure() as memory:
+                        self.run_group([items[index] for index in group])
+                except Exception:  # pylint: disable=W0718
+                    pass
+                else:
+                    duration = (time.perf_counter() - start) / len(group)
+                    for index in group:
+                        durations[index] = duration
+                        peaks[index] = memory.peak
+                    continue
+            singles.extend(group)
+        pipelined = []
+        if self.prefetch > 0:
+            pipelined = [index for index in singles
+                         if not isinstance(items[index], FusedItem)]
+            singles = [index for index in singles
+                       if isinstance(items[index], FusedItem)]
+        for index in singles:
+            start = time.perf_counter()
+            try:
+                with sampler.measure() as memory:
+                    self.run_item(items[index])
+            except Exception as error:  # pylint: disable=W0718
+                errors[index] = error
+            durations[index] = time.perf_counter() - start
+            peaks[index] = memory.peak
+        self.pipeline_stats = self.__run_pipelined(
+            [items[index] for index in pipelined], pipelined,
+            errors, durations, peaks, sampler)
+        return errors, durations, peaks
+
+    def __run_pipelined(self,
+                        items: list[BatchItem],
+                        indexes: list[int],
+                        errors: list[Exception | None],
+                        durations: list[float],
+                        peaks: list[float | None],
+                        sampler: _MemorySampler) -> PipelineStats:
+        """Run items with their reads and writes overlapping the compute
+
+        :param items: Items to run,
+        :param indexes: Index of each item in the results,
+        :param errors: Error of each item, updated in place,
+        :param durations: Runtime of each item, updated in place,
+        :param peaks: Peak memory of each item, updated in place,
+        :param sampler: Sampler measuring the memory of the items,
+        :return: The busy time of the stages
+        """
+        stats = PipelineStats(items=len(items))
+        if not items:
+            return stats
+        start = time.perf_counter()
+
+        def read(item: BatchItem) -> list:
+            begin = time.perf_counter()
+            try:
+                return [self.read_input(value) for value in item.inputs]
+            finally:
+                stats.read += time.perf_counter() - begin
+
+        def write(item: BatchItem, outputs: list):
+            begin = time.perf_counter()
+            try:
+                for info, value in zip(item.outputs, outputs):
+                    self.__write(info, value)
+            finally:
+                stats.write += time.perf_counter() - begin
+
+        def written(index: int, future: Future):
+            try:
+                future.result()
+            except Exception as error:  # pylint: disable=W0718
+                errors[index] = error
+
+        reader = ThreadPoolExecutor(1, thread_name_prefix="sxt-read")
+        writer = ThreadPoolExecutor(1, thread_name_prefix="sxt-write")
+        with reader, writer:
+            reads = deque(reader.submit(read, item)
+                          for item in items[:self.prefetch + 1])
+            writes = deque()
+            for position, (index, item) in enumerate(zip(indexes, items)):
+                begin = time.perf_counter()
+                future = reads.popleft()
+                if position + self.prefetch + 1 < len(items):
+                    reads.append(reader.submit(
+                        read, items[position + self.prefetch + 1]))
+                try:
+                    args = future.result()
+                except Exception as error:  # pylint: disable=W0718
+                    errors[index] = error
+                    durations[index] = time.perf_counter() - begin
+                    continue
+                computed = time.perf_counter()
+                stats.read_wait += computed - begin
+                try:
+                    with sampler.measure() as memory:
+                        outputs = item.func(*args)
+                except Exception as error:  # pylint: disable=W0718
+                    errors[index] = error
+                peaks[index] = memory.peak
+                waited = time.perf_counter()
+                stats.compute += waited - computed
+                if errors[index] is None:
+                    if not isinstance(outputs, (list, tuple)):
+                        outputs = [outputs]
+                    while len(writes) >= max(1, self.write_queue):
+                        written(*writes.popleft())
+                    stats.write_wait += time.perf_counter() - waited
+                    writes.append((index, writer.submit(write, item,
+                                                        outputs)))
+                durations[index] = time.perf_counter() - begin
+            while writes:
+                written(*writes.popleft())
+        stats.elapsed = time.perf_counter() - start
+        return stats
+
+
+def item_failure(batch: int, item: int, func_path: str,
+                 error: BaseException) -> ItemFailure:
+    """Describe the failure of a batch item
+
+    :param batch: Index of the batch in the run,
+    :param item: Index of the item in the batch,
+    :param func_path: Import path of the item function,
+    :param error: Exception raised by the item,
+    :return: The failure description
+    """
+    return ItemFailure(
+        batch=batch,
+        item=item,
+        func=func_path,
+        error=repr(error),
+        traceback="".join(traceback.format_exception(error))
+    )
+
+
+def item_path(item: BatchItem) -> str:
+    """Get the import path of an item function, even if it cannot be loaded
+
+    :param item: Batch item,
+    :return: The path as `module:qualname`, or `<unknown>`
+    """
+    try:
+        return function_path(item.func)
+    except (ImportError, AttributeError, ValueError):
+        return "<unknown>"
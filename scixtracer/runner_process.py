@@ -0,0 +1,439 @@
+"""Built-in runner executing the batch items in a pool of processes
+
+Items are scheduled with the dependency graph of the run: an item is sent to
+a worker as soon as the items producing its inputs are done, and the
+independent items run in parallel. The ready items are balanced between the
+workers with per-worker deques and work stealing, and sent in chunks whose
+size adapts to the number of ready items and to the observed item runtimes.
+The items made ready by a chunk run next on the worker that ran it, and the
+items reading the same input are queued back to back on the worker that read
+it first. Each worker keeps the last data it read in an input cache, so
+an input shared by several items is read once while it stays in the cache.
+The items of a batchable job in the same chunk run in one function call per
+group of `batch_size` items.
+
+A chunk starts only if the memory and threads of its items fit in the budget
+left by the running chunks. The memory of an item is the hint of its job,
+then the peak memory measured by the workers on the earlier items of the job.
+
+With `prefetch`, each worker reads the inputs of the next items of its
+chunk and writes the outputs of the previous ones while it computes an item.
+The utilisation of the read, compute and write stages is logged at the end of
+the run.
+
+The transient outputs of the run (jobs with `keep` False) are written to an
+ephemeral store shared by the workers, in memory and optionally spilled to a
+local directory, and are removed when the items reading them are done.
+
+Chunks are encoded with the scixtracer binary format. Each worker reads the
+config file and connects its own storage. A failing item is reported, as are
+the items that depend on it, and does not stop the rest of the run. A worker
+that dies is replaced and its chunk is reported as failed. After
+`max_start_failures` workers in a row die before they are ready, no worker
+is started again and the items left are reported as failed.
+
+Configuration in the `runner` section of the config file:
+
+.. code-block:: yaml
+
+    runner:
+      name: process
+      workers: 8               # default: number of CPUs
+      max_tasks_per_child: 100 # default: workers are never replaced
+      chunk_size: 16           # maximum items sent at once, default: 32
+      chunk_time: 0.5          # target chunk duration in seconds
+      input_cache: 256         # MB of inputs kept by each worker, 0: none
+      read_only_inputs: false  # give the cached arrays read-only, not copied
+      memory: 16000            # MB shared by the running items, default: none
+      cpus: 8                  # threads shared by the running items,
+                               # default: number of CPUs
+      ephemeral_memory: 1024   # MB of transient outputs kept in memory
+      spill: /scratch/sxt      # local directory for the transient outputs
+                               # that do not fit in memory, default: none,
+                               # they are written to the storage
+      prefetch: 2              # items whose inputs are read in advance,
+                               # default: 0, no pipelining
+      write_queue: 2           # items whose outputs wait to be written
+      max_start_failures: 3    # workers dying in a row at startup before
+                               # the items left fail
+"""
+from multiprocessing.connection import Connection
+from multiprocessing.connection import wait
+import multiprocessing
+import os
+from pathlib import Path
+
+from .config import ConfigData
+from .config import config
+from .factory import Factory
+from .models import Batch
+from .models import ItemFailure
+from .models import PipelineStats
+from .ephemeral import EphemeralLifetimes
+from .ephemeral import EphemeralStore
+from .runner import InputCache
+from .runner import SxRunner
+from .runner import item_failure
+from .runner import item_path
+from .runner import shared_backend
+from .scheduler import ChunkSizer
+from .scheduler import DependencyGraph
+from .scheduler import Node
+from .scheduler import ResourceBudget
+from .scheduler import WorkQueues
+from .storage import SxStorage
+from .logger import logger
+
+
+__worker: SxRunner = None
+
+
+def _init_worker(config_path: str, cache_size: int,
+                 store: EphemeralStore | None = None,
+                 pipeline: tuple[int, int] = (0, 2),
+                 read_only: bool = False):
+    """Connect the storage of a worker process and create its input cache"""
+    global __worker  # pylint: disable=W0603
+    worker_config = ConfigData(Path(config_path))
+    storage: SxStorage = Factory(
+        "sxt_", "storage").get(worker_config.value("storage", "name"))()
+    storage.connect(**worker_config.filtered_section("storage"))
+    prefetch, write_queue = pipeline
+    __worker = SxRunnerProcess(shared_backend(storage) if prefetch > 0
+                               else storage)
+    __worker.input_cache = InputCache(cache_size, read_only)
+    __worker.ephemeral_store = store
+    __worker.prefetch = prefetch
+    __worker.write_queue = write_queue
+
+
+def _run_chunk(nodes: list[Node], message: bytes
+               ) -> tuple[list[ItemFailure], list[float], list[float | None],
+                          PipelineStats | None]:
+    """Run a chunk of items in a worker process
+
+    :param nodes: Batch and item index of each item of the chunk,
+    :param message: The chunk items encoded as a batch,
+    :return: The failed items, the runtime and the peak memory of each item,
+             and the busy time of the pipeline stages
+    """
+    items = Batch.from_bytes(message).items
+    errors, durations, peaks = __worker.run_items(items)
+    failures = [item_failure(batch_index, item_index, item_path(item), error)
+                for (batch_index, item_index), item, error
+                in zip(nodes, items, errors) if error is not None]
+    return failures, durations, peaks, __worker.pipeline_stats
+
+
+def _worker_main(config_path: str, connection: Connection,
+                 max_tasks: int | None, cache_size: int,
+                 store: EphemeralStore | None = None,
+                 pipeline: tuple[int, int] = (0, 2),
+                 read_only: bool = False):
+    """Run the chunks received from the runner until asked to stop
+
+    :param config_path: Config file of the backends,
+    :param connection: Connection to the runner,
+    :param max_tasks: Number of chunks to run before exiting, None for no
+                      limit,
+    :param cache_size: Memory size of the worker input cache in bytes,
+    :param store: Store of the transient outputs of the run,
+    :param pipeline: Prefetch depth and write queue depth of the worker,
+    :param read_only: Give the cached arrays read-only instead of copied
+    """
+    _init_worker(config_path, cache_size, store, pipeline, read_only)
+    connection.send(None)
+    tasks = 0
+    while max_tasks is None or tasks < max_tasks:
+        try:
+            task = connection.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        connection.send(_run_chunk(*task))
+        tasks += 1
+    connection.close()
+
+
+class _Worker:
+    """Worker process with its connection to the runner"""
+    def __init__(self, context, config_path: str, max_tasks: int | None,
+                 cache_size: int, store: EphemeralStore | None,
+                 pipeline: tuple[int, int], read_only: bool):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(config_path, child, max_tasks, cache_size, store,
+                  pipeline, read_only),
+            daemon=True)
+        self.process.start()
+        child.close()
+        self.max_tasks = max_tasks
+        self.tasks = 0
+        self.started = False
+        self.nodes = None
+        self.reserved = None
+
+    @property
+    def idle(self) -> bool:
+        """True if the worker is started and waits for a chunk"""
+        return self.started and self.nodes is None
+
+    @property
+    def exhausted(self) -> bool:
+        """True if the worker exits after its last chunk"""
+        return self.max_tasks is not None and self.tasks >= self.max_tasks
+
+    def send(self, nodes: list[Node], message: bytes):
+        """Send a chunk to the worker"""
+        self.nodes = nodes
+        self.tasks += 1
+        self.connection.send((nodes, message))
+
+    def stop(self):
+        """Ask the worker to exit and wait for it"""
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+class SxRunnerProcess(SxRunner):
+    """Runner using a pool of worker processes"""
+    journaling = True
+    fusing = True
+    ephemeral = True
+
+    def __init__(self, storage: SxStorage = None):
+        super().__init__(storage)
+        self.__workers = os.cpu_count()
+        self.__max_tasks_per_child = None
+        self.__chunk_size = 32
+        self.__chunk_time = 0.5
+        self.__input_cache = 256 * 2**20
+        self.__read_only_inputs = False
+        self.__memory = None
+        self.__cpus = os.cpu_count()
+        self.__ephemeral_memory = 1024 * 2**20
+        self.__spill = None
+        self.__pipeline = (0, 2)
+        self.__max_start_failures = 3
+
+    def connect(self,
+                workers: int = None,
+                max_tasks_per_child: int = None,
+                chunk_size: int = 32,
+                chunk_time: float = 0.5,
+                input_cache: float = 256,
+                read_only_inputs: bool = False,
+                memory: float = None,
+                cpus: int = None,
+                ephemeral_memory: float = 1024,
+                spill: str = None,
+                prefetch: int = 0,
+                write_queue: int = 2,
+                max_start_failures: int = 3,
+                **kwargs):
+        """Set the pool parameters
+
+        :param workers: Number of worker processes,
+        :param max_tasks_per_child: Number of chunks a worker runs before it
+                                    is replaced,
+        :param chunk_size: Maximum number of items sent to a worker at once,
+        :param chunk_time: Target duration of a chunk in seconds,
+        :param input_cache: Memory size in MB of the inputs kept by each
+                            worker,
+        :param read_only_inputs: Give the cached numpy arrays to the items
+                                 read-only instead of copied,
+        :param memory: Memory in MB shared by the running items, None for no
+                       limit,
+        :param cpus: Number of threads shared by the running items,
+        :param ephemeral_memory: Memory size in MB of the transient outputs
+                                 kept by the workers,
+        :param spill: Local directory receiving the transient outputs that do
+                      not fit in memory, None to write them to the storage,
+        :param prefetch: Number of items whose inputs a worker reads while it
+                         computes an item, 0 to run the items one step after
+                         the other,
+        :param write_queue: Number of items whose outputs wait to be written
+                            while a worker computes an item,
+        :param max_start_failures: Number of workers dying in a row before
+                                   they are ready after which the items left
+                                   fail
+        """
+        if workers is not None:
+            self.__workers = int(workers)
+        if max_tasks_per_child is not None:
+            self.__max_tasks_per_child = int(max_tasks_per_child)
+        self.__chunk_size = max(1, int(chunk_size))
+        self.__chunk_time = float(chunk_time)
+        self.__input_cache = max(0, int(float(input_cache) * 2**20))
+        self.__read_only_inputs = bool(read_only_inputs)
+        if memory is not None:
+            self.__memory = float(memory)
+        if cpus is not None:
+            self.__cpus = int(cpus)
+        self.__ephemeral_memory = max(0, int(float(ephemeral_memory) * 2**20))
+        self.__spill = spill
+        self.__pipeline = (max(0, int(prefetch)), max(1, int(write_queue)))
+        self.__max_start_failures = max(1, int(max_start_failures))
+
+    def __worker(self, store: EphemeralStore | None) -> _Worker:
+        """Start a worker process connected to the storage"""
+        return _Worker(multiprocessing.get_context("spawn"),
+                       str(config().file), self.__max_tasks_per_child,
+                       self.__input_cache, store, self.__pipeline,
+                       self.__read_only_inputs)
+
+    def __store(self, graph: DependencyGraph
+                ) -> tuple[EphemeralStore | None, EphemeralLifetimes | None]:
+        """Create the ephemeral store of the transient outputs of a run"""
+        if not self.transient:
+            return None, None
+        store = EphemeralStore(self.__ephemeral_memory, self.__spill,
+                               context=multiprocessing.get_context("spawn"))
+        store.uris = set(self.transient)
+        return store, EphemeralLifetimes(graph, store)
+
+    def __record_pipeline(self, stats: PipelineStats | None):
+        """Add the busy time of the pipeline stages of a chunk"""
+        if stats is None or stats.items == 0:
+            return
+        if self.pipeline_stats is None:
+            self.pipeline_stats = stats
+        else:
+            self.pipeline_stats = self.pipeline_stats.merge(stats)
+
+    def __dispatch(self,
+                   index: int,
+                   worker: _Worker,
+                   graph: DependencyGraph,
+                   queues: WorkQueues,
+                   sizer: ChunkSizer,
+                   budget: ResourceBudget,
+                   failures: list[ItemFailure]):
+        """Send the next chunk of ready items that fit to an idle worker"""
+        while worker.idle and len(queues) > 0:
+            nodes = queues.take(index, sizer.size(len(queues)), budget.fits)
+            if not nodes:
+                break
+            chunk = Batch()
+            chunk.items = [graph.item(node) for node in nodes]
+            try:
+                message = chunk.to_bytes()
+            except (ImportError, AttributeError, ValueError) as error:
+                self.record_failures(graph, failures, [
+                    item_failure(*node, item_path(item), error)
+                    for node, item in zip(nodes, chunk)])
+                continue
+            worker.reserved = budget.acquire(nodes)
+            worker.send(nodes, message)
+            for node in nodes:
+                self.record_started(node)
+
+    def __fail_left(self,
+                    graph: DependencyGraph,
+                    queues: WorkQueues,
+                    failures: list[ItemFailure],
+                    error: Exception):
+        """Report the ready items as failed when no worker can start"""
+        while len(queues) > 0:
+            self.record_failures(graph, failures, [
+                item_failure(*node, item_path(graph.item(node)), error)
+                for node in queues.take(0, len(queues))])
+
+    def run(self, batches: list[Batch]) -> list[ItemFailure]:
+        graph = DependencyGraph(batches)
+        queues = WorkQueues(self.__workers, graph.inputs)
+        queues.distribute(graph.ready())
+        sizer = ChunkSizer(self.__workers, self.__chunk_size,
+                           self.__chunk_time)
+        budget = ResourceBudget(
+            self.__memory, self.__cpus,
+            lambda node: (graph.item(node).memory, graph.item(node).threads))
+        failures = []
+        self.pipeline_stats = None
+        store, lifetimes = self.__store(graph)
+        workers = [self.__worker(store) for _ in range(self.__workers)]
+        start_failures = 0
+        try:
+            while True:
+                for index, worker in enumerate(workers):
+                    if worker is not None:
+                        self.__dispatch(index, worker, graph, queues, sizer,
+                                        budget, failures)
+                live = [worker for worker in workers if worker is not None]
+                if not live:
+                    error = RuntimeError(f"{start_failures} workers died "
+                                         f"before they were ready")
+                    logger().error(str(error))
+                    self.__fail_left(graph, queues, failures, error)
+                    break
+                busy = {worker.connection: index
+                        for index, worker in enumerate(workers)
+                        if worker is not None and not worker.idle}
+                if all(worker.idle for worker in live) or \
+                        (len(queues) == 0 and
+                         all(worker.nodes is None for worker in live)):
+                    break
+                for connection in wait(list(busy)):
+                    index = busy[connection]
+                    worker = workers[index]
+                    nodes, worker.nodes = worker.nodes or [], None
+                    dead = False
+                    try:
+                        result = connection.recv()
+                        if not worker.started:
+                            worker.started = True
+                            start_failures = 0
+                            continue
+                        chunk_failures, durations, peaks, stats = result
+                        self.__record_pipeline(stats)
+                    except (EOFError, OSError) as error:
+                        dead = True
+                        if not worker.started:
+                            start_failures += 1
+                        chunk_failures = [
+                            item_failure(*node, item_path(graph.item(node)),
+                                         RuntimeError(f"Worker died: "
+                                                      f"{error!r}"))
+                            for node in nodes]
+                        durations = peaks = []
+                    if worker.reserved is not None:
+                        budget.release(worker.reserved)
+                        worker.reserved = None
+                    sizer.observe(durations)
+                    budget.observe(nodes, peaks)
+                    settled = len(failures)
+                    failed = self.record_failures(graph, failures,
+                                                    chunk_failures)
+                    for node in nodes:
+                        if node not in failed:
+                            self.record_done(node, graph.item(node))
+                            queues.push(index, graph.done(node))
+                    if lifetimes is not None:
+                        lifetimes.settled(
+                            [node for node in nodes if node not in failed] +
+                            [(failure.batch, failure.item)
+                             for failure in failures[settled:]])
+                    if dead or worker.exhausted:
+                        worker.stop()
+                        workers[index] = \
+                            self.__worker(store) \
+                            if start_failures < self.__max_start_failures \
+                            else None
+        finally:
+            for worker in workers:
+                if worker is not None:
+                    worker.stop()
+            if store is not None:
+                store.close()
+        if self.pipeline_stats is not None:
+            logger().info(f"Pipeline: {self.pipeline_stats.summary()}")
+        return sorted(failures, key=lambda failure: (failure.batch,
+                                                     failure.item))
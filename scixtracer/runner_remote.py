@@ -0,0 +1,555 @@
+"""Built-in runner distributing the batch items to workers over TCP
+
+The runner is a coordinator: it listens on a TCP port and serves chunks of
+ready items, in the scixtracer binary format, to the workers that connect to
+it. The workers run on any machine that shares the workspace: each worker
+reads the same config file, connects its own storage, runs the chunks and
+reports the results.
+
+Protocol, on a `multiprocessing.connection` authenticated with the shared
+`authkey`. Messages are JSON objects, except the chunks. A chunk is a
+`Batch.to_bytes` message: a pickle loaded by an unpickler that only allows
+built-in types and numpy arrays, with a table of functions given by import
+path. Decoding a chunk imports the modules of these functions, and the
+worker then calls them, so the workers only trust a chunk because its
+sender knows the `authkey`:
+
+- worker: `ready`, coordinator: `chunk` (lease id and nodes) followed by the
+  chunk message, or `stop` at the end of the run,
+- worker: `heartbeat` with the lease id, while the chunk runs,
+- worker: `result` with the lease id, the failures, the item runtimes and
+  the busy time of the pipeline stages of the chunk (`pipeline`, or null).
+
+A lease expires if no heartbeat is received for `lease_time` seconds, or when
+the connection of its worker is lost. The items of an expired lease are sent
+again to another worker, up to `retries` times, then reported as failed. A
+result received for an expired lease is ignored.
+
+Start a worker with the `sxt-worker` command, or with
+`python -m scixtracer.runner_remote`:
+
+.. code-block:: bash
+
+    sxt-worker config.yml --host coordinator-host
+
+Configuration in the `runner` section of the config file:
+
+.. code-block:: yaml
+
+    runner:
+      name: remote
+      address: 0.0.0.0       # address the coordinator listens on
+      host: coordinator-host # address the workers connect to
+      port: 6510             # default: a free port, for local workers only
+      authkey: shared-secret # default: random, for local workers only
+      local_workers: 0       # worker processes started by the coordinator
+      chunk_size: 8          # maximum items sent at once
+      chunk_time: 1.0        # target chunk duration in seconds
+      heartbeat: 5           # seconds between two heartbeats
+      lease_time: 30         # seconds without heartbeat to lose a worker
+      retries: 2             # runs of the items of a lost worker
+      prefetch: 2            # items whose inputs a worker reads in advance,
+                             # default: 0, no pipelining
+      write_queue: 2         # items whose outputs wait to be written
+
+The `authkey` is the only protection of the runs, and the connections are
+not encrypted. A peer that knows the key can pull the chunks of a run and
+report false results to the coordinator, or act as a coordinator and make
+workers import and call any function installed on their machine. With
+`address: 0.0.0.0` the coordinator accepts connections on all the network
+interfaces: use a long random key and only open the port to the workers.
+"""
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client
+from multiprocessing.connection import Connection
+from multiprocessing.connection import Listener
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import secrets
+import threading
+import time
+
+from .config import ConfigData
+from .config import config
+from .factory import Factory
+from .logger import logger
+from .models import Batch
+from .models import ItemFailure
+from .models import PipelineStats
+from .runner import InputCache
+from .runner import SxRunner
+from .runner import item_failure
+from .runner import item_path
+from .runner import shared_backend
+from .scheduler import ChunkSizer
+from .scheduler import DependencyGraph
+from .scheduler import Node
+from .scheduler import WorkQueues
+from .storage import SxStorage
+
+
+def _send(connection: Connection, message: dict[str, any],
+          lock: threading.Lock = None):
+    """Send a JSON message"""
+    data = json.dumps(message).encode()
+    if lock is None:
+        connection.send_bytes(data)
+    else:
+        with lock:
+            connection.send_bytes(data)
+
+
+def _receive(connection: Connection) -> dict[str, any]:
+    """Receive a JSON message"""
+    return json.loads(connection.recv_bytes())
+
+
+class _Lease:
+    """Chunk of items sent to a worker"""
+    def __init__(self, worker: int, nodes: list[Node], deadline: float):
+        self.worker = worker
+        self.nodes = nodes
+        self.deadline = deadline
+
+
+class _Coordinator:
+    """State of a run shared by the threads serving the workers
+
+    :param runner: Runner recording the progress of the run,
+    :param batches: Batches of the run,
+    :param sizer: Chunk sizes,
+    :param lease_time: Lease duration in seconds,
+    :param retries: Number of times the items of a lost worker run again
+    """
+    def __init__(self,
+                 runner: SxRunner,
+                 batches: list[Batch],
+                 sizer: ChunkSizer,
+                 lease_time: float,
+                 retries: int):
+        self.__runner = runner
+        self.__graph = DependencyGraph(batches)
+        self.__queues = WorkQueues(1, self.__graph.inputs)
+        self.__queues.distribute(self.__graph.ready())
+        self.__sizer = sizer
+        self.__lease_time = lease_time
+        self.__retries = retries
+        self.__leases = {}
+        self.__next_lease = 0
+        self.__losses = {}
+        self.__done = 0
+        self.failures = []
+        self.pipeline: PipelineStats | None = None
+        self.condition = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        """True when every item is done or failed"""
+        return self.__done + len(self.failures) >= len(self.__graph)
+
+    def lease(self, worker: int
+              ) -> tuple[int, list[Node], bytes] | None:
+        """Wait for a chunk of ready items and lease it to a worker
+
+        :param worker: Identifier of the worker connection,
+        :return: The lease id, the nodes and the chunk message, or None at
+                 the end of the run
+        """
+        with self.condition:
+            while not self.finished:
+                if len(self.__queues) == 0:
+                    self.condition.wait(1.0)
+                    continue
+                nodes = self.__queues.take(
+                    0, self.__sizer.size(len(self.__queues)))
+                chunk = Batch()
+                chunk.items = [self.__graph.item(node) for node in nodes]
+                try:
+                    message = chunk.to_bytes()
+                except (ImportError, AttributeError, ValueError) as error:
+                    self.__runner.record_failures(
+                        self.__graph, self.failures,
+                        [item_failure(*node, item_path(item), error)
+                         for node, item in zip(nodes, chunk)])
+                    self.condition.notify_all()
+                    continue
+                lease_id = self.__next_lease
+                self.__next_lease += 1
+                self.__leases[lease_id] = _Lease(
+                    worker, nodes, time.monotonic() + self.__lease_time)
+                for node in nodes:
+                    self.__runner.record_started(node)
+                return lease_id, nodes, message
+        return None
+
+    def renew(self, lease_id: int):
+        """Extend a lease after a heartbeat
+
+        :param lease_id: The lease
+        """
+        with self.condition:
+            lease = self.__leases.get(lease_id)
+            if lease is not None:
+                lease.deadline = time.monotonic() + self.__lease_time
+
+    def complete(self,
+                 lease_id: int,
+                 failures: list[ItemFailure],
+                 durations: list[float],
+                 pipeline: PipelineStats | None = None):
+        """Record the result of a chunk
+
+        :param lease_id: The lease of the chunk,
+        :param failures: The failed items of the chunk,
+        :param durations: Runtime of each item of the chunk,
+        :param pipeline: Busy time of the pipeline stages of the chunk
+        """
+        with self.condition:
+            lease = self.__leases.pop(lease_id, None)
+            if lease is None:
+                return
+            self.__sizer.observe(durations)
+            if pipeline is not None and pipeline.items > 0:
+                self.pipeline = pipeline if self.pipeline is None \
+                    else self.pipeline.merge(pipeline)
+            failed = self.__runner.record_failures(self.__graph,
+                                                   self.failures, failures)
+            for node in lease.nodes:
+                if node not in failed:
+                    self.__done += 1
+                    self.__runner.record_done(node, self.__graph.item(node))
+                    self.__queues.push(0, self.__graph.done(node))
+            self.condition.notify_all()
+
+    def __expire(self, lease_id: int, reason: str):
+        """Send the items of a lease again, or fail them"""
+        lease = self.__leases.pop(lease_id)
+        lost = []
+        retry = []
+        for node in lease.nodes:
+            self.__losses[node] = self.__losses.get(node, 0) + 1
+            if self.__losses[node] > self.__retries:
+                lost.append(item_failure(
+                    *node, item_path(self.__graph.item(node)),
+                    RuntimeError(f"Worker lost {self.__losses[node]} "
+                                 f"times: {reason}")))
+            else:
+                retry.append(node)
+        self.__runner.record_failures(self.__graph, self.failures, lost)
+        self.__queues.push(0, retry)
+        logger().warning(f"Lease {lease_id} of {len(lease.nodes)} items "
+                         f"expired: {reason}")
+
+    def lose(self, worker: int):
+        """Expire the leases of a worker whose connection is lost
+
+        :param worker: Identifier of the worker connection
+        """
+        with self.condition:
+            for lease_id in [lease_id
+                             for lease_id, lease in self.__leases.items()
+                             if lease.worker == worker]:
+                self.__expire(lease_id, "connection lost")
+            self.condition.notify_all()
+
+    def expire(self):
+        """Expire the leases without heartbeat for the lease time"""
+        with self.condition:
+            now = time.monotonic()
+            for lease_id in [lease_id
+                             for lease_id, lease in self.__leases.items()
+                             if lease.deadline < now]:
+                self.__expire(lease_id, "no heartbeat")
+            self.condition.notify_all()
+
+
+def _serve_worker(coordinator: _Coordinator,
+                  connection: Connection,
+                  worker: int):
+    """Serve the chunks of a run to one worker connection"""
+    try:
+        while True:
+            message = _receive(connection)
+            if message["type"] == "ready":
+                lease = coordinator.lease(worker)
+                if lease is None:
+                    _send(connection, {"type": "stop"})
+                    break
+                lease_id, nodes, chunk = lease
+                _send(connection, {"type": "chunk", "lease": lease_id,
+                                   "nodes": nodes})
+                connection.send_bytes(chunk)
+            elif message["type"] == "heartbeat":
+                coordinator.renew(message["lease"])
+            elif message["type"] == "result":
+                coordinator.complete(
+                    message["lease"],
+                    [ItemFailure(**failure)
+                     for failure in message["failures"]],
+                    message["durations"],
+                    PipelineStats(**message["pipeline"])
+                    if message.get("pipeline") else None)
+    except (EOFError, OSError, ValueError, KeyError):
+        pass
+    finally:
+        coordinator.lose(worker)
+        connection.close()
+
+
+class _Heartbeat:
+    """Thread sending heartbeats while a chunk runs"""
+    def __init__(self, connection: Connection, lock: threading.Lock,
+                 lease_id: int, interval: float):
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(
+            target=self.__beat, args=(connection, lock, lease_id, interval),
+            daemon=True)
+        self.__thread.start()
+
+    def __beat(self, connection: Connection, lock: threading.Lock,
+               lease_id: int, interval: float):
+        while not self.__stop.wait(interval):
+            try:
+                _send(connection, {"type": "heartbeat", "lease": lease_id},
+                      lock)
+            except (OSError, ValueError):
+                return
+
+    def stop(self):
+        """Stop sending heartbeats"""
+        self.__stop.set()
+        self.__thread.join()
+
+
+def _worker_runner(config_path: str, cache_size: int) -> SxRunner:
+    """Connect the storage of a worker and create its input cache"""
+    worker_config = ConfigData(Path(config_path))
+    storage: SxStorage = Factory(
+        "sxt_", "storage").get(worker_config.value("storage", "name"))()
+    storage.connect(**worker_config.filtered_section("storage"))
+    runner_config = worker_config.section("runner")
+    prefetch = max(0, int(runner_config.get("prefetch", 0)))
+    runner = SxRunnerRemote(shared_backend(storage) if prefetch > 0
+                            else storage)
+    runner.input_cache = InputCache(
+        cache_size, bool(runner_config.get("read_only_inputs", False)))
+    runner.prefetch = prefetch
+    runner.write_queue = max(1, int(runner_config.get("write_queue", 2)))
+    return runner
+
+
+def _work(connection: Connection, runner: SxRunner, heartbeat: float):
+    """Run the chunks of a coordinator until it asks to stop"""
+    lock = threading.Lock()
+    while True:
+        _send(connection, {"type": "ready"}, lock)
+        message = _receive(connection)
+        if message["type"] != "chunk":
+            return
+        nodes = [tuple(node) for node in message["nodes"]]
+        items = Batch.from_bytes(connection.recv_bytes()).items
+        beat = _Heartbeat(connection, lock, message["lease"], heartbeat)
+        try:
+            errors, durations, _ = runner.run_items(items)
+        finally:
+            beat.stop()
+        failures = [item_failure(*node, item_path(item), error).model_dump()
+                    for node, item, error in zip(nodes, items, errors)
+                    if error is not None]
+        stats = runner.pipeline_stats
+        _send(connection, {"type": "result", "lease": message["lease"],
+                           "failures": failures, "durations": durations,
+                           "pipeline": stats.model_dump()
+                           if stats is not None else None},
+              lock)
+
+
+def worker_main(address: tuple[str, int],
+                authkey: bytes,
+                config_path: str,
+                heartbeat: float = 5.0,
+                persistent: bool = False,
+                connect_timeout: float = 30.0,
+                cache_size: int = 256 * 2**20):
+    """Run the chunks served by a coordinator
+
+    :param address: Host and port of the coordinator,
+    :param authkey: Key shared with the coordinator,
+    :param config_path: Config file of the backends,
+    :param heartbeat: Seconds between two heartbeats,
+    :param persistent: Wait for the next run at the end of a run,
+    :param connect_timeout: Seconds to wait for the coordinator,
+    :param cache_size: Memory size of the input cache in bytes
+    """
+    runner = _worker_runner(config_path, cache_size)
+    while True:
+        deadline = time.monotonic() + connect_timeout
+        connection = None
+        while connection is None:
+            try:
+                connection = Client(address, authkey=authkey)
+            except OSError:
+                if not persistent and time.monotonic() > deadline:
+                    return
+                time.sleep(0.5)
+        try:
+            _work(connection, runner, heartbeat)
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+        if not persistent:
+            return
+
+
+class SxRunnerRemote(SxRunner):
+    """Runner serving the batch items to workers over TCP"""
+    journaling = True
+    fusing = True
+
+    def __init__(self, storage: SxStorage = None):
+        super().__init__(storage)
+        self.__address = "127.0.0.1"
+        self.__host = None
+        self.__port = 0
+        self.__authkey = secrets.token_bytes(32)
+        self.__local_workers = 0
+        self.__chunk_size = 8
+        self.__chunk_time = 1.0
+        self.__heartbeat = 5.0
+        self.__lease_time = 30.0
+        self.__retries = 2
+
+    def connect(self,
+                address: str = "127.0.0.1",
+                host: str = None,
+                port: int = 0,
+                authkey: str = None,
+                local_workers: int = 0,
+                chunk_size: int = 8,
+                chunk_time: float = 1.0,
+                heartbeat: float = 5.0,
+                lease_time: float = 30.0,
+                retries: int = 2,
+                **kwargs):
+        """Set the coordinator parameters
+
+        :param address: Address the coordinator listens on,
+        :param host: Address the workers connect to, the listen address by
+                     default,
+        :param port: Port of the coordinator, 0 for a free port,
+        :param authkey: Key shared with the workers, random by default,
+        :param local_workers: Number of worker processes started on this
+                              machine for each run,
+        :param chunk_size: Maximum number of items sent at once,
+        :param chunk_time: Target duration of a chunk in seconds,
+        :param heartbeat: Seconds between two heartbeats of a worker,
+        :param lease_time: Seconds without heartbeat after which a worker
+                           is lost,
+        :param retries: Number of times the items of a lost worker run again
+        """
+        self.__address = address
+        self.__host = host
+        self.__port = int(port)
+        if authkey is not None:
+            self.__authkey = str(authkey).encode()
+        self.__local_workers = int(local_workers)
+        self.__chunk_size = max(1, int(chunk_size))
+        self.__chunk_time = float(chunk_time)
+        self.__heartbeat = float(heartbeat)
+        self.__lease_time = float(lease_time)
+        self.__retries = int(retries)
+
+    def __local_worker(self, address: tuple[str, int]):
+        """Start a worker process on this machine"""
+        process = multiprocessing.get_context("spawn").Process(
+            target=worker_main,
+            args=(address, self.__authkey, str(config().file),
+                  self.__heartbeat),
+            daemon=True)
+        process.start()
+        return process
+
+    def run(self, batches: list[Batch]) -> list[ItemFailure]:
+        coordinator = _Coordinator(
+            self, batches,
+            ChunkSizer(max(1, self.__local_workers), self.__chunk_size,
+                       self.__chunk_time),
+            self.__lease_time, self.__retries)
+        listener = Listener((self.__address, self.__port),
+                            authkey=self.__authkey)
+        closing = threading.Event()
+        address = (self.__host or listener.address[0], listener.address[1])
+        logger().info(f"Run coordinator listening on {listener.address}")
+
+        def accept():
+            worker = 0
+            while True:
+                try:
+                    connection = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    if closing.is_set():
+                        return
+                    continue
+                threading.Thread(target=_serve_worker,
+                                 args=(coordinator, connection, worker),
+                                 daemon=True).start()
+                worker += 1
+
+        threading.Thread(target=accept, daemon=True).start()
+        processes = [self.__local_worker(address)
+                     for _ in range(self.__local_workers)]
+        try:
+            while True:
+                with coordinator.condition:
+                    if coordinator.finished:
+                        break
+                    coordinator.condition.wait(
+                        min(self.__heartbeat, self.__lease_time))
+                coordinator.expire()
+                for index, process in enumerate(processes):
+                    if not process.is_alive():
+                        processes[index] = self.__local_worker(address)
+        finally:
+            closing.set()
+            listener.close()
+            for process in processes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+        self.pipeline_stats = coordinator.pipeline
+        if self.pipeline_stats is not None:
+            logger().info(f"Pipeline: {self.pipeline_stats.summary()}")
+        return sorted(coordinator.failures,
+                      key=lambda failure: (failure.batch, failure.item))
+
+
+def main(args: list[str] = None):
+    """Start a worker from the command line
+
+    :param args: Command line arguments, the process arguments by default
+    """
+    parser = argparse.ArgumentParser(
+        description="Run the batch items served by a scixtracer coordinator")
+    parser.add_argument("config", help="Config file of the workspace")
+    parser.add_argument("--host", help="Address of the coordinator")
+    parser.add_argument("--port", type=int, help="Port of the coordinator")
+    parser.add_argument("--persistent", action="store_true",
+                        help="Wait for the next run at the end of a run")
+    args = parser.parse_args(args)
+    runner_config = ConfigData(Path(args.config)).section("runner")
+    host = args.host or runner_config.get("host") or \
+        runner_config.get("address", "127.0.0.1")
+    worker_main((host, args.port or int(runner_config["port"])),
+                str(runner_config["authkey"]).encode(),
+                args.config,
+                heartbeat=float(runner_config.get("heartbeat", 5.0)),
+                persistent=args.persistent,
+                cache_size=int(float(runner_config.get("input_cache", 256))
+                               * 2**20))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Built-in runner executing the batch items in a pool of threads
+
+The items run concurrently in the process that starts the run. It suits the
+job functions that spend their time in code releasing the GIL (NumPy, SciPy,
+scikit-image): the items share the storage connection and the input cache,
+and no item or data is pickled.
+
+Items are scheduled with the dependency graph of the run, as with the process
+runner: an item starts as soon as the items producing its inputs are done,
+the items made ready run next, and an item only starts if its memory and
+threads fit in the budget left by the running items. The items of a
+batchable job run in one function call per group of `batch_size` ready
+items.
+
+A storage backend that sets `thread_safe` to True is called concurrently by
+the items. The calls to the other backends are serialized with a lock, while
+the functions of the items still run in parallel.
+
+Configuration in the `runner` section of the config file:
+
+.. code-block:: yaml
+
+    runner:
+      name: thread
+      workers: 8               # default: number of CPUs
+      input_cache: 256         # MB of inputs shared by the threads, 0: none
+      read_only_inputs: false  # give the cached arrays read-only, not copied
+      memory: 16000            # MB shared by the running items, default: none
+      cpus: 8                  # threads shared by the running items,
+                               # default: number of CPUs
+"""
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import os
+
+from .models import Batch
+from .models import ItemFailure
+from .runner import InputCache
+from .runner import SxRunner
+from .runner import item_failure
+from .runner import item_path
+from .runner import shared_backend
+from .scheduler import DependencyGraph
+from .scheduler import ResourceBudget
+from .scheduler import WorkQueues
+from .storage import SxStorage
+
+
+class SxRunnerThread(SxRunner):
+    """Runner using a pool of threads of the current process"""
+    journaling = True
+    fusing = True
+
+    def __init__(self, storage: SxStorage = None):
+        super().__init__(storage)
+        self.__workers = os.cpu_count()
+        self.__input_cache = 256 * 2**20
+        self.__read_only_inputs = False
+        self.__memory = None
+        self.__cpus = os.cpu_count()
+
+    def connect(self,
+                workers: int = None,
+                input_cache: float = 256,
+                read_only_inputs: bool = False,
+                memory: float = None,
+                cpus: int = None,
+                **kwargs):
+        """Set the pool parameters
+
+        :param workers: Number of threads,
+        :param input_cache: Memory size in MB of the inputs kept for the
+                            items sharing them,
+        :param read_only_inputs: Give the cached numpy arrays to the items
+                                 read-only instead of copied,
+        :param memory: Memory in MB shared by the running items, None for no
+                       limit,
+        :param cpus: Number of threads shared by the running items
+        """
+        if workers is not None:
+            self.__workers = max(1, int(workers))
+        self.__input_cache = max(0, int(float(input_cache) * 2**20))
+        self.__read_only_inputs = bool(read_only_inputs)
+        if memory is not None:
+            self.__memory = float(memory)
+        if cpus is not None:
+            self.__cpus = int(cpus)
+
+    def __worker(self) -> SxRunner:
+        """Create the runner shared by the threads"""
+        worker = SxRunnerThread(shared_backend(self.storage))
+        worker.measure_memory = False
+        if self.__input_cache > 0:
+            worker.input_cache = InputCache(self.__input_cache,
+                                            self.__read_only_inputs)
+        return worker
+
+    def run(self, batches: list[Batch]) -> list[ItemFailure]:
+        graph = DependencyGraph(batches)
+        queues = WorkQueues(1, graph.inputs)
+        queues.distribute(graph.ready())
+        budget = ResourceBudget(
+            self.__memory, self.__cpus,
+            lambda node: (graph.item(node).memory, graph.item(node).threads))
+        worker = self.__worker()
+        failures = []
+        running = {}
+        with ThreadPoolExecutor(self.__workers,
+                                thread_name_prefix="sxt-runner") as pool:
+            while True:
+                while len(running) < self.__workers and len(queues) > 0:
+                    nodes = queues.take(0, 1, budget.fits)
+                    if not nodes:
+                        break
+                    size = graph.item(nodes[0]).batch_size
+                    if size > 1:
+                        nodes += queues.take(0, size - 1, budget.fits)
+                    reserved = budget.acquire(nodes)
+                    for node in nodes:
+                        self.record_started(node)
+                    future = pool.submit(worker.run_items,
+                                         [graph.item(node) for node in nodes])
+                    running[future] = (nodes, reserved)
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    nodes, reserved = running.pop(future)
+                    budget.release(reserved)
+                    errors = future.result()[0]
+                    failed = self.record_failures(graph, failures, [
+                        item_failure(*node, item_path(graph.item(node)),
+                                     error)
+                        for node, error in zip(nodes, errors)
+                        if error is not None])
+                    for node in nodes:
+                        if node not in failed:
+                            self.record_done(node, graph.item(node))
+                            queues.push(0, graph.done(node))
+        return sorted(failures, key=lambda failure: (failure.batch,
+                                                     failure.item))
@@ -0,0 +1,516 @@
+"""Dependency graph between the items of a run
+
+The run planner creates the outputs of every item before the run starts, so
+an item that consumes the output of another item has this output URI in its
+inputs. The graph links each item to the items producing its inputs. An item
+is ready when all its producers are done, whatever their batch, so the
+downstream items of a location can start while other locations are still
+processed by the upstream job.
+
+The ready items are balanced between the workers with work stealing: each
+worker has its own deque of items, takes chunks from its front, and steals
+from the back of the longest deque when its own is empty. The chunk size is
+adapted with guided self-scheduling: large chunks while many items are
+ready, smaller ones near the end of the run, and never longer than a target
+duration given the observed item runtimes.
+
+The items are placed by data locality: the items reading the same input URI
+are queued back to back on the worker that first read it, so the worker
+input cache serves the input again instead of the storage.
+
+The running items share a memory and CPU budget: an item only starts if its
+memory and threads fit in what the running items leave.
+
+Before the run, the chains of items with a single consumer at the same
+location (eg a filter followed by a detection on the filtered image) are
+fused into one item, so the intermediate results go from one stage to the
+next in memory.
+"""
+from typing import Callable
+from typing import Iterator
+from collections import deque
+import math
+
+from .models import DataInfo
+from .models import DataInfoSet
+from .models import BatchItem
+from .models import Batch
+from .models import FusedItem
+
+
+Node = tuple[int, int]
+
+
+def input_uris(value: any) -> Iterator[str]:
+    """Get the URIs of the data in a batch item input
+
+    :param value: Data information, list of data information or value,
+    :return: The data URIs
+    """
+    if isinstance(value, DataInfo):
+        yield value.uri.value
+    elif isinstance(value, DataInfoSet):
+        yield from value.uris.tolist()
+    elif isinstance(value, (list, tuple)):
+        for val in value:
+            yield from input_uris(val)
+
+
+class DependencyGraph:
+    """Dependencies between the items of a list of batches
+
+    Each item is identified by a node `(batch index, item index)`.
+
+    :param batches: Batches of the run
+    """
+    def __init__(self, batches: list[Batch]):
+        self.__batches = batches
+        producers = {}
+        for batch_index, batch in enumerate(batches):
+            for item_index, item in enumerate(batch.items):
+                for info in item.outputs:
+                    producers[info.uri.value] = (batch_index, item_index)
+
+        self.__inputs = {}
+        self.__dependencies = {}
+        self.__consumers = {}
+        for batch_index, batch in enumerate(batches):
+            for item_index, item in enumerate(batch.items):
+                node = (batch_index, item_index)
+                uris = list(dict.fromkeys(input_uris(item.inputs)))
+                self.__inputs[node] = uris
+                dependencies = {producers[uri]
+                                for uri in uris
+                                if uri in producers} - {node}
+                self.__dependencies[node] = dependencies
+                for dependency in dependencies:
+                    self.__consumers.setdefault(dependency, []).append(node)
+        self.__pending = {node: len(dependencies)
+                          for node, dependencies in self.__dependencies.items()}
+
+    def __len__(self):
+        return len(self.__dependencies)
+
+    def item(self, node: Node):
+        """Get the batch item of a node
+
+        :param node: The node,
+        :return: The batch item
+        """
+        return self.__batches[node[0]].items[node[1]]
+
+    def inputs(self, node: Node) -> list[str]:
+        """Get the URIs of the data read by an item
+
+        :param node: The node,
+        :return: The input URIs, without duplicates
+        """
+        return self.__inputs[node]
+
+    def dependencies(self, node: Node) -> set[Node]:
+        """Get the items producing the inputs of an item
+
+        :param node: The node,
+        :return: The producer nodes
+        """
+        return self.__dependencies[node]
+
+    def consumers(self, node: Node) -> list[Node]:
+        """Get the items using the outputs of an item
+
+        :param node: The node,
+        :return: The consumer nodes
+        """
+        return self.__consumers.get(node, [])
+
+    def ready(self) -> list[Node]:
+        """Get the items that have no dependencies
+
+        :return: The nodes in batch order
+        """
+        return [node for node, count in self.__pending.items() if count == 0]
+
+    def done(self, node: Node) -> list[Node]:
+        """Mark an item as done
+
+        :param node: The finished node,
+        :return: The consumers that became ready
+        """
+        ready = []
+        for consumer in self.consumers(node):
+            self.__pending[consumer] -= 1
+            if self.__pending[consumer] == 0:
+                ready.append(consumer)
+        return ready
+
+    def failed(self, node: Node) -> list[Node]:
+        """Mark an item as failed
+
+        :param node: The failed node,
+        :return: All the items that depend on it, directly or not, and that
+                 cannot run anymore
+        """
+        cancelled = []
+        stack = list(self.consumers(node))
+        while stack:
+            consumer = stack.pop()
+            if self.__pending[consumer] < 0:
+                continue
+            self.__pending[consumer] = -1
+            cancelled.append(consumer)
+            stack.extend(self.consumers(consumer))
+        return sorted(cancelled)
+
+
+class WorkQueues:
+    """Deques of ready items, one per worker, with work stealing
+
+    :param workers: Number of workers,
+    :param inputs: Function giving the input URIs of an item, to queue the
+                   items sharing inputs on the same worker
+    """
+    def __init__(self,
+                 workers: int,
+                 inputs: Callable[[Node], list[str]] = None):
+        self.__queues = [deque() for _ in range(workers)]
+        self.__inputs = inputs
+        self.__owners = {}
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.__queues)
+
+    def __owner(self, node: Node) -> int | None:
+        """Get the worker that read an input of an item, if any"""
+        if self.__inputs is None:
+            return None
+        for uri in self.__inputs(node):
+            if uri in self.__owners:
+                return self.__owners[uri]
+        return None
+
+    def __own(self, worker: int, node: Node):
+        """Assign the inputs of an item, not assigned yet, to a worker"""
+        if self.__inputs is not None:
+            for uri in self.__inputs(node):
+                self.__owners.setdefault(uri, worker)
+
+    def distribute(self, nodes: list[Node]):
+        """Split items in contiguous blocks, one block per worker
+
+        The items sharing an input are kept together in the block of the
+        first of them.
+
+        :param nodes: Ready items
+        """
+        groups = {}
+        keys = {}
+        for node in nodes:
+            uris = self.__inputs(node) if self.__inputs is not None else []
+            key = next((keys[uri] for uri in uris if uri in keys), node)
+            for uri in uris:
+                keys.setdefault(uri, key)
+            groups.setdefault(key, []).append(node)
+        size = math.ceil(len(nodes) / len(self.__queues))
+        position = 0
+        for group in groups.values():
+            worker = min(position // size, len(self.__queues) - 1)
+            self.__queues[worker].extend(group)
+            for node in group:
+                self.__own(worker, node)
+            position += len(group)
+
+    def push(self, worker: int, nodes: list[Node]):
+        """Add items to the deque of a worker
+
+        The items go to the front of the deque of the worker that read one of
+        their inputs, or of the given worker, to run while their inputs are
+        cached.
+
+        :param worker: Index of the worker that made the items ready,
+        :param nodes: Ready items
+        """
+        front = {}
+        for node in nodes:
+            owner = self.__owner(node)
+            if owner is None:
+                owner = worker
+            front.setdefault(owner, []).append(node)
+            self.__own(owner, node)
+        for owner, group in front.items():
+            self.__queues[owner].extendleft(reversed(group))
+
+    def take(self,
+             worker: int,
+             count: int,
+             fits: Callable[[Node], bool] = None) -> list[Node]:
+        """Get the next items of a worker
+
+        The items are taken from the front of the worker deque. If it is
+        empty, up to half of the longest other deque is stolen from its back.
+        With a `fits` test, the items that do not fit are skipped, looking at
+        a limited number of items in each deque.
+
+        :param worker: Index of the worker,
+        :param count: Maximum number of items,
+        :param fits: Test of the items that can run now,
+        :return: The items, empty if there is no ready item that fits
+        """
+        queue = self.__queues[worker]
+        if fits is None:
+            if queue:
+                return [queue.popleft()
+                        for _ in range(min(count, len(queue)))]
+            victim = max(self.__queues, key=len)
+            count = min(count, math.ceil(len(victim) / 2))
+            return [victim.pop() for _ in range(count)][::-1]
+
+        nodes = _select(queue, count, fits, False)
+        if nodes:
+            return nodes
+        for victim in sorted(self.__queues, key=len, reverse=True):
+            if victim is not queue and victim:
+                nodes = _select(victim, min(count, math.ceil(len(victim) / 2)),
+                                fits, True)
+                if nodes:
+                    return nodes[::-1]
+        return []
+
+
+# Number of items skipped at most when looking for items that fit
+_SCAN_LIMIT = 64
+
+
+def _select(queue: deque,
+            count: int,
+            fits: Callable[[Node], bool],
+            from_back: bool) -> list[Node]:
+    """Remove up to count items that fit from one end of a deque
+
+    The skipped items stay in the deque in the same order.
+    """
+    taken = []
+    skipped = []
+    while queue and len(taken) < count and len(skipped) < _SCAN_LIMIT:
+        node = queue.pop() if from_back else queue.popleft()
+        if fits(node):
+            taken.append(node)
+        else:
+            skipped.append(node)
+    if from_back:
+        queue.extend(reversed(skipped))
+    else:
+        queue.extendleft(reversed(skipped))
+    return taken
+
+
+class ChunkSizer:
+    """Adaptive number of items sent to a worker at once
+
+    :param workers: Number of workers,
+    :param max_size: Maximum chunk size,
+    :param target_time: Target duration of a chunk in seconds,
+    :param factor: Guided scheduling factor, a chunk contains at most the
+                   ready items divided by `factor` times the workers
+    """
+    def __init__(self,
+                 workers: int,
+                 max_size: int,
+                 target_time: float,
+                 factor: int = 2):
+        self.__workers = workers
+        self.__max_size = max_size
+        self.__target_time = target_time
+        self.__factor = factor
+        self.__item_time = None
+
+    @property
+    def item_time(self) -> float | None:
+        """Moving average of the item runtime, None before any observation"""
+        return self.__item_time
+
+    def observe(self, durations: list[float]):
+        """Update the item runtime with the durations of a chunk
+
+        :param durations: Runtime of each item of the chunk in seconds
+        """
+        if not durations:
+            return
+        mean = sum(durations) / len(durations)
+        if self.__item_time is None:
+            self.__item_time = mean
+        else:
+            self.__item_time = 0.7 * self.__item_time + 0.3 * mean
+
+    def size(self, ready: int) -> int:
+        """Get the size of the next chunk
+
+        :param ready: Number of ready items not sent yet,
+        :return: The chunk size
+        """
+        size = math.ceil(ready / (self.__factor * self.__workers))
+        if self.__item_time and math.isfinite(self.__target_time):
+            size = min(size, int(self.__target_time / self.__item_time))
+        return max(1, min(size, self.__max_size))
+
+
+class ResourceBudget:
+    """Memory and threads shared by the running chunks of items
+
+    A chunk runs its items one after the other, so it needs the largest
+    memory and the largest number of threads of its items. A chunk is
+    admitted if it fits in what the running chunks leave, or if no chunk is
+    running. The memory of an item is the hint of its job until items of the
+    job are measured, then the largest measured peak with a margin.
+
+    :param memory: Memory available to the items in MB, None for no limit,
+    :param threads: Threads available to the items,
+    :param hints: Function giving the memory hint (None if unknown) and the
+                  threads of an item,
+    :param margin: Factor applied to the measured peaks
+    """
+    def __init__(self,
+                 memory: float | None,
+                 threads: int,
+                 hints: Callable[[Node], tuple[float | None, int]],
+                 margin: float = 1.2):
+        self.__memory = memory
+        self.__threads = threads
+        self.__hints = hints
+        self.__margin = margin
+        self.__peaks = {}
+        self.__used_memory = 0.0
+        self.__used_threads = 0
+        self.__running = 0
+
+    def need(self, node: Node) -> tuple[float, int]:
+        """Get the memory and threads needed by an item
+
+        :param node: The item,
+        :return: The memory in MB and the number of threads
+        """
+        memory, threads = self.__hints(node)
+        if node[0] in self.__peaks:
+            memory = self.__peaks[node[0]] * self.__margin
+        return memory or 0.0, threads
+
+    def fits(self, node: Node) -> bool:
+        """Check if an item can start now
+
+        :param node: The item,
+        :return: True if the item fits in the free resources
+        """
+        if self.__running == 0:
+            return True
+        memory, threads = self.need(node)
+        if self.__memory is not None and \
+                self.__used_memory + memory > self.__memory:
+            return False
+        return self.__used_threads + threads <= self.__threads
+
+    def acquire(self, nodes: list[Node]) -> tuple[float, int]:
+        """Reserve the resources of a chunk
+
+        :param nodes: Items of the chunk,
+        :return: The reserved memory and threads, to release
+        """
+        needs = [self.need(node) for node in nodes]
+        reserved = (max(memory for memory, _ in needs),
+                    max(threads for _, threads in needs))
+        self.__used_memory += reserved[0]
+        self.__used_threads += reserved[1]
+        self.__running += 1
+        return reserved
+
+    def release(self, reserved: tuple[float, int]):
+        """Free the resources of a finished chunk
+
+        :param reserved: Resources returned by :meth:`acquire`
+        """
+        self.__used_memory -= reserved[0]
+        self.__used_threads -= reserved[1]
+        self.__running -= 1
+
+    def observe(self, nodes: list[Node], peaks: list[float | None]):
+        """Record the measured peak memory of items
+
+        :param nodes: The items,
+        :param peaks: Peak memory of each item in MB, None if not measured
+        """
+        for node, peak in zip(nodes, peaks):
+            if peak is not None:
+                self.__peaks[node[0]] = max(peak,
+                                            self.__peaks.get(node[0], 0.0))
+
+
+def _fusible(producer: BatchItem, consumer: BatchItem) -> bool:
+    """Check if two items can run as stages of the same task"""
+    items = (producer, consumer)
+    if any(isinstance(item, FusedItem) or item.batch_size > 1 or
+           not item.outputs for item in items):
+        return False
+    locations = {info.location.uuid
+                 for item in items for info in item.outputs}
+    return len(locations) == 1
+
+
+def fuse_batches(batches: list[Batch], transient: set[str] = None
+                 ) -> tuple[list[Batch], dict[Node, list[Node]]]:
+    """Fuse the chains of items with a single consumer at the same location
+
+    An item is fused with its consumer if it is the only consumer of the
+    item, the item is its only producer, both write at the same location and
+    none of them is batchable. The fused item takes the place of the first
+    item of its chain. A transient output is kept in memory only if all its
+    consumers are in the same chain.
+
+    :param batches: Batches of the run,
+    :param transient: URIs of the outputs that need not be written,
+    :return: The batches with the fused items, and the nodes of the given
+             batches run by each node of the returned batches
+    """
+    transient = transient or set()
+    graph = DependencyGraph(batches)
+    nodes = [(batch_index, item_index)
+             for batch_index, batch in enumerate(batches)
+             for item_index in range(len(batch))]
+    readers = {}
+    for node in nodes:
+        for uri in graph.inputs(node):
+            readers.setdefault(uri, []).append(node)
+
+    next_stage = {}
+    for node in nodes:
+        consumers = graph.consumers(node)
+        if len(consumers) == 1 and \
+                graph.dependencies(consumers[0]) == {node} and \
+                _fusible(graph.item(node), graph.item(consumers[0])):
+            next_stage[node] = consumers[0]
+    chains = {}
+    fused = set(next_stage.values())
+    for node in nodes:
+        if node in next_stage and node not in fused:
+            chain = [node]
+            while chain[-1] in next_stage:
+                chain.append(next_stage[chain[-1]])
+            chains[node] = chain
+
+    fused_batches = []
+    fused_nodes = {}
+    for batch_index, batch in enumerate(batches):
+        fused_batch = Batch()
+        for item_index, item in enumerate(batch.items):
+            node = (batch_index, item_index)
+            if node in fused:
+                continue
+            chain = chains.get(node, [node])
+            if len(chain) > 1:
+                stages = [graph.item(stage) for stage in chain]
+                item = FusedItem(stages, [
+                    info.uri.value for stage in stages
+                    for info in stage.outputs
+                    if info.uri.value in transient and
+                    set(readers.get(info.uri.value, [])) <= set(chain)])
+            fused_nodes[(batch_index, len(fused_batch))] = chain
+            fused_batch.append(item)
+        fused_batches.append(fused_batch)
+    return fused_batches, fused_nodes
@@ -0,0 +1,412 @@
+"""Compact binary encoding of jobs and batches
+
+The encoding is made to send jobs and batches to workers or to write them on
+disk. A message starts with a magic number and a format version, followed by
+a pickle of built-in types only:
+
+- functions are stored by import path (`module:qualname`),
+- datasets are stored once in a shared table and referenced by index,
+- data are stored by reference (dataset index, location uuid, storage type,
+  URI and metadata URI), not as DataInfo objects,
+- the batching options and resource hints of an item are only stored when
+  they differ from their defaults,
+- a fused item stores its stages in its options.
+
+The pickle is loaded with an unpickler that refuses any class or function
+other than the data reference marker and the numpy array and scalar
+constructors, so loading it never imports or runs other code. The items of
+a decoded batch are only rebuilt when they are accessed, which imports the
+modules of their functions: only decode messages from a trusted sender.
+"""
+from typing import Callable
+import functools
+import importlib
+import io
+import pickle
+import struct
+
+from .models import StorageTypes
+from .models import URI
+from .models import Dataset
+from .models import Location
+from .models import DataInfo
+from .models import DataInfoSet
+from .models import Job
+from .models import DataQueryType
+from .models import BatchItem
+from .models import FusedItem
+from .models import Batch
+
+
+FORMAT_MAGIC = b"SXB"
+FORMAT_VERSION = 2
+
+__HEADER = struct.Struct(">3sBB")
+__JOB = 1
+__BATCH_ITEM = 2
+__BATCH = 3
+
+# Tags of the encoded inputs. Plain values are stored as is, data references
+# are stored as _DataRef tuples starting with a tag.
+__DATA = 0
+__DATA_SET = 1
+
+__STORAGE_TYPES = {str(type_): type_ for type_ in StorageTypes}
+
+
+class _DataRef(tuple):
+    """Encoded data reference, told apart from the tuple parameters"""
+    __slots__ = ()
+
+
+# Objects a message may contain besides the built-in types
+_ALLOWED = {
+    (__name__, "_DataRef"),
+    ("numpy", "dtype"),
+    ("numpy", "ndarray"),
+    ("numpy.core.multiarray", "_reconstruct"),
+    ("numpy.core.multiarray", "scalar"),
+    ("numpy.core.numeric", "_frombuffer"),
+    ("numpy._core.multiarray", "_reconstruct"),
+    ("numpy._core.multiarray", "scalar"),
+    ("numpy._core.numeric", "_frombuffer"),
+}
+
+
+class _SafeUnpickler(pickle.Unpickler):
+    """Unpickler restricted to built-in types, numpy arrays and scalars"""
+    def find_class(self, module, name):
+        if (module, name) in _ALLOWED:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(
+            f"Forbidden object {module}.{name} in a scixtracer message")
+
+
+def function_path(func: Callable) -> str:
+    """Get the import path of a function
+
+    :param func: Function defined at the top level of a module,
+    :return: The path as `module:qualname`
+    """
+    qualname = func.__qualname__
+    if "<" in qualname:
+        raise ValueError(f"Function {qualname} cannot be imported by path, "
+                         "define it at the top level of a module")
+    return f"{func.__module__}:{qualname}"
+
+
+@functools.lru_cache(maxsize=None)
+def import_function(path: str) -> Callable:
+    """Import a function from its import path
+
+    :param path: Path as `module:qualname`,
+    :return: The function
+    """
+    module_name, qualname = path.split(":")
+    obj = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+class _Tables:
+    """Tables of the functions and datasets shared by the encoded objects"""
+    def __init__(self,
+                 functions: list[str] = None,
+                 datasets: list[tuple[str, str, str | None]] = None):
+        self.functions = functions if functions is not None else []
+        self.datasets = datasets if datasets is not None else []
+        self.__function_ids = {}
+        self.__dataset_ids = {}
+        self.__functions = {}
+        self.__datasets = {}
+
+    def function_id(self, func: Callable) -> int:
+        """Get the index of a function, adding it if needed"""
+        func_id = self.__function_ids.get(func)
+        if func_id is None:
+            func_id = len(self.functions)
+            self.functions.append(function_path(func))
+            self.__function_ids[func] = func_id
+        return func_id
+
+    def dataset_id(self, dataset: Dataset) -> int:
+        """Get the index of a dataset, adding it if needed"""
+        key = dataset.uri.value
+        dataset_id = self.__dataset_ids.get(key)
+        if dataset_id is None:
+            dataset_id = len(self.datasets)
+            self.datasets.append((dataset.name, key, dataset.metadata_value))
+            self.__dataset_ids[key] = dataset_id
+        return dataset_id
+
+    def function(self, func_id: int) -> Callable:
+        """Get a function from its index"""
+        func = self.__functions.get(func_id)
+        if func is None:
+            func = import_function(self.functions[func_id])
+            self.__functions[func_id] = func
+        return func
+
+    def dataset(self, dataset_id: int) -> Dataset:
+        """Get a dataset from its index"""
+        dataset = self.__datasets.get(dataset_id)
+        if dataset is None:
+            dataset = Dataset.intern(*self.datasets[dataset_id])
+            self.__datasets[dataset_id] = dataset
+        return dataset
+
+
+def _dumps(kind: int, payload: tuple) -> bytes:
+    """Write the header and the payload of a message"""
+    return __HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, kind) + \
+        pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _loads(kind: int, message: bytes) -> tuple:
+    """Check the header of a message and read its payload"""
+    if len(message) < __HEADER.size:
+        raise ValueError("Message too short for a scixtracer message")
+    magic, version, message_kind = __HEADER.unpack_from(message)
+    if magic != FORMAT_MAGIC:
+        raise ValueError("Not a scixtracer message")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported message format version {version}")
+    if message_kind != kind:
+        raise ValueError(f"Message of kind {message_kind}, expected {kind}")
+    stream = io.BytesIO(memoryview(message)[__HEADER.size:])
+    return _SafeUnpickler(stream).load()
+
+
+def _encode_value(value: any, tables: _Tables) -> any:
+    """Encode a batch item input or output"""
+    if isinstance(value, DataInfo):
+        return _DataRef((__DATA, tables.dataset_id(value.dataset),
+                         value.location.uuid, str(value.storage_type),
+                         value.uri.value,
+                         None if value.metadata_uri is None
+                         else value.metadata_uri.value))
+    if isinstance(value, DataInfoSet):
+        return _DataRef((__DATA_SET, tables.dataset_id(value.dataset),
+                         value.uuids.tolist(), value.storage_types.tolist(),
+                         value.uris.tolist(), value.metadata_uris.tolist()))
+    if isinstance(value, list):
+        return [_encode_value(val, tables) for val in value]
+    if type(value) is tuple:  # pylint: disable=C0123
+        return tuple(_encode_value(val, tables) for val in value)
+    return value
+
+
+def _decode_value(value: any, tables: _Tables) -> any:
+    """Decode a batch item input or output"""
+    if isinstance(value, _DataRef):
+        if value[0] == __DATA:
+            _, dataset_id, uuid, storage_type, uri, metadata_uri = value
+            return DataInfo(
+                location=Location.intern(tables.dataset(dataset_id), uuid),
+                storage_type=__STORAGE_TYPES[storage_type],
+                uri=URI(value=uri),
+                metadata_uri=None if metadata_uri is None
+                else URI(value=metadata_uri))
+        return DataInfoSet(tables.dataset(value[1]), *value[2:])
+    if isinstance(value, list):
+        return [_decode_value(val, tables) for val in value]
+    if isinstance(value, tuple):
+        return tuple(_decode_value(val, tables) for val in value)
+    return value
+
+
+def _encode_item(item: BatchItem, tables: _Tables) -> tuple:
+    """Encode a batch item with the shared tables
+
+    A fused item is encoded with empty inputs and outputs, and its stages in
+    its options.
+    """
+    if isinstance(item, FusedItem):
+        return (tables.function_id(item.func), [], [],
+                {"stages": [_encode_item(stage, tables)
+                            for stage in item.stages],
+                 "transient": sorted(item.transient)})
+    encoded = (tables.function_id(item.func),
+               _encode_value(item.inputs, tables),
+               _encode_value(item.outputs, tables))
+    options = _item_options(item, tables.function_id)
+    if options:
+        encoded += (options,)
+    return encoded
+
+
+def _item_options(item: BatchItem | Job, function_id: Callable) -> dict:
+    """Get the batching options and resource hints that are not defaults
+
+    :param item: Batch item or job,
+    :param function_id: Function encoding the stack and unstack functions,
+    :return: The options by name
+    """
+    options = {}
+    if item.batch_size > 1:
+        options["batch_size"] = item.batch_size
+        for name in ("stack", "unstack"):
+            func = getattr(item, name)
+            if func is not None:
+                options[name] = function_id(func)
+    if item.memory is not None:
+        options["memory"] = item.memory
+    if item.threads != 1:
+        options["threads"] = item.threads
+    if not getattr(item, "keep", True):
+        options["keep"] = False
+    return options
+
+
+def _decode_options(options: dict, function: Callable) -> dict:
+    """Decode the options written by :func:`_item_options`"""
+    options = dict(options)
+    for name in ("stack", "unstack"):
+        if name in options:
+            options[name] = function(options[name])
+    return options
+
+
+def _decode_item(encoded: tuple, tables: _Tables) -> BatchItem:
+    """Decode a batch item encoded by :func:`_encode_item`"""
+    if len(encoded) > 3 and "stages" in encoded[3]:
+        return FusedItem([_decode_item(stage, tables)
+                          for stage in encoded[3]["stages"]],
+                         encoded[3]["transient"])
+    return _EncodedBatchItem(encoded, tables)
+
+
+class _EncodedBatchItem(BatchItem):
+    """Batch item decoded on first access to its content"""
+    def __init__(self, encoded: tuple, tables: _Tables):
+        super().__init__(None, None, None)
+        self.__encoded = encoded
+        self.__tables = tables
+        self.__decoded = None
+
+    def __decode(self) -> tuple:
+        if self.__decoded is None:
+            func_id, inputs, outputs = self.__encoded[:3]
+            self.__decoded = (self.__tables.function(func_id),
+                              _decode_value(inputs, self.__tables),
+                              _decode_value(outputs, self.__tables),
+                              _decode_options(self.__options,
+                                              self.__tables.function))
+        return self.__decoded
+
+    @property
+    def __options(self) -> dict:
+        """Options of the item that are not defaults, not decoded"""
+        return self.__encoded[3] if len(self.__encoded) > 3 else {}
+
+    @property
+    def func(self):
+        """Function property"""
+        return self.__decode()[0]
+
+    @property
+    def inputs(self):
+        """Inputs property"""
+        return self.__decode()[1]
+
+    @property
+    def outputs(self):
+        """Outputs property"""
+        return self.__decode()[2]
+
+    @property
+    def batch_size(self) -> int:
+        """Maximum number of items per call of the function"""
+        return self.__options.get("batch_size", 1)
+
+    @property
+    def stack(self) -> Callable | None:
+        """Function stacking the item values of a data input"""
+        return self.__decode()[3].get("stack")
+
+    @property
+    def unstack(self) -> Callable | None:
+        """Function splitting an output into the item values"""
+        return self.__decode()[3].get("unstack")
+
+    @property
+    def memory(self) -> float | None:
+        """Peak memory of the item in MB, None if unknown"""
+        return self.__options.get("memory")
+
+    @property
+    def threads(self) -> int:
+        """Number of threads used by the item"""
+        return self.__options.get("threads", 1)
+
+
+def encode_job(job: Job) -> bytes:
+    """Encode a job description
+
+    :param job: Job to encode,
+    :return: The binary message
+    """
+    return _dumps(__JOB, (function_path(job.func), job.inputs, job.outputs,
+                          str(job.query_type),
+                          _item_options(job, function_path)))
+
+
+def decode_job(message: bytes) -> Job:
+    """Decode a job description
+
+    :param message: Message written by :func:`encode_job`,
+    :return: The job
+    """
+    func, inputs, outputs, query_type, *options = _loads(__JOB, message)
+    return Job(func=import_function(func),
+               inputs=inputs,
+               outputs=outputs,
+               query_type=DataQueryType(query_type),
+               **_decode_options(options[0] if options else {},
+                                 import_function))
+
+
+def encode_batch_item(item: BatchItem) -> bytes:
+    """Encode a batch item
+
+    :param item: Item to encode,
+    :return: The binary message
+    """
+    tables = _Tables()
+    encoded = _encode_item(item, tables)
+    return _dumps(__BATCH_ITEM, (tables.functions, tables.datasets, encoded))
+
+
+def decode_batch_item(message: bytes) -> BatchItem:
+    """Decode a batch item
+
+    :param message: Message written by :func:`encode_batch_item`,
+    :return: The item, decoded on first access to its content
+    """
+    functions, datasets, encoded = _loads(__BATCH_ITEM, message)
+    return _decode_item(encoded, _Tables(functions, datasets))
+
+
+def encode_batch(batch: Batch) -> bytes:
+    """Encode a batch with tables shared by all its items
+
+    :param batch: Batch to encode,
+    :return: The binary message
+    """
+    tables = _Tables()
+    items = [_encode_item(item, tables) for item in batch.items]
+    return _dumps(__BATCH, (tables.functions, tables.datasets, items))
+
+
+def decode_batch(message: bytes) -> Batch:
+    """Decode a batch
+
+    :param message: Message written by :func:`encode_batch`,
+    :return: The batch, each item is decoded on first access to its content
+    """
+    functions, datasets, items = _loads(__BATCH, message)
+    tables = _Tables(functions, datasets)
+    batch = Batch()
+    batch.items = [_decode_item(encoded, tables) for encoded in items]
+    return batch
@@ -0,0 +1,234 @@
+"""Export and import of a dataset index as compressed columnar files"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .models import Dataset
+
+
+SNAPSHOT_VERSION = 1
+
+__VALUE_TYPES = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": lambda value: value == "True"
+}
+
+
+def annotation_type(value: any) -> str:
+    """Get the name of the type used to store an annotation value"""
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, np.integer)):
+        return "int"
+    if isinstance(value, (float, np.floating)):
+        return "float"
+    return "str"
+
+
+def encode_values(values: list[any]) -> tuple[list[str], list[str]]:
+    """Encode annotation values into a string column and a type column
+
+    :param values: Annotation values,
+    :return: The values as strings and the name of their types
+    """
+    types = [annotation_type(value) for value in values]
+    return [str(value) for value in values], types
+
+
+def decode_values(values: list[str], types: list[str]) -> list[any]:
+    """Decode annotation values from a string column and a type column
+
+    :param values: Annotation values as strings,
+    :param types: Name of the value types,
+    :return: The annotation values
+    """
+    return [__VALUE_TYPES[type_](value)
+            for value, type_ in zip(values, types)]
+
+
+def annotations_table(ids: list[any],
+                      keys: list[str],
+                      values: list[any],
+                      id_column: str
+                      ) -> pd.DataFrame:
+    """Build a long annotation table from parallel columns
+
+    :param ids: Identifier of the annotated object for each annotation,
+    :param keys: Annotation keys,
+    :param values: Annotation values,
+    :param id_column: Name of the identifier column,
+    :return: The annotation table
+    """
+    str_values, types = encode_values(values)
+    return pd.DataFrame({id_column: ids,
+                         "key": pd.Categorical(keys),
+                         "value": str_values,
+                         "value_type": pd.Categorical(types)})
+
+
+def _melt_view(view: pd.DataFrame,
+               id_column: str,
+               base_columns: list[str]
+               ) -> pd.DataFrame:
+    """Turn the annotation columns of a view table into a long table"""
+    ids, keys, values = [], [], []
+    id_values = view[id_column].tolist()
+    for key in view.columns:
+        if key in base_columns:
+            continue
+        for object_id, value in zip(id_values, view[key].tolist()):
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                continue
+            ids.append(object_id)
+            keys.append(key)
+            values.append(value)
+    return annotations_table(ids, keys, values, id_column)
+
+
+class IndexSnapshot:
+    """Complete content of a dataset index as columnar tables
+
+    :param dataset: Name, URI, metadata URI and description of the dataset,
+    :param locations: Table with the `location` uuid column,
+    :param location_annotations: Table with the `location`, `key`, `value`,
+                                 and `value_type` columns,
+    :param data: Table with the `uri`, `location`, `storage_type` and
+                 `metadata_uri` columns,
+    :param data_annotations: Table with the `uri`, `key`, `value` and
+                             `value_type` columns
+    """
+    def __init__(self,
+                 dataset: dict[str, any],
+                 locations: pd.DataFrame,
+                 location_annotations: pd.DataFrame,
+                 data: pd.DataFrame,
+                 data_annotations: pd.DataFrame):
+        self.dataset = dataset
+        self.locations = locations
+        self.location_annotations = location_annotations
+        self.data = data
+        self.data_annotations = data_annotations
+
+    @classmethod
+    def from_views(cls,
+                   dataset: Dataset,
+                   description: dict[str, any],
+                   locations_view: pd.DataFrame,
+                   data_view: pd.DataFrame
+                   ) -> "IndexSnapshot":
+        """Build a snapshot from the locations and data view tables
+
+        :param dataset: Dataset of the views,
+        :param description: Description of the dataset,
+        :param locations_view: Locations view of the dataset,
+        :param data_view: Data view of the dataset,
+        :return: The snapshot
+        """
+        data_columns = ["uri", "location", "storage_type", "metadata_uri"]
+        data = pd.DataFrame({
+            column: data_view[column].astype(str).tolist()
+            if column != "location" else data_view[column].tolist()
+            for column in data_columns
+        })
+        data["metadata_uri"] = data["metadata_uri"].replace("None", None)
+        return cls(
+            dataset={"name": dataset.name,
+                     "uri": dataset.uri.value,
+                     "metadata_uri": None if dataset.metadata_uri is None
+                     else dataset.metadata_uri.value,
+                     "description": description},
+            locations=pd.DataFrame(
+                {"location": locations_view["location"].tolist()}),
+            location_annotations=_melt_view(locations_view, "location",
+                                            ["location"]),
+            data=data,
+            data_annotations=_melt_view(data_view, "uri", data_columns)
+        )
+
+    def location_annotations_of(self) -> dict[int, dict[str, any]]:
+        """Get the annotations of each location
+
+        :return: The annotations indexed by location uuid
+        """
+        return _group_annotations(self.location_annotations, "location")
+
+    def data_annotations_of(self) -> dict[str, dict[str, any]]:
+        """Get the annotations of each data
+
+        :return: The annotations indexed by data URI
+        """
+        return _group_annotations(self.data_annotations, "uri")
+
+    def annotation_counts(self) -> tuple[dict[str, dict[any, int]],
+                                         dict[str, dict[any, int]]]:
+        """Count the annotation values in one pass over the tables
+
+        :return: The number of locations and of data for each annotation key
+                 and value
+        """
+        return (_counts(self.location_annotations),
+                _counts(self.data_annotations))
+
+    def write(self, path: Path | str):
+        """Write the snapshot in a directory of compressed parquet files
+
+        :param path: Destination directory
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with open(path / "dataset.json", "w", encoding="utf-8") as file:
+            json.dump({"version": SNAPSHOT_VERSION, **self.dataset}, file)
+        for name in ("locations", "location_annotations", "data",
+                     "data_annotations"):
+            getattr(self, name).to_parquet(path / f"{name}.parquet",
+                                           compression="zstd", index=False)
+
+    @classmethod
+    def read(cls, path: Path | str) -> "IndexSnapshot":
+        """Read a snapshot written with :meth:`write`
+
+        :param path: Snapshot directory,
+        :return: The snapshot
+        """
+        path = Path(path)
+        with open(path / "dataset.json", "r", encoding="utf-8") as file:
+            dataset = json.load(file)
+        version = dataset.pop("version", None)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported index snapshot version {version}")
+        return cls(
+            dataset=dataset,
+            **{name: pd.read_parquet(path / f"{name}.parquet")
+               for name in ("locations", "location_annotations", "data",
+                            "data_annotations")}
+        )
+
+
+def _group_annotations(table: pd.DataFrame, id_column: str
+                       ) -> dict[any, dict[str, any]]:
+    """Group a long annotation table by annotated object"""
+    out = {}
+    values = decode_values(table["value"].tolist(),
+                           table["value_type"].astype(str).tolist())
+    for object_id, key, value in zip(table[id_column].tolist(),
+                                     table["key"].astype(str).tolist(),
+                                     values):
+        out.setdefault(object_id, {})[key] = value
+    return out
+
+
+def _counts(table: pd.DataFrame) -> dict[str, dict[any, int]]:
+    """Count the annotation values of a long annotation table"""
+    out = {}
+    if len(table.index) == 0:
+        return out
+    counts = table.groupby(["key", "value", "value_type"], observed=True,
+                           sort=False).size()
+    for (key, value, type_), count in counts.items():
+        value = decode_values([value], [type_])[0]
+        out.setdefault(key, {})[value] = int(count)
+    return out
@@ -1,5 +1,6 @@
 """Definition of the main API methods"""
 from abc import ABC, abstractmethod
+import os
 
 from .models import Dataset
 from .models import DataInfo
@@ -9,7 +10,14 @@ from .models import DataInstance
 
 
 class SxStorage(ABC):
-    """Interface for storage interactions"""
+    """Interface for storage interactions
+
+    A storage that can be called from several threads at once sets
+    `thread_safe` to True. The thread runner serializes the calls to the
+    other storages.
+    """
+    thread_safe: bool = False
+
     @abstractmethod
     def connect(self, **kwargs):
         """Initialize any needed connection to the database"""
@@ -167,6 +175,25 @@ class SxStorage(ABC):
         :param uri: Unique identifier of the data,
         """
 
+    def version(self, uri: URI) -> str | None:
+        """Get a version of the content of a data
+
+        The cache-aware runs use it to detect the data rewritten in place. The
+        default implementation gives the modification time and the size of
+        the file or directory when the URI is a local path, and None
+        otherwise. A storage whose URIs are not local paths should override
+        it: without a version, a data rewritten in place is not seen as
+        changed by the cache.
+
+        :param uri: Unique identifier of the data,
+        :return: A value that changes with the data content, or None
+        """
+        try:
+            stat = os.stat(uri.value)
+        except (OSError, ValueError, TypeError):
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
     def read_data(self, data_info: DataInfo) -> DataInstance:
         """Read a tensor from the dataset storage
 
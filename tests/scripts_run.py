@@ -1,4 +1,8 @@
 """Scripts to run analysis on synthetic dataset for testing"""
+import os
+import threading
+from typing import Callable
+
 import numpy as np
 import pandas as pd
 
@@ -97,7 +101,29 @@ def mean_t_test(cond1: list[pd.DataFrame],
     return float(stat_value), float(p_value)
 
 
-def pipeline_runner(dataset: sx.Dataset):
+def scale(value: float, factor: float) -> float:
+    """Multiply a value by a factor
+
+    :param value: Value to scale,
+    :param factor: Scale factor,
+    :return: The scaled value
+    """
+    return value * factor
+
+
+def checked_scale(value: float, factor: float) -> float:
+    """Multiply a positive value by a factor
+
+    :param value: Value to scale,
+    :param factor: Scale factor,
+    :return: The scaled value
+    """
+    if value < 0:
+        raise ValueError("Negative value")
+    return value * factor
+
+
+def pipeline_runner(dataset: sx.Dataset, cache: bool = False):
     """Main script to analyze dataset using the job runner"""
 
     # Deconvolution
@@ -141,8 +167,8 @@ def pipeline_runner(dataset: sx.Dataset):
                  {"value": "t-pvalue", "metric": "count"}],
         query_type=sx.GROUP_SET
     )
-    sx.run(dataset, [job_decon, job_detection, job_analysis, stat1_job,
-                     stat2_job])
+    return sx.run(dataset, [job_decon, job_detection, job_analysis,
+                            stat1_job, stat2_job], cache=cache)
 
 
 def pipeline_call(dataset: sx.Dataset):
@@ -181,3 +207,109 @@ def pipeline_call(dataset: sx.Dataset):
         [{"value": "t-stat", "metric": "count", "job_id": job_id},
          {"value": "t-pvalue", "metric": "count", "job_id": job_id}],
         metrics_sets[0], metrics_sets[1], "count")
+
+
+STACKED = []
+
+
+def stack_values(values: list[float]) -> np.ndarray:
+    """Stack the item values of a batched call and record the stack size
+
+    :param values: Value of each item,
+    :return: The stacked values
+    """
+    STACKED.append(len(values))
+    return np.array(values)
+
+
+def crashing_scale(value: float, factor: float) -> float:
+    """Multiply a positive value by a factor, exit the process otherwise
+
+    :param value: Value to scale,
+    :param factor: Scale factor,
+    :return: The scaled value
+    """
+    if value < 0:
+        os._exit(1)
+    return value * factor
+
+
+BARRIER = threading.Barrier(3, timeout=10)
+
+
+def barrier_scale(value: float, factor: float) -> float:
+    """Multiply a value by a factor once 3 items run at the same time
+
+    :param value: Value to scale,
+    :param factor: Scale factor,
+    :return: The scaled value
+    """
+    BARRIER.wait()
+    return value * factor
+
+
+def split_value(value: float, other: float | None) -> tuple:
+    """Split the sum of two values in two halves
+
+    :param value: First value,
+    :param other: Second value, None to get an output the storage rejects,
+    :return: The two halves
+    """
+    if other is None:
+        return value / 2, object()
+    total = value + other
+    return total / 2, total / 2
+
+
+SAMPLERS = []
+
+
+def allocate_scale(value: float, factor: float) -> float:
+    """Multiply a value by a factor after allocating 64 MB
+
+    The number of memory sampler threads alive is added to SAMPLERS.
+
+    :param value: Value to scale,
+    :param factor: Scale factor,
+    :return: The scaled value
+    """
+    block = np.ones(64 * 2**20, dtype=np.uint8)
+    SAMPLERS.append(sum(thread.name == "sxt-memory"
+                        for thread in threading.enumerate()))
+    return value * factor * int(block[-1])
+
+
+def two_stage_batches(dataset: sx.Dataset,
+                      values: list[float | None],
+                      first_func: Callable | list[Callable]
+                      ) -> tuple[sx.Batch, sx.Batch]:
+    """Build the batches of a two stage run on new input values
+
+    Each value is indexed as an `input` data at a new location, with the
+    `scaled` and `result` outputs of the stages at the same location. The
+    first batch gives the input and 2.0 to `first_func`, the second batch
+    gives the scaled value and 10.0 to `scale`.
+
+    :param dataset: Dataset of the run,
+    :param values: Input values, None gives a None input to the first stage,
+    :param first_func: Function of the first stage, or one per value,
+    :return: The batches of the first and of the second stage
+    """
+    if callable(first_func):
+        first_func = [first_func] * len(values)
+    first, second = sx.Batch(), sx.Batch()
+    for i, (value, func) in enumerate(zip(values, first_func)):
+        if value is None:
+            location = sx.new_location(dataset, {"id": i})
+            data = None
+        else:
+            data = sx.new_data(dataset, value, loc_annotate={"id": i},
+                               data_annotate={"value": "input"})
+            location = data.location
+        scaled = sx.new_data(location, sx.StorageTypes.VALUE,
+                             data_annotate={"value": "scaled"})
+        result = sx.new_data(location, sx.StorageTypes.VALUE,
+                             data_annotate={"value": "result"})
+        first.append(sx.BatchItem(func, [data, 2.0], [scaled]))
+        second.append(sx.BatchItem(scale, [scaled, 10.0], [result]))
+    return first, second
@@ -1,5 +1,6 @@
 """Test importing the demo dataset"""
 import scixtracer as sx
+from scixtracer.snapshot import IndexSnapshot
 from .scripts_import import clean_dataset
 from .scripts_import import import_data
 
@@ -34,6 +35,26 @@ def test_import_data(workspace):
     assert datainfo_1[0].storage_type == sx.StorageTypes.ARRAY
     datainfo_list = sx.query_data(dataset, annotations={"image": "raw"})
     assert len(datainfo_list) == 40
+    assert sx.count_data(dataset, {"image": "raw"}) == 40
+    assert sx.count_data(dataset, {"population": "population2"}) == 20
+
+    locations_2 = sx.query_location(dataset, {"population": "population2"})
+    sx.annotate_locations_many(locations_2, {"plate": "A",
+                                             "well": list(range(20))})
+    assert len(sx.query_location(dataset, {"plate": "A"})) == 20
+    assert len(sx.query_location(dataset, {"well": 3})) == 1
+    sx.annotate_data_many(datainfo_list, {"batch": "first"})
+    assert sx.count_data(dataset, {"batch": "first"}) == 40
 
     data_1 = sx.read_data(datainfo_1[0])
     assert data_1.shape == (128, 128)
+
+    sx.export_index(dataset, workspace / "demo_spots_snapshot")
+    snapshot = IndexSnapshot.read(workspace / "demo_spots_snapshot")
+    assert snapshot.dataset["name"] == "Demo spots"
+    assert len(snapshot.locations.index) == 40
+    assert len(snapshot.data.index) == 40
+    loc_counts, data_counts = snapshot.annotation_counts()
+    assert loc_counts["population"] == {"population1": 20,
+                                        "population2": 20}
+    assert data_counts["image"] == {"raw": 40}
@@ -0,0 +1,259 @@
+"""Tests for the SQLite reference index"""
+import multiprocessing
+
+import pandas as pd
+import pytest
+import sqlite3
+
+from scixtracer.models import StorageTypes
+from scixtracer.models import URI
+from scixtracer.models import DataInfo
+from scixtracer.models import DataInfoSet
+from scixtracer.index import SxIndex
+from scixtracer.index import filtered_view
+from scixtracer.index_sqlite import SxIndexSQLite
+
+
+def create_index(tmp_path):
+    """Create an index with a small dataset"""
+    index = SxIndexSQLite()
+    index.connect(workspace=str(tmp_path))
+    dataset = index.new_dataset("Small set")
+    for i in range(6):
+        location = index.new_location(
+            dataset, {"population": f"pop{i % 2}", "id": i})
+        index.create_data(location, URI(value=f"raw_{i}"),
+                          StorageTypes.ARRAY, {"image": "raw"})
+        index.create_data(location, URI(value=f"count_{i}"),
+                          StorageTypes.VALUE, {"value": "count"})
+    return index, dataset
+
+
+def test_sqlite_queries(tmp_path):
+    """Test the queries and the annotation statistics"""
+    index, dataset = create_index(tmp_path)
+
+    assert index.query_location_annotation(dataset)["population"] == \
+        ["pop0", "pop1"]
+    assert index.query_data_annotation(dataset) == {"image": ["raw"],
+                                                    "value": ["count"]}
+    assert len(index.query_location(dataset, {"population": "pop1"})) == 3
+    assert index.count_data(dataset, {"population": "pop0",
+                                      "image": "raw"}) == 3
+    assert len(index.query_data_loc_set(
+        dataset, [{"image": "raw"}, {"value": "count"}])) == 6
+    groups = index.query_data_group_set(
+        dataset, [{"population": "pop0"}, {"population": "pop1"}])
+    assert [len(group) for group in groups] == [6, 6]
+
+    result = index.query_data_single(dataset, {"population": "pop0"})
+    assert isinstance(result, DataInfoSet)
+    assert isinstance(result[0], DataInfo)
+    assert list(result.storage_types) == ["Array", "Value"] * 3
+    raw = result.filter(storage_type=StorageTypes.ARRAY)
+    assert list(raw.uris) == ["raw_0", "raw_2", "raw_4"]
+    assert len(index.query_data_at(dataset, raw[:2])) == 4
+    location = index.query_location(dataset, {"id": 0})[0]
+    assert index.query_data_at(dataset, [location])[1].location is location
+    assert result[0].dataset is dataset
+    assert index.query_data_single(dataset, {"image": "none"}) == []
+
+    index.annotate_data_many(index.query_data_single(dataset,
+                                                     {"image": "raw"}),
+                             {"image": "raw_checked"})
+    assert index.query_data_annotation(dataset)["image"] == ["raw_checked"]
+
+    index.delete(index.get_data_info(dataset, URI(value="count_0")))
+    assert index.count_data(dataset, {"value": "count"}) == 5
+
+
+def test_sqlite_annotation_stats(tmp_path):
+    """Keep the annotation statistics of the values left unchanged"""
+    index, dataset = create_index(tmp_path)
+    counts = index.query_data_single(dataset, {"value": "count"})
+    index.annotate_data_many(counts[:2], {"tag": "x"})
+    index.annotate_data_many(counts[:2], {"tag": [None, "y"]})
+    assert sorted(index.query_data_annotation(dataset)["tag"]) == ["x", "y"]
+    assert index.count_data(dataset, {"tag": "x"}) == 1
+
+    index.annotate_data_many(counts[:2], {"tag": ["y", "y"]})
+    assert index.query_data_annotation(dataset)["tag"] == ["y"]
+
+    location = index.query_location(dataset, {"id": 0})[0]
+    index.annotate_location(location, "checked", True)
+    assert index.query_location_annotation(dataset)["checked"] == [True]
+    assert index.count_data(dataset, {"checked": True}) == 2
+    view = index.view_locations(dataset, columns=["location", "checked"])
+    assert view["checked"].tolist()[0] is True
+
+
+def test_sqlite_annotation_types(tmp_path):
+    """Keep the type of each annotation value"""
+    index, dataset = create_index(tmp_path)
+    index.new_location(dataset, {"flag": False})
+    index.new_location(dataset, {"flag": 2})
+    view = index.view_locations(dataset, columns=["location", "flag"])
+    assert [type(value) for value in view["flag"].tolist()[-2:]] == \
+        [bool, int]
+
+    counts = index.query_data_single(dataset, {"value": "count"})
+    index.annotate_data_many(counts[:3], {"n": [2, True, 1]})
+    assert sorted(map(repr, index.query_data_annotation(dataset)["n"])) == \
+        ["1", "2", "True"]
+    view = index.view_data(dataset, columns=["uri", "n"])
+    assert [repr(view["n"][i]) for i in (1, 3, 5)] == ["2", "True", "1"]
+    assert list(index.iter_view_data(dataset, columns=["n"],
+                                     chunk_size=4))[0]["n"][1] == 2
+
+    index.annotate_data_many(counts[1:2], {"n": 1})
+    assert sorted(map(repr, index.query_data_annotation(dataset)["n"])) == \
+        ["1", "2"]
+    index.delete(counts[0])
+    assert index.query_data_annotation(dataset)["n"] == [1]
+
+
+def test_sqlite_recreate_dataset(tmp_path):
+    """Drop the entries of a dataset whose directory was removed"""
+    index = SxIndexSQLite()
+    index.connect(workspace=str(tmp_path))
+    dataset = index.new_dataset("Recreated")
+    index.new_location(dataset, {"level": True})
+    dataset = index.new_dataset("Recreated")
+    index.new_location(dataset, {"level": 3})
+    assert index.query_location_annotation(dataset) == {"level": [3]}
+    assert [type(value) for value in
+            index.view_locations(dataset)["level"].tolist()] == [int]
+
+
+def test_sqlite_views_and_snapshot(tmp_path):
+    """Test the columnar views and the snapshot round trip"""
+    index, dataset = create_index(tmp_path)
+
+    view = index.view_data(dataset, columns=["uri", "image"])
+    assert list(view.columns) == ["uri", "image"]
+    assert isinstance(view["image"].dtype, pd.CategoricalDtype)
+    chunks = list(index.iter_view_locations(
+        dataset, annotations={"population": "pop0"}, chunk_size=2))
+    assert [len(chunk.index) for chunk in chunks] == [2, 1]
+
+    snapshot = index.snapshot(dataset)
+    assert snapshot.dataset["uri"] == "small_set"
+    for other in (SxIndexSQLite(), ReplayedSnapshot()):
+        other.connect(workspace=str(tmp_path / type(other).__name__))
+        copy = other.load_snapshot(snapshot)
+        assert copy.uri.value == \
+            str(tmp_path / type(other).__name__ / "small_set")
+        assert other.view_locations(copy).equals(
+            index.view_locations(dataset))
+        assert other.query_data_annotation(copy) == \
+            index.query_data_annotation(dataset)
+
+
+class ReplayedSnapshot(SxIndexSQLite):
+    """Index plugin loading the snapshots with the default implementation"""
+    load_snapshot = SxIndex.load_snapshot
+
+
+class LegacyViews(SxIndexSQLite):
+    """Index plugin with the view methods of the first index interface"""
+    def view_locations(self, dataset):
+        return super().view_locations(dataset)
+
+    def view_data(self, dataset, locations=None):
+        return super().view_data(dataset, locations)
+
+
+def test_view_filters(tmp_path):
+    """Filter the views of the indexes with and without the view filters"""
+    index, dataset = create_index(tmp_path)
+    legacy = LegacyViews()
+    legacy.connect(workspace=str(tmp_path))
+
+    for view_index in (index, legacy):
+        view = filtered_view(view_index.view_locations, dataset,
+                             annotations={"population": "pop1"},
+                             columns=["location", "id"])
+        assert list(view.columns) == ["location", "id"]
+        assert view["id"].tolist() == [1, 3, 5]
+        view = filtered_view(view_index.view_data, dataset,
+                             annotations={"value": "count"},
+                             columns=["uri"])
+        assert view["uri"].tolist() == [f"count_{i}" for i in range(6)]
+        assert len(filtered_view(view_index.view_data, dataset)) == 12
+        chunks = list(view_index.iter_view_data(
+            dataset, annotations={"image": "raw"}, chunk_size=4))
+        assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert filtered_view(legacy.view_data, dataset,
+                         annotations={"unknown": 1}).empty
+
+
+def test_sqlite_create_data_many(tmp_path):
+    """Index the data of a new location in one transaction"""
+    index, dataset = create_index(tmp_path)
+    infos = index.create_data_many(
+        dataset, [URI(value="mean_0"), URI(value="std_0")],
+        [StorageTypes.VALUE, StorageTypes.VALUE],
+        [{"value": "mean"}, {"value": "std"}],
+        loc_annotate={"population": "pop2"})
+    assert infos[0].location is infos[1].location
+    assert index.count_data(dataset, {"population": "pop2"}) == 2
+    assert index.query_data_annotation(dataset)["value"] == \
+        ["count", "mean", "std"]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        index.create_data_many(
+            dataset, [URI(value="max_0"), URI(value="raw_0")],
+            [StorageTypes.VALUE, StorageTypes.ARRAY],
+            [{"value": "max"}, {"image": "raw"}],
+            loc_annotate={"population": "pop3"})
+    assert index.get_data_info(dataset, URI(value="max_0")) is None
+    assert index.query_location(dataset, {"population": "pop3"}) == []
+    assert "max" not in index.query_data_annotation(dataset)["value"]
+
+
+def read_index(workspace: str, uri: str, ready, stop, results):
+    """Query and view a dataset until stopped, report the lock errors"""
+    index = SxIndexSQLite()
+    index.connect(workspace=workspace)
+    dataset = index.get_dataset(URI(value=uri))
+    reads, errors = 0, []
+    while not stop.is_set():
+        try:
+            index.query_data_single(dataset, {"image": "raw"})
+            index.view_data(dataset)
+            reads += 1
+        except sqlite3.OperationalError as error:
+            errors.append(str(error))
+        if reads == 1:
+            ready.release()
+    results.put((reads, errors))
+
+
+def test_sqlite_concurrent_readers(tmp_path):
+    """Write while reader processes query the same database"""
+    index, dataset = create_index(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    ready, stop = context.Semaphore(0), context.Event()
+    results = context.Queue()
+    readers = [context.Process(target=read_index,
+                               args=(str(tmp_path), dataset.uri.value, ready,
+                                     stop, results))
+               for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    try:
+        for _ in readers:
+            assert ready.acquire(timeout=60)
+        for i in range(100):
+            location = index.new_location(dataset, {"id": 6 + i})
+            index.create_data(location, URI(value=f"new_{i}"),
+                              StorageTypes.ARRAY, {"image": "raw"})
+            index.annotate_location(location, "population", f"pop{i % 2}")
+    finally:
+        stop.set()
+        outcomes = [results.get(timeout=60) for _ in readers]
+        for reader in readers:
+            reader.join()
+    assert all(reads > 0 for reads, _ in outcomes)
+    assert [errors for _, errors in outcomes] == [[]] * 3
+    assert index.count_data(dataset, {"image": "raw"}) == 106
@@ -0,0 +1,64 @@
+"""Tests for the data models"""
+import pickle
+
+import pytest
+
+from scixtracer.models import StorageTypes
+from scixtracer.models import URI
+from scixtracer.models import Dataset
+from scixtracer.models import Location
+from scixtracer.models import DataInfo
+from scixtracer.models import DataInfoSet
+
+
+def test_row_types():
+    """Check the fields of the dataclass row types"""
+    dataset = Dataset.intern("Models", "/workspace/models")
+    location = Location.intern(dataset, 0)
+    info = DataInfo(location=location, storage_type="Array",
+                    uri=URI(value="raw_0"))
+    assert info.storage_type is StorageTypes.ARRAY
+    assert info.dataset is dataset
+    assert pickle.loads(pickle.dumps(info)) == info
+    assert {URI(value="raw_0"), info.uri} == {info.uri}
+    assert Dataset(name="Models", uri=info.uri).uri is info.uri
+
+    with pytest.raises(TypeError):
+        URI(value=0)
+    with pytest.raises(TypeError):
+        DataInfo(location=location, storage_type=StorageTypes.ARRAY,
+                 uri="raw_0")
+    with pytest.raises(TypeError):
+        DataInfo(location=location, storage_type=StorageTypes.ARRAY,
+                 uri=info.uri, metadata_uri="raw_0.json")
+    with pytest.raises(ValueError):
+        DataInfo(location=location, storage_type="Arrays", uri=info.uri)
+
+
+def test_data_info_set():
+    """Select data with array operations and keep the list semantics"""
+    dataset = Dataset.intern("Models", "/workspace/models")
+    data = DataInfoSet(dataset, [0, 0, 1, 1, 2],
+                       ["Array", "Value", "Array", "Value", "Array"],
+                       [f"data_{i}" for i in range(5)])
+    assert data.storage_types.tolist() == \
+        ["Array", "Value", "Array", "Value", "Array"]
+    assert data[[0, 3]].storage_types.tolist() == ["Array", "Value"]
+    assert [info.storage_type for info in data[:2]] == \
+        [StorageTypes.ARRAY, StorageTypes.VALUE]
+    raw = data.filter(storage_type=StorageTypes.ARRAY)
+    assert raw.uris.tolist() == ["data_0", "data_2", "data_4"]
+    assert raw[raw.uuids > 0].uris.tolist() == ["data_2", "data_4"]
+    assert raw[1].location is Location.intern(dataset, 1)
+    assert data.filter(locations=[Location.intern(dataset, 2)]).uris.tolist() \
+        == ["data_4"]
+    assert DataInfoSet.from_list(dataset, raw.to_list()) == raw
+
+    assert data == data.to_list()
+    assert data[:0] == []
+    assert raw + data[:1] == raw.to_list() + [data[0]]
+    assert [data[1]] + raw == [data[1]] + raw.to_list()
+    with pytest.raises(TypeError):
+        hash(data)
+    with pytest.raises(ValueError):
+        DataInfoSet(dataset, [0], ["Arrays"], ["data_0"])
@@ -1,10 +1,40 @@
 """Tests for the runners"""
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
 import pytest
 import scixtracer as sx
+from scixtracer import runner_process
+from scixtracer.runner_process import SxRunnerProcess
+from scixtracer.runner_remote import SxRunnerRemote
+from scixtracer.runner_thread import SxRunnerThread
+from scixtracer import api_runner
+from scixtracer.api import __storage
+from scixtracer.api import get_metadata
+from scixtracer.runner import InputCache
+from scixtracer.ephemeral import EphemeralStore
+from scixtracer.runner import batch_groups
+from scixtracer.runner import shared_backend
+from scixtracer.scheduler import fuse_batches
+from scixtracer.journal import RunJournal
+from scixtracer.cache import call_fingerprint
 from .scripts_import import clean_dataset
 from .scripts_import import import_data
 from .scripts_run import pipeline_call
 from .scripts_run import pipeline_runner
+from .scripts_run import scale
+from .scripts_run import checked_scale
+from .scripts_run import crashing_scale
+from .scripts_run import stack_values
+from .scripts_run import STACKED
+from .scripts_run import barrier_scale
+from .scripts_run import split_value
+from .scripts_run import allocate_scale
+from .scripts_run import SAMPLERS
+from .scripts_run import two_stage_batches
+from .test_scheduler import data_info
 
 
 def do_assert(dataset: sx.Dataset, dataset_name: str, ann_count: int):
@@ -23,7 +53,12 @@ def do_assert(dataset: sx.Dataset, dataset_name: str, ann_count: int):
     result = sx.query_data(dataset,
                            annotations={"value": "t-stat", "metric": "count"},
                            info_only=False)
-    assert result[0].value == pytest.approx(-3.89435849621, 0.000001)
+    data = result[0]
+    assert isinstance(data.info, sx.DataInfo)
+    assert not data.is_loaded
+    assert data.value == pytest.approx(-3.89435849621, 0.000001)
+    data.release()
+    assert data.value == pytest.approx(-3.89435849621, 0.000001)
     result = sx.query_data(dataset,
                            annotations={"value": "t-pvalue", "metric": "count"})
     assert sx.read_data(result[0]) == pytest.approx(0.000385836563, 0.000001)
@@ -53,3 +88,402 @@ def test_pipeline_runner(workspace):
     assert "run_id" in data_ann
 
     do_assert(dataset, "Demo spots runner", 6)
+
+
+def test_pipeline_cache(workspace):
+    """Run the pipeline again and only compute the new items"""
+    clean_dataset(workspace, "demo_spots_cache")
+    dataset = import_data("Demo spots cache")
+    assert pipeline_runner(dataset, cache=True) == []
+    count = sx.count_data(dataset)
+    decon = sx.count_data(dataset, {"image": "decon"})
+    assert decon == sx.count_data(dataset, {"image": "raw"})
+
+    assert pipeline_runner(dataset, cache=True) == []
+    assert sx.count_data(dataset) == count
+
+    raw = sx.query_data(dataset, {"image": "raw"})[0]
+    sx.new_data(dataset, sx.read_data(raw),
+                loc_annotate={"population": "population1", "id": "new"},
+                data_annotate={"image": "raw"})
+    assert pipeline_runner(dataset, cache=True) == []
+    assert sx.count_data(dataset, {"image": "decon"}) == decon + 1
+    assert sx.count_data(dataset, {"value": "t-stat"}) == 4
+
+
+def test_call_cache(workspace):
+    """Skip a call already made with the same inputs"""
+    clean_dataset(workspace, "call_cache")
+    dataset = sx.new_dataset("Call cache")
+    value = sx.new_data(dataset, 3.0, data_annotate={"value": "input"})
+    for _ in range(2):
+        sx.call(scale, cache=True)([{"value": "scaled"}], value, 2.0)
+    sx.call(scale, cache=True)([{"value": "scaled"}], value, 3.0)
+    scaled = sx.query_data(dataset, {"value": "scaled"})
+    assert sorted(sx.read_data(info) for info in scaled) == [6.0, 9.0]
+
+    time.sleep(0.01)
+    sx.write_data(value, 4.0)
+    sx.call(scale, cache=True)([{"value": "scaled"}], value, 2.0)
+    scaled = sx.query_data(dataset, {"value": "scaled"})
+    assert sorted(sx.read_data(info) for info in scaled) == [6.0, 8.0, 9.0]
+
+    first, second = np.zeros(2000), np.zeros(2000)
+    second[1000] = 1.0
+    assert call_fingerprint(scale, [first, 2.0], [{}]) != \
+        call_fingerprint(scale, [second, 2.0], [{}])
+    assert call_fingerprint(scale, [first, 2.0], [{}]) == \
+        call_fingerprint(scale, [first.copy(), 2.0], [{}])
+    assert call_fingerprint(scale, [threading.Lock(), 2.0], [{}]) is None
+
+
+def test_call_commit(workspace):
+    """Commit the outputs of a call all together or not at all"""
+    clean_dataset(workspace, "call_commit")
+    dataset = sx.new_dataset("Call commit")
+    first = sx.new_data(dataset, 2.0, data_annotate={"value": "input"})
+    second = sx.new_data(dataset, 3.0, data_annotate={"value": "input"})
+    outputs = sx.call(split_value)([{"value": "half"}, {"value": "rest"}],
+                                   first, second)
+    assert [sx.read_data(info) for info in outputs] == [2.5, 2.5]
+    assert outputs[0].location is outputs[1].location
+    assert sx.query_location_annotation(dataset)["origin"] == \
+        ["split_value"]
+
+    with pytest.raises(ValueError):
+        sx.call(split_value)([{"value": "half"}, {"value": "rest"}],
+                             first, None)
+    assert sx.count_data(dataset, {"value": "half"}) == 1
+    assert len(sx.query_location(dataset, {"origin": "split_value"})) == 1
+
+
+def test_call_map(workspace):
+    """Map a call over query results in a pool of threads"""
+    clean_dataset(workspace, "call_map")
+    dataset = sx.new_dataset("Call map")
+    for i in range(6):
+        sx.new_data(dataset, float(i if i != 4 else -1),
+                    loc_annotate={"id": i}, data_annotate={"value": "input"})
+    inputs = sx.query_data(dataset, {"value": "input"})
+
+    results = list(sx.call(checked_scale).map(
+        inputs, 2.0, annotations=[{"value": "scaled"}], workers=3,
+        ordered=True))
+    assert [result[0].uri.value for result in results] == \
+        [info.uri.value for info in inputs]
+    errors = [error for _, _, error in results if error is not None]
+    assert len(errors) == 1 and "Negative value" in str(errors[0])
+    done = [(info, outputs[0]) for info, outputs, error in results
+            if error is None]
+    assert [sx.read_data(output) for _, output in done] == \
+        [0.0, 2.0, 4.0, 6.0, 10.0]
+    assert all(info.location.uuid == output.location.uuid
+               for info, output in done)
+    outputs = [output for _, output in done]
+    assert get_metadata(outputs[1])["func"] == "checked_scale"
+
+    pairs = sx.query_data(dataset, [{"value": "input"}, {"value": "scaled"}],
+                          query_type=sx.LOC_SET)
+    summed = sx.call(scale).map(pairs, annotations=[{"value": "product"}])
+    assert sorted(sx.read_data(outputs[0])
+                  for _, outputs, error in summed if error is None) == \
+        [0.0, 2.0, 8.0, 18.0, 50.0]
+
+
+def test_resume(workspace):
+    """Resume a run stopped by a failing item"""
+    clean_dataset(workspace, "resume")
+    dataset = sx.new_dataset("Resume")
+    values = [sx.new_data(dataset, -1.0 if i == 2 else float(i),
+                          loc_annotate={"id": i},
+                          data_annotate={"value": "input"})
+              for i in range(4)]
+    job = sx.Job(func=checked_scale, inputs=[{"value": "input"}, 2.0],
+                 outputs=[{"value": "scaled"}])
+    with pytest.raises(ValueError):
+        sx.run(dataset, [job])  # the local runner stops at the failing item
+    assert len(sx.query_data(dataset, {"value": "scaled"})) == 0
+
+    sx.write_data(values[2], 2.0)
+    run_id = max(path.name for path in (workspace / "runs").iterdir())
+    assert sx.resume(run_id) == []
+    scaled = sx.query_data(dataset, {"value": "scaled"})
+    assert sorted(sx.read_data(info) for info in scaled) == [0, 2, 4, 6]
+
+
+def test_process_runner(workspace):
+    """Run dependent batch items in a pool of processes"""
+    clean_dataset(workspace, "process_runner")
+    dataset = sx.new_dataset("Process runner")
+    first, second = two_stage_batches(dataset, [0.0, 1.0, 2.0, 3.0, None],
+                                      scale)
+    outputs = [item.outputs[0] for item in second]
+
+    runner = SxRunnerProcess()
+    runner.connect(workers=2, chunk_size=2, max_tasks_per_child=2)
+    runner.journal = RunJournal(workspace / "process_runner" / "run")
+    runner.journal.open()
+    failures = runner.run([first, second])
+    runner.journal.close()
+    assert runner.journal.completed() == \
+        {(batch, item) for batch in range(2) for item in range(4)}
+
+    assert [sx.read_data(info) for info in outputs[:4]] == [0, 20, 40, 60]
+    assert [(failure.batch, failure.item) for failure in failures] == \
+        [(0, 4), (1, 4)]
+    assert failures[0].func == "tests.scripts_run:scale"
+    assert "TypeError" in failures[0].error
+
+
+def test_worker_start_failures(workspace, monkeypatch):
+    """Fail the items when the workers cannot start"""
+    clean_dataset(workspace, "worker_start_failures")
+    dataset = sx.new_dataset("Worker start failures")
+    first, second = two_stage_batches(dataset, [0.0, 1.0, 2.0], scale)
+
+    monkeypatch.setattr(runner_process, "config", lambda: SimpleNamespace(
+        file=workspace / "worker_start_failures" / "missing.yml"))
+    runner = SxRunnerProcess()
+    runner.connect(workers=2, max_start_failures=2)
+    failures = runner.run([first, second])
+    assert len(failures) == 6
+    assert "died before they were ready" in failures[0].error
+
+
+def test_input_cache():
+    """Keep the last read inputs and give each read its own copy"""
+    infos = [data_info("input", i) for i in range(3)]
+    cache = InputCache(max_bytes=30)
+    assert [cache.read(info, lambda info: 10.0 * info.location.uuid)
+            for info in [infos[1], infos[1], infos[2], infos[1]]] == \
+        [10, 10, 20, 10]
+    assert (cache.hits, cache.misses) == (1, 3)
+
+    array = np.arange(4)
+    for read_only in [False, True]:
+        cache = InputCache(read_only=read_only)
+        read, read_again = [cache.read(infos[0], lambda _: array)
+                            for _ in range(2)]
+        assert (read is read_again) == read_only
+        assert read.flags.writeable != read_only
+        if not read_only:
+            read -= 1
+            assert read_again.tolist() == array.tolist() == [0, 1, 2, 3]
+
+
+def test_batched_items(workspace):
+    """Run the items of a batchable function with one call per group"""
+    clean_dataset(workspace, "batched_items")
+    dataset = sx.new_dataset("Batched items")
+    items = []
+    for i in range(5):
+        value = sx.new_data(dataset, float(i), loc_annotate={"id": i},
+                            data_annotate={"value": "input"})
+        output = sx.new_data(value.location, sx.StorageTypes.VALUE,
+                             data_annotate={"value": "scaled"})
+        items.append(sx.BatchItem(scale, [value, 2.0], [output],
+                                  batch_size=2, stack=stack_values))
+    output = sx.new_data(items[0].inputs[0].location, sx.StorageTypes.VALUE,
+                         data_annotate={"value": "tripled"})
+    items.append(sx.BatchItem(scale, [items[0].inputs[0], 3.0], [output],
+                              batch_size=2, stack=stack_values))
+    assert batch_groups(items) == [[0, 1], [2, 3], [4], [5]]
+
+    first, second = np.zeros(2000), np.zeros(2000)
+    second[1000] = 1.0
+    params = [sx.BatchItem(scale, [items[0].inputs[0], param], [output],
+                           batch_size=2, stack=stack_values)
+              for param in (first, second, first.copy(), threading.Lock())]
+    assert batch_groups(params) == [[0, 2], [1], [3]]
+
+    batch = sx.Batch()
+    batch.items = items
+    decoded = sx.Batch.from_bytes(batch.to_bytes())
+    assert decoded[0].batch_size == 2
+    assert decoded[0].stack is stack_values
+
+    STACKED.clear()
+    runner = SxRunnerProcess(__storage)
+    errors, durations, peaks = runner.run_items(decoded.items)
+    assert errors == [None] * 6
+    assert len(durations) == len(peaks) == 6
+    assert STACKED == [2, 2]
+    assert [sx.read_data(item.outputs[0]) for item in items] == \
+        [0, 2, 4, 6, 8, 0]
+
+    SAMPLERS.clear()
+    memory_items = [sx.BatchItem(allocate_scale, [float(i), 2.0],
+                                 [item.outputs[0]])
+                    for i, item in enumerate(items[:3])]
+    errors, durations, peaks = runner.run_items(memory_items)
+    assert errors == [None] * 3
+    assert SAMPLERS == [1, 1, 1]
+    assert all(peak is None or peak >= 32 for peak in peaks)
+    assert not any(thread.name == "sxt-memory"
+                   for thread in threading.enumerate())
+
+
+def test_remote_runner(workspace):
+    """Serve batch items to workers over TCP and retry lost items"""
+    clean_dataset(workspace, "remote_runner")
+    dataset = sx.new_dataset("Remote runner")
+    first, second = two_stage_batches(
+        dataset, [0.0, 1.0, 2.0, 3.0, 4.0, -1.0], crashing_scale)
+    outputs = [item.outputs[0] for item in second]
+
+    runner = SxRunnerRemote()
+    runner.connect(local_workers=2, chunk_size=1, heartbeat=0.2,
+                   lease_time=5, retries=1)
+    failures = runner.run([first, second])
+
+    assert [sx.read_data(info) for info in outputs[:5]] == [0, 20, 40, 60, 80]
+    assert [(failure.batch, failure.item) for failure in failures] == \
+        [(0, 5), (1, 5)]
+    assert "Worker lost 2 times" in failures[0].error
+
+
+def test_fused_jobs(workspace, monkeypatch):
+    """Run a chain of jobs as fused items without the intermediate results"""
+    clean_dataset(workspace, "fused_jobs")
+    dataset = sx.new_dataset("Fused jobs")
+    first, second = two_stage_batches(dataset, [0.0, 1.0, 2.0], scale)
+    second.append(sx.BatchItem(scale, [first[2].outputs[0], 3.0],
+                               [second[2].outputs[0]]))
+
+    fused, nodes = fuse_batches([first, second],
+                                {first[0].outputs[0].uri.value})
+    assert [len(batch) for batch in fused] == [3, 2]
+    assert nodes[(0, 0)] == [(0, 0), (1, 0)]
+    assert nodes[(0, 2)] == [(0, 2)]
+    assert fused[0][0].transient == {first[0].outputs[0].uri.value}
+    assert fused[0][0].outputs == [second[0].outputs[0]]
+    decoded = sx.Batch.from_bytes(fused[0].to_bytes())
+    assert decoded[0].transient == fused[0][0].transient
+    assert [stage.func for stage in decoded[0].stages] == [scale, scale]
+
+    for i in range(3, 6):
+        sx.new_data(dataset, float(i), loc_annotate={"id": i},
+                    data_annotate={"value": "input"})
+    runner = SxRunnerProcess(__storage)
+    runner.connect(workers=2)
+    monkeypatch.setattr(api_runner, "__runner", runner)
+    jobs = [sx.job(scale, [{"value": "input"}, 2.0], [{"value": "double"}],
+                   keep=False),
+            sx.job(scale, [{"value": "double"}, 10.0], [{"value": "twenty"}])]
+    assert sx.run(dataset, jobs) == []
+    assert sx.count_data(dataset, {"value": "double"}) == 0
+    twenty = sx.query_data(dataset, {"value": "twenty"})
+    assert sorted(sx.read_data(info) for info in twenty) == \
+        [0, 20, 40, 60, 80, 100]
+
+
+def test_ephemeral_outputs(workspace, tmp_path, monkeypatch):
+    """Keep the transient outputs read by several jobs in the run store"""
+    store = EphemeralStore(100, memory=tmp_path / "memory")
+    store.uris = {"small", "large"}
+    assert store.write("small", 1.0)
+    assert store.used > 0
+    assert not store.write("large", list(range(100)))
+    assert not store.write("other", 1.0)
+    assert store.read("small") == 1.0
+    store.evict("small")
+    assert store.used == 0
+    with pytest.raises(KeyError):
+        store.read("small")
+    store.close()
+
+    store = EphemeralStore(100, spill=tmp_path / "spill",
+                           memory=tmp_path / "memory")
+    store.uris = {"large"}
+    assert store.write("large", list(range(100)))
+    assert store.used == 0
+    assert store.read("large") == list(range(100))
+    store.close()
+
+    clean_dataset(workspace, "ephemeral_outputs")
+    dataset = sx.new_dataset("Ephemeral outputs")
+    for i in range(6):
+        sx.new_data(dataset, float(i), loc_annotate={"id": i},
+                    data_annotate={"value": "input"})
+    value = sx.query_data(dataset, {"value": "input"})[3]
+    output = sx.new_data(value.location, sx.StorageTypes.VALUE,
+                         data_annotate={"value": "scaled"})
+    runner = SxRunnerProcess(__storage)
+    runner.ephemeral_store = EphemeralStore(1000, memory=tmp_path / "memory")
+    runner.ephemeral_store.uris = {output.uri.value}
+    assert runner.run_items([sx.BatchItem(scale, [value, 2.0], [output])]
+                            )[0] == [None]
+    assert runner.ephemeral_store.read(output.uri.value) == \
+        2 * sx.read_data(value)
+    runner.ephemeral_store.close()
+
+    runner = SxRunnerProcess(__storage)
+    runner.connect(workers=2, ephemeral_memory=0.0001,
+                   spill=str(tmp_path / "spill"))
+    monkeypatch.setattr(api_runner, "__runner", runner)
+    jobs = [sx.job(scale, [{"value": "input"}, 2.0], [{"value": "double"}],
+                   keep=False),
+            sx.job(scale, [{"value": "double"}, 10.0], [{"value": "twenty"}]),
+            sx.job(scale, [{"value": "double"}, 15.0], [{"value": "thirty"}])]
+    assert sx.run(dataset, jobs) == []
+    assert sx.count_data(dataset, {"value": "double"}) == 0
+    for name, factor in (("twenty", 20), ("thirty", 30)):
+        results = sx.query_data(dataset, {"value": name})
+        assert sorted(sx.read_data(info) for info in results) == \
+            [factor * i for i in range(6)]
+    assert list((tmp_path / "spill").iterdir()) == []
+
+
+def test_thread_runner(workspace):
+    """Run dependent batch items concurrently in a pool of threads"""
+    clean_dataset(workspace, "thread_runner")
+    dataset = sx.new_dataset("Thread runner")
+    first, second = two_stage_batches(
+        dataset, [0.0, 1.0, 2.0, -1.0], [barrier_scale] * 3 + [checked_scale])
+    outputs = [item.outputs[0] for item in second]
+
+    runner = SxRunnerThread(__storage)
+    runner.connect(workers=4, cpus=4)
+    runner.journal = RunJournal(workspace / "thread_runner" / "run")
+    runner.journal.open()
+    failures = runner.run([first, second])
+    runner.journal.close()
+
+    assert [sx.read_data(info) for info in outputs[:3]] == [0, 20, 40]
+    assert runner.journal.completed() == \
+        {(batch, item) for batch in range(2) for item in range(3)}
+    assert [(failure.batch, failure.item) for failure in failures] == \
+        [(0, 3), (1, 3)]
+    assert "Negative value" in failures[0].error
+
+
+def test_pipelined_items(workspace):
+    """Read and write the items of a chunk while computing the next one"""
+    clean_dataset(workspace, "pipelined_items")
+    dataset = sx.new_dataset("Pipelined items")
+    items = []
+    outputs = []
+    for i in range(6):
+        value = sx.new_data(dataset, float(i if i != 2 else -1),
+                            loc_annotate={"id": i},
+                            data_annotate={"value": "input"})
+        outputs.append(sx.new_data(value.location, sx.StorageTypes.VALUE,
+                                   data_annotate={"value": "result"}))
+        items.append(sx.BatchItem(checked_scale, [value, 3.0],
+                                  [outputs[-1]]))
+
+    runner = SxRunnerProcess(shared_backend(__storage))
+    runner.prefetch = 2
+    runner.write_queue = 1
+    errors, durations, _ = runner.run_items(items)
+
+    assert [error is None for error in errors] == \
+        [True, True, False, True, True, True]
+    assert "Negative value" in str(errors[2])
+    assert len(durations) == 6
+    assert [sx.read_data(outputs[i]) for i in [0, 1, 3, 4, 5]] == \
+        [0, 3, 9, 12, 15]
+    stats = runner.pipeline_stats
+    assert stats.items == 6
+    assert set(stats.utilisation()) == {"read", "compute", "write"}
+    assert 0 < stats.merge(stats).elapsed == pytest.approx(2 * stats.elapsed)
@@ -0,0 +1,111 @@
+"""Tests for the scheduling of the batch items"""
+import pytest
+
+from scixtracer.models import StorageTypes
+from scixtracer.models import URI
+from scixtracer.models import Dataset
+from scixtracer.models import Location
+from scixtracer.models import DataInfo
+from scixtracer.models import BatchItem
+from scixtracer.models import Batch
+from scixtracer.scheduler import ChunkSizer
+from scixtracer.scheduler import DependencyGraph
+from scixtracer.scheduler import WorkQueues
+from scixtracer.scheduler import ResourceBudget
+
+
+def data_info(name: str, uuid: int) -> DataInfo:
+    """Build the information of a data without an index"""
+    dataset = Dataset.intern("Scheduler", "/workspace/scheduler")
+    return DataInfo(location=Location.intern(dataset, uuid),
+                    storage_type=StorageTypes.VALUE,
+                    uri=URI(value=f"{name}_{uuid}"))
+
+
+def test_dependency_graph():
+    """Release the consumers of the done items and cancel the failed ones"""
+    first, second, third = Batch(), Batch(), Batch()
+    for i in range(3):
+        first.append(BatchItem(abs, [data_info("input", i)],
+                               [data_info("scaled", i)]))
+        second.append(BatchItem(abs, [data_info("scaled", i), 10.0],
+                                [data_info("result", i)]))
+        third.append(BatchItem(abs, [data_info("result", i)],
+                               [data_info("summary", i)]))
+    graph = DependencyGraph([first, second, third])
+    assert len(graph) == 9
+    assert graph.ready() == [(0, i) for i in range(3)]
+    assert graph.dependencies((1, 2)) == {(0, 2)}
+    assert graph.inputs((1, 2)) == ["scaled_2"]
+    assert graph.item((1, 2)) is second[2]
+    assert graph.done((0, 2)) == [(1, 2)]
+    assert graph.failed((0, 1)) == [(1, 1), (2, 1)]
+    assert graph.done((1, 2)) == [(2, 2)]
+
+
+def test_chunk_sizer():
+    """Size the chunks from the ready items and the item runtimes"""
+    sizer = ChunkSizer(4, 32, 0.5)
+    assert sizer.item_time is None
+    assert [sizer.size(ready) for ready in (0, 3, 100, 1000)] == \
+        [1, 1, 13, 32]
+
+    sizer.observe([])
+    assert sizer.item_time is None
+    sizer.observe([0.05, 0.15])
+    assert sizer.item_time == pytest.approx(0.1)
+    assert sizer.size(1000) == 5
+    sizer.observe([0.2])
+    assert sizer.item_time == pytest.approx(0.13)
+    assert sizer.size(1000) == 3
+    assert sizer.size(8) == 1
+    sizer.observe([60.0])
+    assert sizer.size(1000) == 1
+
+    unbounded = ChunkSizer(4, 32, float("inf"))
+    unbounded.observe([60.0])
+    assert unbounded.size(100) == 13
+
+
+def test_work_queues():
+    """Queue the items by shared input and steal work from other workers"""
+    inputs = {(0, 0): ["a"], (0, 1): ["b"], (0, 2): ["a"], (0, 3): ["c"],
+              (1, 0): ["a"], (1, 1): ["d"]}
+    queues = WorkQueues(2, lambda node: inputs.get(node, []))
+    queues.distribute([(0, 0), (0, 1), (0, 2), (0, 3)])
+    assert len(queues) == 4
+
+    assert queues.take(0, 5) == [(0, 0), (0, 2)]
+    assert queues.take(0, 5) == [(0, 3)]
+    assert len(queues) == 1
+
+    queues.push(1, [(1, 0), (1, 1)])
+    assert queues.take(1, 1) == [(1, 1)]
+    assert queues.take(0, 2, lambda node: node != (1, 0)) == [(0, 1)]
+    assert queues.take(1, 2, lambda node: node != (1, 0)) == []
+    assert queues.take(0, 2) == [(1, 0)]
+    assert len(queues) == 0
+    assert queues.take(1, 2) == []
+
+
+def test_resource_budget():
+    """Admit the chunks that fit in the free memory and threads"""
+    hints = {(0, 0): (600.0, 1), (0, 1): (600.0, 1), (1, 0): (None, 1),
+             (1, 1): (None, 2)}
+    budget = ResourceBudget(1000.0, 2, hints.get)
+    assert budget.fits((1, 1))
+    reserved = budget.acquire([(0, 0), (1, 0)])
+    assert reserved == (600.0, 1)
+    assert not budget.fits((0, 1))
+    assert budget.fits((1, 0))
+    assert not budget.fits((1, 1))
+    queues = WorkQueues(1)
+    queues.distribute([(0, 1), (1, 0), (1, 1)])
+    assert queues.take(0, 2, budget.fits) == [(1, 0)]
+
+    budget.release(reserved)
+    assert budget.fits((1, 1))
+    budget.observe([(0, 0), (0, 1)], [100.0, None])
+    assert budget.need((0, 1)) == (pytest.approx(120.0), 1)
+    assert budget.need((1, 0)) == (0.0, 1)
+    assert ResourceBudget(None, 1, hints.get).need((0, 0)) == (600.0, 1)
@@ -0,0 +1,72 @@
+"""Tests for the binary encoding of jobs and batches"""
+import numpy as np
+import pytest
+
+import scixtracer as sx
+from scixtracer.models import BatchItem
+from scixtracer.models import Batch
+from .scripts_run import wiener_filter
+from .test_index_sqlite import create_index
+
+
+def test_batch_round_trip(tmp_path):
+    """Encode and decode a job and a batch"""
+    job = sx.job(wiener_filter, [{"image": "raw"}, 2.0],
+                 [{"image": "filtered"}])
+    decoded_job = sx.Job.from_bytes(job.to_bytes())
+    assert decoded_job.func is wiener_filter
+    assert decoded_job.inputs == job.inputs
+    assert decoded_job.outputs == job.outputs
+    assert decoded_job.batch_size == 1
+
+    job = sx.job(wiener_filter, [{"image": "raw"}, 2.0],
+                 [{"image": "filtered"}], batch_size=8, unstack=list)
+    decoded_job = sx.Job.from_bytes(job.to_bytes())
+    assert decoded_job.batch_size == 8
+    assert decoded_job.stack is None
+    assert decoded_job.unstack is list
+
+    index, dataset = create_index(tmp_path)
+    raw = index.query_data_single(dataset, {"image": "raw"})
+    counts = index.query_data_single(dataset, {"value": "count"})
+    batch = Batch()
+    for i in range(len(raw)):
+        batch.append(BatchItem(wiener_filter, [raw[i], 2.0, [counts[i]]],
+                               [counts[i]]))
+    batch.append(BatchItem(wiener_filter, [raw], []))
+
+    decoded = Batch.from_bytes(batch.to_bytes())
+    assert len(decoded) == len(batch)
+    item = decoded[0]
+    assert item.func is wiener_filter
+    assert item.inputs[0] == raw[0]
+    assert item.inputs[0].location is raw[0].location
+    assert item.inputs[1] == 2.0
+    assert item.inputs[2] == [counts[0]]
+    assert item.outputs == [counts[0]]
+    assert decoded[-1].inputs[0].uris.tolist() == raw.uris.tolist()
+
+    item = BatchItem.from_bytes(batch[1].to_bytes())
+    assert item.inputs[0] == raw[1]
+
+    with pytest.raises(ValueError):
+        Batch.from_bytes(job.to_bytes())
+
+
+def test_parameter_round_trip(tmp_path):
+    """Keep tuple and numpy parameters apart from the data references"""
+    index, dataset = create_index(tmp_path)
+    raw = index.query_data_single(dataset, {"image": "raw"})
+    params = [(3, 3), (1, 2, 3), ("a", 1), (3,), (raw[0], 2),
+              np.float64(0.5), np.int32(7), np.arange(6.).reshape(2, 3)]
+    batch = Batch()
+    batch.append(BatchItem(wiener_filter, [raw[0], *params], [raw[1]]))
+
+    item = Batch.from_bytes(batch.to_bytes())[0]
+    assert item.inputs[0] == raw[0]
+    assert item.inputs[1:5] == [(3, 3), (1, 2, 3), ("a", 1), (3,)]
+    assert item.inputs[5] == (raw[0], 2)
+    assert type(item.inputs[6]) is np.float64 and item.inputs[6] == 0.5
+    assert type(item.inputs[7]) is np.int32 and item.inputs[7] == 7
+    assert np.array_equal(item.inputs[8], params[-1])
+    assert item.outputs == [raw[1]]